@@ -1,42 +1,114 @@
 import asyncio
 import os
+from functools import partial
+from typing import List
 
 from discord import __version__
 
-from config import BOT_DESC, DISCORD_COGS_PATH, EXCLUDED_COGS, PROJ_CACHE_PATH
+from config import (BOT_DESC, CLUSTER_SUFFIX, DB_BACKEND, DB_FLUSH_INTERVAL,
+                    DB_MAX_BATCH, DB_MAX_WORKERS, DB_REPLICA, DB_REPLICA_PATHS,
+                    DB_SQLITE_PATH, DB_TIMEOUT, DB_WRITE_BEHIND,
+                    DISCORD_COGS_PATH, EXCLUDED_COGS, LAZY_COGS, PROCESSES,
+                    PROJ_CACHE_PATH, SHARD_COUNT, SHARDING, SHARED_CACHE_URL,
+                    TOKEN)
 from log import Logger
 from src.bot import CustomBot
 from src.subsystems.firebase_auth import FirebaseAuth
 from src.subsystems.sys_assets_storage import AssetsStorage
 from src.subsystems.sys_firebase import Database
+from src.subsystems.sys_sqlite import SQLiteBackend
+from src.utils.cluster import Cluster, cancel_on_sigterm, fetch_recommended_shard_count
+from src.utils.cog_manifest import read_cog
+from src.utils.custom_cache import CustomCache
 from src.utils.helper import Helper
+from src.utils.shared_cache import RedisSharedCache
+from src.utils.startup import StartupGraph
 
 
 class Application():
     """ Main application entry point for the bot """
 
-    def __init__(self) -> None:
-        """ Initialize bot and other components of the application """
+    def __init__(self, shard_ids: List[int] = None, shard_count: int = 1) -> None:
+        """ 
+        Plans the startup of the bot and other components of the application.
+        They're created by initialize(), each as soon as what it needs is ready.
+        The bot connects with the given shards (see CustomBot).
+        """
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
         Logger.INFO("Logger initiated")
         Logger.DEBUG(f"discord.py version: {__version__}")
 
+        self.firebase_auth = None
+        self.database = None
+        self.assets_storage = None
+        self.bot = None
+
+        self.startup = StartupGraph()
+        self.startup.add('cache_folder', self._create_cache_folder)
+        self.startup.add('firebase_auth', self._authenticate)
+        # The local database doesn't need Firebase
+        database_depends = ['cache_folder'] + (['firebase_auth'] if DB_BACKEND == "firebase" else [])
+        self.startup.add('database', self._connect_database, depends=database_depends)
+        self.startup.add('assets_storage', self._connect_assets_storage, depends=['firebase_auth'])
+        bot_depends = ['database', 'assets_storage']
+        if SHARED_CACHE_URL:
+            # Without it, caches just aren't shared
+            self.startup.add('shared_cache', self._connect_shared_cache, optional=True)
+            bot_depends.append('shared_cache')
+        self.startup.add('bot', self._create_bot, depends=bot_depends)
+
+    async def initialize(self) -> None:
+        """ Runs the startup steps planned so far, independent ones at the same time """
+        await self.startup.run()
+
+    def _connect_shared_cache(self) -> None:
+        backend = RedisSharedCache(SHARED_CACHE_URL)
+        backend.ping()
+        CustomCache.shared_backend = backend
+        Logger.INFO("Sharing caches through %s", SHARED_CACHE_URL)
+
+    def _create_cache_folder(self) -> None:
+        # Create cache folder for storing local files
+        Helper.mkdir(PROJ_CACHE_PATH)
+        Logger.INFO(f"Created {PROJ_CACHE_PATH}")
+
+    def _authenticate(self) -> None:
         self.firebase_auth = FirebaseAuth()
         Logger.INFO("Authenticated with Google Firebase.")
 
-        self.database = Database()
-        Logger.INFO("Authenticated with Google Realtime Database.")
+    def _connect_database(self) -> None:
+        backend = None
+        if DB_BACKEND == "sqlite":
+            backend = SQLiteBackend(DB_SQLITE_PATH or f"{PROJ_CACHE_PATH}/database.sqlite3")
+
+        self.database = Database(
+            max_workers=DB_MAX_WORKERS,
+            timeout=DB_TIMEOUT,
+            write_behind=DB_WRITE_BEHIND,
+            flush_interval=DB_FLUSH_INTERVAL,
+            max_batch=DB_MAX_BATCH,
+            journal_path=f"{PROJ_CACHE_PATH}/database_journal{CLUSTER_SUFFIX}.jsonl",
+            replica_paths=DB_REPLICA_PATHS if DB_REPLICA else None,
+            snapshot_path=f"{PROJ_CACHE_PATH}/database_replica{CLUSTER_SUFFIX}.json",
+            backend=backend
+        )
+        self.database.start_replica()
+        Logger.INFO(f"Connected to the database ({DB_BACKEND}).")
 
+    def _connect_assets_storage(self) -> None:
         self.assets_storage = AssetsStorage()
         Logger.INFO("Authenticated with Google Cloud Storage.")
 
-        # Create cache folder for storing local files
-        Helper.mkdir(PROJ_CACHE_PATH)
-        Logger.INFO(f"Created {PROJ_CACHE_PATH}")
-
+    async def _create_bot(self) -> None:
+        # On the event loop rather than in a thread, like everything else touching the bot
         self.bot = CustomBot(
             p_description=BOT_DESC,
             database=self.database,
             assets_storage=self.assets_storage,
+            startup=self.startup,
+            shard_ids=self.shard_ids,
+            shard_count=self.shard_count
         )
         Logger.INFO("Running bot")
 
@@ -53,31 +125,66 @@ async def _start_bot(self) -> None:
     async def _close_bot(self) -> None:
         await self.bot.close_bot()
 
-    async def setup_cogs(self) -> None:
+    def setup_cogs(self) -> None:
         """ 
         Sets up cogs by searching and loading folder with cogs files (.py files).
         Source for solution: 
         https://stackoverflow.com/questions/65203363/how-to-load-multiple-cogs-in-python-3
+
+        Each cog is loaded by its own startup step once the bot logs in, so cogs
+        that wait on a service during their setup don't hold up the others.
+
+        With lazy cogs on, cogs without background tasks or slash commands are only
+        read for their commands, and get imported and loaded the first time one is used.
         """
-        if __name__ == '__main__':
-            for filename in os.listdir(DISCORD_COGS_PATH):
-                filename_without_ext = Helper.strip_file_ext(
-                    f"{DISCORD_COGS_PATH}/{filename}")
-                if filename.endswith(".py") and filename_without_ext not in EXCLUDED_COGS:
-                    Logger.DEBUG(f"Now loading cog: {filename}")
-                    cog_file = f"{DISCORD_COGS_PATH}.{filename[:-3]}".lstrip("./").replace(
-                        "/", ".")
-                    await self.bot.load_extension(cog_file)
-                    Logger.DEBUG(f"Loaded cog: {filename}")
+        for filename in os.listdir(DISCORD_COGS_PATH):
+            filename_without_ext = Helper.strip_file_ext(
+                f"{DISCORD_COGS_PATH}/{filename}")
+            if filename.endswith(".py") and filename_without_ext not in EXCLUDED_COGS:
+                Logger.DEBUG(f"Will load cog: {filename}")
+                cog_file = f"{DISCORD_COGS_PATH}.{filename[:-3]}".lstrip("./").replace(
+                    "/", ".")
+                spec = read_cog(f"{DISCORD_COGS_PATH}/{filename}", cog_file) if LAZY_COGS else None
+                if spec is not None and spec.lazy:
+                    self.startup.add(f"cog:{filename[:-3]}",
+                                     partial(self.bot.cog_manager.add_stand_in, spec))
+                else:
+                    self.startup.add(f"cog:{filename[:-3]}",
+                                     partial(self.bot.load_extension, cog_file))
 
 
 # Instead of running the application synchronously, run it asynchronously
 # https://discordpy.readthedocs.io/en/stable/migrating.html#asyncio-event-loop-changes
-async def main():
-    app = Application()
+async def main(shard_ids: List[int] = None, shard_count: int = 1):
+    app = Application(shard_ids, shard_count)
+    await app.initialize()
     bot = app.get_bot()
     async with bot:
-        await app.setup_cogs()
+        app.setup_cogs()
         await bot.start_bot()
 
-asyncio.run(main())
+
+async def _run_worker(shard_ids: List[int], shard_count: int) -> None:
+    cancel_on_sigterm(asyncio.current_task())
+    await main(shard_ids, shard_count)
+
+
+def run_cluster_worker(shard_ids: List[int], shard_count: int) -> None:
+    """ Entry point of each worker process of the cluster """
+    try:
+        asyncio.run(_run_worker(shard_ids, shard_count))
+    except asyncio.CancelledError:
+        # Stopped by the launcher, after closing the bot
+        pass
+
+
+if __name__ == '__main__':
+    if not SHARDING:
+        asyncio.run(main())
+    elif PROCESSES == 1:
+        # One process runs every shard; their number is fetched from Discord if not set
+        asyncio.run(main(shard_count=SHARD_COUNT))
+    else:
+        # Every worker needs the same total to agree on which guild goes to which shard
+        shard_count = SHARD_COUNT or asyncio.run(fetch_recommended_shard_count(TOKEN))
+        Cluster(run_cluster_worker, shard_count, PROCESSES).run()
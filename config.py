@@ -9,11 +9,13 @@
 
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
-GUILD = os.getenv('DISCORD_GUILD')
 
-if not TOKEN or not GUILD:
+if not TOKEN:
     raise Exception(
-        "TOKEN or GUILD not given, please insert your Discord bot token and/or name of your server, please! ")
+        "TOKEN not given, please insert your Discord bot token, please! ")
+
+# Where Twitch notifications go for every guild that didn't pick a channel
+TWITCH_NOTIFICATIONS_CHANNEL_ID = int(os.getenv('TWITCH_NOTIFICATIONS_CHANNEL_ID') or 0) or None
 
 # TODO: Make admin role and staff roles modifiable on the database.
 # Maybe add them to bot_settings so they can be modified via admin.py?
@@ -27,12 +29,44 @@
 
 BOT_ENV = os.getenv('BOT_ENV')
 
+# Set by the cluster launcher in each of its worker processes. Files written by a
+# worker get it as a suffix, so workers don't write to the same files.
+CLUSTER_ID = int(os.getenv('BOT_CLUSTER_ID', 0))
+CLUSTER_SUFFIX = f".{CLUSTER_ID}" if os.getenv('BOT_CLUSTER_ID') is not None else ""
+
+LOG_QUEUE = config.get_log_value("queue") != "False"
+LOG_JSON_PATH = config.get_log_value("json_path")
+if LOG_JSON_PATH and CLUSTER_SUFFIX:
+    root, ext = os.path.splitext(LOG_JSON_PATH)
+    LOG_JSON_PATH = f"{root}{CLUSTER_SUFFIX}{ext}"
+LOG_MAX_BYTES = int(config.get_log_value("max_bytes") or 10 * 1024 * 1024)
+LOG_BACKUP_COUNT = int(config.get_log_value("backup_count") or 5)
+LOG_COMPRESS = config.get_log_value("compress") != "False"
+
 # WRAPAPI_KEY = os.getenv('WRAPAPI_KEY')
 
 # Default database paths
 # TODO: Make them modifiable
 BOT_SETTINGS_PATH = config.get_bot_db_value("bot_settings")
 TWITCH_USERS_PATH = config.get_bot_db_value("twitch_users")
+COMMAND_TREE_PATH = config.get_bot_db_value("command_tree") or "command_tree"
+GUILDS_PATH = config.get_bot_db_value("guilds") or "guilds"
+LEASES_PATH = config.get_bot_db_value("leases") or "leases"
+
+DB_BACKEND = config.get_bot_db_value("backend") or "firebase"
+DB_SQLITE_PATH = config.get_bot_db_value("sqlite_path")
+
+if DB_BACKEND not in ("firebase", "sqlite"):
+    raise ValueError(f"Unknown database backend {DB_BACKEND}, please use firebase or sqlite.")
+
+DB_MAX_WORKERS = int(config.get_bot_db_value("max_workers") or 4)
+DB_TIMEOUT = float(config.get_bot_db_value("timeout") or 10)
+DB_WRITE_BEHIND = config.get_bot_db_value("write_behind") == "True"
+DB_FLUSH_INTERVAL = float(config.get_bot_db_value("flush_interval") or 0.05)
+DB_MAX_BATCH = int(config.get_bot_db_value("max_batch") or 100)
+DB_REPLICA = config.get_bot_db_value("replica") == "True"
+DB_REPLICA_PATHS = (config.get_bot_db_value("replica_paths") or
+                    f"{BOT_SETTINGS_PATH},{TWITCH_USERS_PATH},{GUILDS_PATH}").replace(" ", "").split(",")
 
 TIMEZONE_REGION = config.get_bot_value("timezone")
 
@@ -66,6 +100,29 @@
         "GREETING_USER_IDs is None, please insert at least one Discord user ID.")
 
 EXCLUDED_COGS = (config.get_bot_value("excluded_cogs")).strip().split(",")
+LAZY_COGS = config.get_bot_value("lazy_cogs") == "True"
+
+LEAN_GATEWAY = config.get_bot_value("lean_gateway") == "True"
+MEMBER_CACHE = [flag for flag in (config.get_bot_value("member_cache") or "voice").replace(" ", "").split(",")
+                if flag and flag != "none"]
+MEMBER_INTENT = config.get_bot_value("member_intent") == "True"
+MESSAGE_CONTENT = config.get_bot_value("message_content") != "False"
+SYNC_COMMANDS = config.get_bot_value("sync_commands") == "True"
+
+SHARDING = config.get_bot_value("sharding") == "True"
+SHARD_COUNT = int(config.get_bot_value("shard_count") or 0) or None
+PROCESSES = int(config.get_bot_value("processes") or 1)
+PREFIX_REFRESH = float(config.get_bot_value("prefix_refresh") or 30)
+LEADER_ELECTION = config.get_bot_value("leader_election") == "True"
+LEADER_LEASE = float(config.get_bot_value("leader_lease") or 30)
+LEADER_CLOCK_SKEW = float(config.get_bot_value("leader_clock_skew") or 5)
+SHARED_CACHE_URL = config.get_bot_value("shared_cache")
+MAX_HEAVY_COMMANDS = int(config.get_bot_value("max_heavy_commands") or 8)
+MAX_HEAVY_COMMANDS_PER_GUILD = int(config.get_bot_value("max_heavy_commands_per_guild") or 2)
+MAX_QUEUED_COMMANDS = int(config.get_bot_value("max_queued_commands") or 16)
+
+if PROCESSES > 1 and not SHARDING:
+    raise ValueError("Running the bot in more than one process requires sharding = True.")
 
 BOT_DESC = config.get_bot_value("description")
 
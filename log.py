@@ -1,9 +1,17 @@
+import atexit
+import gzip
+import json
 import logging
+import os
+import shutil
 from enum import Enum
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import SimpleQueue
 
 from discord.ext.commands import Context
 
-from config import BOT_ENV
+from config import (BOT_ENV, LOG_BACKUP_COUNT, LOG_COMPRESS, LOG_JSON_PATH,
+                    LOG_MAX_BYTES, LOG_QUEUE)
 
 
 class _Color(Enum):
@@ -50,12 +58,46 @@ def format(self, record: logging.LogRecord) -> str:
         return f'{color_code}{message}{reset_code}'
 
 
+class _JSONFormatter(logging.Formatter):
+    """ Formats each record as one JSON object, for log collectors """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    """ Compresses a rotated log file """
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
 class _CustomLogger():
-    """ Custom logger that includes color schemes """
+    """ 
+    Custom logger that includes color schemes 
 
-    def __init__(self, name: str = __name__):
+    With use_queue, records are put on a queue and written by a QueueListener's
+    background thread, so the event loop never waits on stdout or a log file.
+    With json_path, records are also written as JSON lines to a file that is
+    rotated at max_bytes, keeping backup_count old files (gzipped if compress).
+    """
+
+    def __init__(self, name: str = __name__, use_queue: bool = LOG_QUEUE,
+                 json_path: str = LOG_JSON_PATH, max_bytes: int = LOG_MAX_BYTES,
+                 backup_count: int = LOG_BACKUP_COUNT, compress: bool = LOG_COMPRESS):
         LOG_LVL = logging.DEBUG if BOT_ENV == 'DEV' else logging.CRITICAL
         self.name = name
+        self.listener = None
 
         # Create logger
         self.logger = logging.getLogger(name)
@@ -63,59 +105,120 @@ def __init__(self, name: str = __name__):
         self.logger.handlers.clear()
         format = "[%(asctime)s] %(levelname)s: %(message)s"
 
-        # Create handler
+        # Create handlers
         handler = logging.StreamHandler()
         handler.setLevel(LOG_LVL)
         handler.setFormatter(_ColoredFormatter(format))
+        handlers = [handler]
+
+        if json_path:
+            os.makedirs(os.path.dirname(json_path) or '.', exist_ok=True)
+            json_handler = RotatingFileHandler(json_path, maxBytes=max_bytes,
+                                               backupCount=backup_count, encoding='utf-8')
+            json_handler.setFormatter(_JSONFormatter())
+            if compress:
+                json_handler.namer = lambda name: f"{name}.gz"
+                json_handler.rotator = _gzip_rotator
+            handlers.append(json_handler)
+
+        if not use_queue:
+            for handler in handlers:
+                self.logger.addHandler(handler)
+            return
+
+        log_queue = SimpleQueue()
+        self.logger.addHandler(QueueHandler(log_queue))
+        self.listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        # Write out whatever is still queued when the bot exits
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        """ Writes out the queued records and stops the background thread """
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def log(self, level: int, message, *args):
+        """ 
+        Logs message at level. Nothing is formatted unless the level is enabled:
+        args are merged into message %-style by logging itself, and a callable
+        message is only called then.
+        """
+        if not self.logger.isEnabledFor(level):
+            return
+        if callable(message):
+            message = message()
+        self.logger.log(level, message, *args)
+
+    def is_enabled_for(self, level: int) -> bool:
+        return self.logger.isEnabledFor(level)
+
+    def debug(self, message, *args):
+        self.log(logging.DEBUG, message, *args)
+
+    def info(self, message, *args):
+        self.log(logging.INFO, message, *args)
+
+    def warning(self, message, *args):
+        self.log(logging.WARNING, message, *args)
+
+    def error(self, message, *args):
+        self.log(logging.ERROR, message, *args)
+
+    def critical(self, message, *args):
+        self.log(logging.CRITICAL, message, *args)
 
-        self.logger.addHandler(handler)
-
-    def debug(self, message):
-        self.logger.debug(message)
-
-    def info(self, message):
-        self.logger.info(message)
 
-    def warning(self, message):
-        self.logger.warning(message)
-
-    def error(self, message):
-        self.logger.error(message)
+class Logger():
+    """ 
+    Interface class that allows logging for the application 
 
-    def critical(self, message):
-        self.logger.critical(message)
+    Messages are only formatted if their level is enabled, as long as they're
+    passed lazily, either %-style or as a callable:
+        Logger.DEBUG("matches: %s", matches)
+        Logger.DEBUG(lambda: f"matches: {matches}")
+    Guard anything else that's expensive with is_enabled_for().
+    """
 
+    _logger = _CustomLogger()
 
-class Logger():
-    """ Interface class that allows logging for the application """
+    @classmethod
+    def stop(cls) -> None:
+        """ Flushes the background logging thread, if there's one """
+        cls._logger.stop()
 
-    _logger = _CustomLogger()
+    @classmethod
+    def is_enabled_for(cls, level: int) -> bool:
+        """ Checks if messages at level (e.g. logging.DEBUG) would be logged """
+        return cls._logger.is_enabled_for(level)
 
     @classmethod
-    def DEBUG(cls, message):
-        cls._logger.debug(message)
+    def DEBUG(cls, message, *args):
+        cls._logger.debug(message, *args)
 
     @classmethod
-    def INFO(cls, message):
-        cls._logger.info(message)
+    def INFO(cls, message, *args):
+        cls._logger.info(message, *args)
 
     @classmethod
-    def WARNING(cls, message):
-        cls._logger.warning(message)
+    def WARNING(cls, message, *args):
+        cls._logger.warning(message, *args)
 
     @classmethod
-    def ERROR(cls, message):
-        cls._logger.error(message)
+    def ERROR(cls, message, *args):
+        cls._logger.error(message, *args)
 
     @classmethod
-    def CRITICAL(cls, message):
-        cls._logger.critical(message)
+    def CRITICAL(cls, message, *args):
+        cls._logger.critical(message, *args)
 
     """ Below are logging functions for messaging the users in Discord directly """
 
     @staticmethod
     async def CTX_ERROR(ctx: Context, message: str) -> None:
-        """ Send error messages to the user """
+        """ Send error messages to the user. They're never replayed by @cached_response. """
+        ctx.cache_response = False
         await ctx.send(f"{ctx.author.mention}: ERROR: {message}")
 
     @staticmethod
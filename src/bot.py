@@ -1,50 +1,164 @@
 import asyncio
+from time import perf_counter
+from typing import List
 
 import discord
 from discord.ext import commands, tasks
 from discord.ext.commands import DefaultHelpCommand
 
-from config import (BOT_SETTINGS_PATH, GREETING_CLIP_PATH, GREETING_ON,
-                    GREETING_USER_IDS, GUILD, MEMBER_JOINS_MSG, STATUS_MSG,
-                    TOKEN)
+from config import (BOT_SETTINGS_PATH, CLUSTER_ID, COMMAND_TREE_PATH,
+                    GREETING_CLIP_PATH, GREETING_ON, GREETING_USER_IDS,
+                    GUILDS_PATH, LEADER_CLOCK_SKEW, LEADER_ELECTION,
+                    LEADER_LEASE, LEAN_GATEWAY, LEASES_PATH, MAX_HEAVY_COMMANDS,
+                    MAX_HEAVY_COMMANDS_PER_GUILD, MAX_QUEUED_COMMANDS,
+                    MEMBER_CACHE, MEMBER_INTENT, MEMBER_JOINS_MSG,
+                    MESSAGE_CONTENT, PREFIX_REFRESH, PROCESSES, STATUS_MSG,
+                    SYNC_COMMANDS, TOKEN, TWITCH_NOTIFICATIONS_CHANNEL_ID)
 from log import Logger
 
+from .managers.cog_manager import CogManager
+from .managers.command_tree_manager import CommandTreeManager
+from .managers.guild_manager import GuildManager
+from .managers.prefix_manager import PrefixManager
 from .managers.voice_manager import VoiceManager
 from .subsystems.sys_assets_storage import AssetsStorage
 from .subsystems.sys_firebase import Database
+from .utils.admission import AdmissionController
+from .utils.command_cache import ResponseCache
+from .utils.gateway import gateway_options
 from .utils.helper import Helper
+from .utils.job_scheduler import JobScheduler
+from .utils.leader_election import (DatabaseLeaseStore, LeaderElection,
+                                    LocalLeaseStore)
+from .utils.message_filter import MessagePrefilter
+from .utils.message_scheduler import MessageScheduler
+from .utils.startup import StartupGraph
 
 
-class CustomBot(commands.Bot):
+class CustomBot(commands.AutoShardedBot):
     """ The heart of the project. """
 
     def __init__(self, p_description: str, database: Database,
-                 assets_storage: AssetsStorage) -> None:
-        """ Create Bot instance """
+                 assets_storage: AssetsStorage, startup: StartupGraph = None,
+                 shard_ids: List[int] = None, shard_count: int = 1) -> None:
+        """ 
+        Create Bot instance. Steps added to startup (e.g. loading cogs) run in
+        setup_hook(), together with the bot's own warmups.
+
+        The bot connects with shard_count shards, or as many as Discord recommends
+        if it's None. With shard_ids, only those shards connect, and the other
+        workers of the cluster run the rest.
+        """
+        self._created_at = perf_counter()
+        self._startup_reported = False
         super().__init__(
             command_prefix=self.get_cmd_prefix,
-            intents=discord.Intents.all(),
             description=p_description,
-            help_command=DefaultHelpCommand()
+            help_command=DefaultHelpCommand(),
+            shard_ids=shard_ids,
+            shard_count=shard_count,
+            **gateway_options(LEAN_GATEWAY, MEMBER_INTENT, MEMBER_CACHE, MESSAGE_CONTENT)
         )
 
         self.database = database
         self.assets_storage = assets_storage
         self.voice_manager = VoiceManager()
+        self.cog_manager = CogManager(self)
+        self.command_tree_manager = CommandTreeManager(database, COMMAND_TREE_PATH)
+        self.prefilter = MessagePrefilter()
+        # Other workers of the cluster can change the prefixes and settings too
+        refresh_after = PREFIX_REFRESH if PROCESSES > 1 else None
+        self.guild_manager = GuildManager(database, GUILDS_PATH,
+                                          default_greeting_user_ids=GREETING_USER_IDS,
+                                          default_notification_channel_id=TWITCH_NOTIFICATIONS_CHANNEL_ID,
+                                          on_change=self._update_prefilter,
+                                          refresh_after=refresh_after)
+        self.prefix_manager = PrefixManager(database, BOT_SETTINGS_PATH,
+                                            on_change=self._update_prefilter,
+                                            refresh_after=refresh_after)
+        self._update_prefilter()
+        self.add_check(self._command_enabled)
+        # Background jobs that must run once across the cluster only run in the leader
+        lease_store = DatabaseLeaseStore(database, LEASES_PATH) if LEADER_ELECTION else LocalLeaseStore()
+        self.leader = LeaderElection(lease_store, 'background_tasks', duration=LEADER_LEASE,
+                                     max_skew=LEADER_CLOCK_SKEW)
+        # Cogs register their background jobs with it rather than running loops of their own
+        self.jobs = JobScheduler(is_leader=lambda: self.leader.is_leader, wait=self.wait_until_ready)
+        self.response_cache = ResponseCache()
+        # Cogs send through it rather than calling send() directly
+        self.scheduler = MessageScheduler()
+        # Heavy commands run through it, see @admitted
+        self.admission = AdmissionController(MAX_HEAVY_COMMANDS, MAX_HEAVY_COMMANDS_PER_GUILD,
+                                             MAX_QUEUED_COMMANDS)
+        self.startup = startup if startup is not None else StartupGraph()
+
+    async def setup_hook(self) -> None:
+        """ 
+        Called once after logging in, before connecting to the gateway. Runs the
+        remaining startup steps concurrently and warms the caches, so the bot
+        doesn't become ready until it can answer from them.
+        """
+        self.prefilter.set_user_id(self.user.id)
+        self.startup.add('recovered_writes', self._flush_recovered_writes)
+        self.startup.add('prefixes', self.prefix_manager.load, depends=['recovered_writes'])
+        self.startup.add('guilds', self.guild_manager.load, depends=['recovered_writes'])
+        self.startup.add('leader_election', self.leader.start, depends=['recovered_writes'])
+        self.startup.add('asset_index', self.assets_storage.warm_index, optional=True)
+        # The tree is global, so only one worker of a cluster syncs it
+        if SYNC_COMMANDS and CLUSTER_ID == 0:
+            # Once every cog has added its slash commands to the tree
+            cogs = [name for name in self.startup.names if name.startswith('cog:')]
+            self.startup.add('command_tree', self._sync_command_tree, depends=cogs, optional=True)
+        await self.startup.run()
+        Logger.INFO(self.startup.report())
+        self.jobs.start()
+
+    async def _sync_command_tree(self) -> None:
+        await self.command_tree_manager.sync(self.tree)
+
+    async def _flush_recovered_writes(self) -> None:
+        # Commit any writes recovered from the journal before reading anything
+        try:
+            await self.database.flush()
+        except Exception as e:
+            Logger.ERROR(f"Could not commit recovered database writes: {e}")
+
+    def _update_prefilter(self, *_) -> None:
+        """ Lets through the default prefix and the prefix of every guild """
+        self.prefilter.set_prefixes(self.prefix_manager.prefixes | self.guild_manager.prefixes)
+
+    def _command_enabled(self, ctx: commands.Context) -> bool:
+        """ Global check: stops commands that the guild turned off """
+        if ctx.guild is None or ctx.command is None:
+            return True
+        name = (ctx.command.root_parent or ctx.command).qualified_name
+        if not self.guild_manager.is_enabled(ctx.guild.id, name):
+            raise commands.DisabledCommand(f"{name} is turned off in this server.")
+        return True
 
     async def on_ready(self) -> None:
         """ 
         Called when bot is done preparing data received from Discord. 
         May want to read more into this: https://discordpy.readthedocs.io/en/stable/api.html#discord.on_ready
         """
-        guild = discord.utils.get(self.guilds, name=GUILD)
-        members = '\n - '.join([member.name + ' (id: ' +
-                               str(member.id) + ')' for member in guild.members])
-
-        Logger.INFO(
-            f'{self.user} is connected to the following server / guild:')
-        Logger.INFO(f'{guild.name} (id: {guild.id})')
-        Logger.INFO(f'Server Members:\n - {members}')
+        Logger.INFO("%s is ready with shard(s) %s of %s", self.user,
+                    ', '.join(str(shard_id) for shard_id in sorted(self.shards)), self.shard_count)
+        Logger.INFO(f'{self.user} is connected to {len(self.guilds)} server(s) / guild(s)')
+        Logger.DEBUG(lambda: 'Servers:\n - ' + '\n - '.join(
+            f'{guild.name} (id: {guild.id}, {guild.member_count} members)' for guild in self.guilds))
+        self._report_startup()
+
+    def _report_startup(self) -> None:
+        """ Logs how long the bot took to get ready and its peak memory, once """
+        if self._startup_reported:
+            return
+        self._startup_reported = True
+        rss = Helper.get_peak_rss_mb()
+        Logger.INFO("Ready in %.2fs, peak RSS: %s (%s gateway, %d members cached)",
+                    perf_counter() - self._created_at,
+                    f"{rss:.1f} MB" if rss is not None else "unknown",
+                    "lean" if LEAN_GATEWAY else "full",
+                    len(self.users))
 
     @tasks.loop(count=1)
     async def _wait_until_ready(self):
@@ -73,26 +187,44 @@ async def start_bot(self) -> None:
         await self.start(TOKEN)
 
     async def close_bot(self) -> None:
-        """ Closes the bot """
+        """ Closes the bot, committing any queued database writes """
         await self.close()
 
+    async def add_cog(self, cog: commands.Cog, **kwargs) -> None:
+        """ Adds a cog, in place of its stand-in if it was loaded lazily """
+        await self.cog_manager.replace_stand_in(cog)
+        await super().add_cog(cog, **kwargs)
+
+    async def close(self) -> None:
+        """ 
+        Stops the background jobs, closes the connection to Discord, hands over the
+        lead, then closes the database
+        """
+        await self.jobs.stop()
+        await super().close()
+        await self.leader.stop()
+        await self.database.close()
+
     async def on_message(self, message: discord.Message):
-        """ Responds with a friendly message if a user mentions the bot. """
-        for x in message.mentions:
-            if x == self.user:
-                await message.channel.send("What?")
+        """ 
+        Responds with a friendly message if a user mentions the bot. Messages that
+        can't be commands are dropped by the prefilter before any command processing.
+        """
+        mentioned = self.user in message.mentions
+        if not self.prefilter.check(message.content, is_bot=message.author.bot,
+                                    mentioned=mentioned):
+            return
+        if mentioned:
+            await message.channel.send("What?")
         await self.process_commands(message)
 
     async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState,
                                     after: discord.VoiceState) -> None:
         """ 
-        The bot will greet these two specific users down below whenever they
-        join a VC in a server. :D 
+        The bot will greet the users chosen by the server (or the ones in the
+        config) whenever they join a VC in it. :D 
         """
-        # TODO: Maybe store the constants below in the database and rewrite
-        # this system to include anyone, rather than specific people. Then, maybe
-        # play certain audio clips for certain people. Moreover, have this feature
-        # have option to turn on or off
+        # TODO: Maybe play certain audio clips for certain people
 
         if not GREETING_ON or not GREETING_CLIP_PATH:
             Logger.DEBUG("Not greeting anyone that joined a voice channel!")
@@ -111,7 +243,7 @@ async def on_voice_state_update(self, member: discord.Member, before: discord.Vo
         # greet only once after joining a voice channel. If they choose to join another voice
         # channel in the server, the bot will not follow them around.
         if before.channel is None and after.channel is not None:
-            if str(member.id) in GREETING_USER_IDS:
+            if str(member.id) in self.guild_manager.greeting_user_ids(member.guild.id):
                 await asyncio.sleep(0.5)
 
                 greeting_audio_name = Helper.get_name(GREETING_CLIP_PATH)
@@ -121,7 +253,7 @@ async def on_voice_state_update(self, member: discord.Member, before: discord.Vo
                     Logger.ERROR(f"Cannot play file `{greeting_audio_name}`!")
                     return
 
-                voice = discord.utils.get(self.voice_clients)
+                voice = member.guild.voice_client
                 await self.voice_manager.join_channel_and_play_clip(
                     voice, channel, self.assets_storage.audio_file_path)
                 self.assets_storage.remove_audio_file()
@@ -172,6 +304,9 @@ async def on_command_error(self, ctx: commands.Context, error: commands.CommandE
         elif isinstance(error, commands.errors.CommandNotFound):
             await ctx.send(f"{author}: I can't find any command with that name.")
 
+        elif isinstance(error, commands.DisabledCommand):
+            await ctx.send(f"{author}: {error}")
+
         elif isinstance(error, commands.errors.CheckFailure):
             pass
 
@@ -194,31 +329,14 @@ async def get_cmd_prefix(self, bot: commands.Bot, message: discord.Message) -> s
         prefixes. Read the first paragraph in the provided link below:
         https://discordpy.readthedocs.io/en/latest/ext/commands/api.html#discord.ext.commands.Bot.command_prefix
 
-        If command prefix is not available in the database, the function will create one and add
-        it into the database.
+        Prefixes are resolved from memory: the guild's own, or else the default one.
+        The database is only read again if the previous attempt to load them failed
+        and its retry period is over. Mentioning the bot also works as a prefix.
         """
-        try:
-            data = self.database.read(BOT_SETTINGS_PATH)
-            for key in data:
-                prefix = data[key]['cmd_prefix']
-            Logger.DEBUG(f"Successfully retrieved command prefix: {prefix}")
-            return prefix
-        except Exception as e:
-            func_name = Helper.get_func_name()
-            Logger.DEBUG(f"Catching error in {func_name}: {e}")
-            default_prefix = '>'
-            Logger.DEBUG("No command prefixes found!")
-            Logger.DEBUG(f"Creating default command prefix: {default_prefix}")
-            await self.create_cmd_prefix(BOT_SETTINGS_PATH, default_prefix)
-            return default_prefix
-
-    async def create_cmd_prefix(self, path: str, cmd_prefix: str = '>'):
-        """ Create command prefix if not available. """
-        try:
-            self.database.add(path, {
-                'cmd_prefix': cmd_prefix
-            })
-            Logger.DEBUG(f"Added {cmd_prefix} to the database!")
-        except Exception as e:
-            Logger.CRITICAL("Could not create command prefix!")
-            Logger.CRITICAL(str(e))
+        if self.prefix_manager.needs_reload():
+            await self.prefix_manager.load()
+        if self.guild_manager.needs_reload():
+            await self.guild_manager.load()
+        guild_id = message.guild.id if message.guild else None
+        prefix = self.guild_manager.get_prefix(guild_id) or self.prefix_manager.get_prefix(guild_id)
+        return commands.when_mentioned_or(prefix)(bot, message)
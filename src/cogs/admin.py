@@ -1,16 +1,19 @@
+import asyncio
+from datetime import datetime
 from io import BytesIO
 
 import aiohttp
 import discord
 from discord.ext import commands
-from PIL import Image
 
-from config import ADMIN_ROLE, BOT_SETTINGS_PATH
+from config import ADMIN_ROLE, TIMEZONE
 from log import Logger
 
 from ..bot import CustomBot
 from ..utils.helper import Helper
 from ..utils.http_utils import HTTPClient
+from ..utils.message_scheduler import INTERACTIVE
+from ..utils.single_flight import SingleFlight
 
 
 class Admin(commands.Cog):
@@ -22,21 +25,119 @@ def __init__(self, bot: CustomBot):
         self.assets_storage = self.bot.assets_storage
 
     @commands.command(name='setprefix', aliases=['changeprefix', 'change_prefix', 'changePrefix'], 
-                      help='Change prefix for commands.')
-    @commands.is_owner()
+                      help='Change prefix for commands in this server.')
+    @commands.check_any(commands.is_owner(), commands.has_guild_permissions(manage_guild=True))
     @commands.guild_only()
     async def change_cmd_prefix(self, ctx: commands.Context, new_cmd_prefix: str):
-        """ Change command prefix (ex. '>' or '!') """
+        """ Change command prefix of the server (ex. '>' or '!') """
         if len(new_cmd_prefix) > 1:
             await Logger.CTX_ERROR(ctx, "Prefix must be a single character!")
             return
-        data = self.database.read(BOT_SETTINGS_PATH)
-        for key in data:
-            self.database.update(BOT_SETTINGS_PATH, {
-                key: {'cmd_prefix': new_cmd_prefix}
-            })
-            await Logger.CTX_SUCCESS(ctx, f"Changed command prefix to `{new_cmd_prefix}`")
-            break
+        await self.bot.guild_manager.set_prefix(ctx.guild.id, new_cmd_prefix)
+        # Cached responses may mention the old prefix
+        self.bot.response_cache.invalidate()
+        await Logger.CTX_SUCCESS(ctx, f"Changed command prefix to `{new_cmd_prefix}`")
+
+    @commands.command(name='setdefaultprefix', help='Change prefix for commands in servers without their own.')
+    @commands.is_owner()
+    async def change_default_cmd_prefix(self, ctx: commands.Context, new_cmd_prefix: str):
+        """ Change the command prefix used by servers that didn't set one """
+        if len(new_cmd_prefix) > 1:
+            await Logger.CTX_ERROR(ctx, "Prefix must be a single character!")
+            return
+        await self.bot.prefix_manager.set_prefix(new_cmd_prefix)
+        self.bot.response_cache.invalidate()
+        await Logger.CTX_SUCCESS(ctx, f"Changed default command prefix to `{new_cmd_prefix}`")
+
+    @commands.command(name='toggle', help='Turn a command on or off in this server.')
+    @commands.check_any(commands.is_owner(), commands.has_guild_permissions(manage_guild=True))
+    @commands.guild_only()
+    async def toggle_command(self, ctx: commands.Context, command_name: str):
+        """ Turns a command off in the server, or back on if it's off """
+        command = self.bot.get_command(command_name)
+        if command is None:
+            await Logger.CTX_ERROR(ctx, f"There's no command called `{command_name}`!")
+            return
+        name = (command.root_parent or command).qualified_name
+        if name == ctx.command.qualified_name:
+            await Logger.CTX_ERROR(ctx, "This command can't be turned off!")
+            return
+        enabled = not self.bot.guild_manager.is_enabled(ctx.guild.id, name)
+        await self.bot.guild_manager.set_command_enabled(ctx.guild.id, name, enabled)
+        await Logger.CTX_SUCCESS(ctx, f"Turned `{name}` {'on' if enabled else 'off'} in this server")
+
+    @commands.command(name='greet', help='Choose whether the bot greets a member joining a voice channel.')
+    @commands.check_any(commands.is_owner(), commands.has_guild_permissions(manage_guild=True))
+    @commands.guild_only()
+    async def toggle_greeting(self, ctx: commands.Context, member: discord.Member):
+        """ Adds a member to the server's greeted users, or removes them if they're in it """
+        user_ids = set(self.bot.guild_manager.greeting_user_ids(ctx.guild.id))
+        greeted = str(member.id) not in user_ids
+        if greeted:
+            user_ids.add(str(member.id))
+        else:
+            user_ids.discard(str(member.id))
+        await self.bot.guild_manager.set_greeting_user_ids(ctx.guild.id, user_ids)
+        await Logger.CTX_SUCCESS(ctx, f"{'Will' if greeted else 'Will no longer'} greet {member.display_name}")
+
+    @commands.command(name='prefilter', help='Shows how many messages skipped command processing.')
+    @commands.is_owner()
+    async def prefilter_stats(self, ctx: commands.Context):
+        """ Shows the counters of the message prefilter """
+        stats = self.bot.prefilter.stats
+        await Logger.CTX_INFO(ctx, f"Checked `{stats['checked']}` messages, skipped `{stats['skipped']}` " +
+                              f"and passed `{stats['passed']}` on to command processing.")
+
+    @commands.command(name='flights', help='Shows how many outbound calls were merged.')
+    @commands.is_owner()
+    async def single_flight_stats(self, ctx: commands.Context):
+        """ Shows the counters of every named SingleFlight """
+        lines = [f"{name}: {flight.calls} call(s) made, {flight.merged} merged"
+                 for name, flight in sorted(SingleFlight.registry.items())]
+        await Logger.CTX_INFO(ctx, "```" + ("\n".join(lines) or "No calls yet") + "```")
+
+    @commands.command(name='sendq', help='Shows how outgoing messages are queued.')
+    @commands.is_owner()
+    async def scheduler_stats(self, ctx: commands.Context):
+        """ Shows the counters of the message scheduler """
+        stats = self.bot.scheduler.stats
+        await Logger.CTX_INFO(ctx, f"`{stats['queued']}` queued, `{stats['sent']}` sent " +
+                              f"(`{stats['merged']}` merged into others), waited " +
+                              f"`{stats['avg_wait_ms']:.0f}` ms on average and `{stats['max_wait_ms']:.0f}` ms at most.")
+
+    @commands.command(name='admission', help='Shows how many heavy commands ran, waited or were turned away.')
+    @commands.is_owner()
+    async def admission_stats(self, ctx: commands.Context):
+        """ Shows the counters of the admission controller """
+        stats = self.bot.admission.stats
+        await Logger.CTX_INFO(ctx, f"`{stats['running']}` running, `{stats['waiting']}` waiting, " +
+                              f"`{stats['admitted']}` admitted and `{stats['rejected']}` turned away. " +
+                              f"Queued commands waited `{stats['avg_wait_ms']:.0f}` ms on average " +
+                              f"and `{stats['max_wait_ms']:.0f}` ms at most.")
+
+    @commands.command(name='jobs', help='Shows how the background jobs ran, or the last runs of one job.')
+    @commands.is_owner()
+    async def job_stats(self, ctx: commands.Context, job_name: str = None):
+        """ Shows the counters of every background job, or the recent runs of one """
+        jobs = self.bot.jobs.jobs
+        if job_name is None:
+            lines = []
+            for name, job in sorted(jobs.items()):
+                stats = job.stats
+                state = 'running' if job.running else 'idle'
+                lines.append(f"{name} ({state}): {stats['runs']} runs, {stats['failures']} failed " +
+                             f"({stats['timeouts']} timed out), {stats['skipped']} skipped, " +
+                             f"{stats['overruns']} overran, avg {stats['avg_ms']:.0f} ms, " +
+                             f"max {stats['max_ms']:.0f} ms")
+            await Logger.CTX_INFO(ctx, "```" + ("\n".join(lines) or "No jobs") + "```")
+            return
+        job = jobs.get(job_name)
+        if job is None:
+            await Logger.CTX_ERROR(ctx, f"There's no job named `{job_name}`.")
+            return
+        lines = [f"{datetime.fromtimestamp(run.started_at, tz=TIMEZONE):%Y-%m-%d %H:%M:%S} " +
+                 f"{run.duration * 1000:.0f} ms {run.error or 'ok'}" for run in reversed(job.history)]
+        await Logger.CTX_INFO(ctx, "```" + ("\n".join(lines) or "No runs yet") + "```")
 
     ###################################################
     # The following commands are derived from Alex Flipnote:
@@ -68,6 +169,8 @@ async def change_avatar(self, ctx: commands.Context, url: str = None):
         try:
             Logger.DEBUG(f"url: {url}")
             func_name = Helper.get_func_name()
+            # Pillow is only needed here, so it's imported on first use
+            from PIL import Image
             async with HTTPClient(loop=self.bot.loop, name=func_name) as session:
                 async with session.get(url) as r:
                     img = Image.open(BytesIO(await r.read()), mode='r')
@@ -84,11 +187,12 @@ async def change_avatar(self, ctx: commands.Context, url: str = None):
     async def dm(self, ctx: commands.Context, user: discord.User, *, message: str):
         """ DM the user of your choice """
         try:
-            await user.send(message)
-            await ctx.author.send(f"✉️ Succesfully sent a fan letter to **{user}**!")
-            await ctx.author.send(f"Contents of messsage: {message}")
+            await self.bot.scheduler.send(user, message)
+            await asyncio.gather(
+                self.bot.scheduler.submit(ctx.author, f"✉️ Succesfully sent a fan letter to **{user}**!"),
+                self.bot.scheduler.submit(ctx.author, f"Contents of messsage: {message}"))
             # Delete the message after issuing the command 
-            await ctx.message.delete()
+            await self.bot.scheduler.delete(ctx.message, INTERACTIVE)
         except discord.Forbidden:
             await Logger.CTX_ERROR(ctx, "This user might have their DMs blocked or it's a bot account.")
 
@@ -217,6 +321,7 @@ async def upload_file(self, ctx: commands.Context):
                     await Logger.CTX_ERROR(ctx, f"Something went wrong with uploading {attachment_name}! Aw man.")
                     return
                 Logger.DEBUG(f"Uploaded {attachment_name}")
+                self.bot.response_cache.invalidate('getobjs', 'getdirs')
         await Logger.CTX_SUCCESS(ctx, "Uploaded all attachments to cloud!")
 
     # async def delete_file(self, ctx):
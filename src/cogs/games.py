@@ -1,5 +1,6 @@
 import random
 
+from discord import app_commands
 from discord.ext import commands
 
 from log import Logger
@@ -13,7 +14,8 @@ class Games(commands.Cog):
     def __init__(self, bot: CustomBot):
         self.bot = bot
 
-    @commands.command(help="Rolls the dice, ranging from either 1 to some target number.")
+    @commands.hybrid_command(help="Rolls the dice, ranging from either 1 to some target number.")
+    @app_commands.describe(target="The highest number that can be rolled")
     async def rtd(self, ctx: commands.Context, target: int = 10):
         """ 
         Rolls the dice and randomly generates a number from start to some target number. 
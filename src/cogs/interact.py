@@ -1,3 +1,5 @@
+import asyncio
+
 import discord
 from discord.ext import commands
 
@@ -14,8 +16,8 @@ def __init__(self, bot: CustomBot):
     @commands.command(aliases=['spamming'], help="Spam someone :D", hidden=True)
     @commands.is_owner()
     async def spam(self, ctx: commands.Context, player: discord.Member = None, nums: int = 5):
-        for i in range(nums):
-            await ctx.send(player.mention)
+        # Queued all at once, so they go out merged into as few messages as possible
+        await asyncio.gather(*(self.bot.scheduler.submit(ctx, player.mention) for _ in range(nums)))
 
 
 async def setup(bot: CustomBot):
@@ -4,7 +4,9 @@
 import datetime
 import os
 import random
+from typing import Tuple
 
+from discord import app_commands
 from discord.ext import commands
 from riotwatcher import LolWatcher
 
@@ -12,8 +14,12 @@
 from log import Logger
 
 from ..bot import CustomBot
-from ..utils.helper import Helper, JSONHelper
+from ..utils.admission import admitted
+from ..utils.command_cache import cached_response
+from ..utils.custom_cache import CustomCache
+from ..utils.helper import Helper
 from ..utils.http_utils import HTTPClient
+from ..utils.single_flight import SingleFlight
 
 # Maps the player to their respective roles
 # (lane, role): player role
@@ -37,10 +43,13 @@ def __init__(self, region: str = 'na1') -> None:
         self.DATA_DRAGON_URL = "https://ddragon.leagueoflegends.com"
         self.VERSION_URL = f"{self.DATA_DRAGON_URL}/api/versions.json"
         self.LANGUAGES_URL = f"{self.DATA_DRAGON_URL}/cdn/languages.json"
+        # Identical requests made at the same time share one call to the API
+        self.flight = SingleFlight(__class__.__name__)
 
     def get_summoner(self, name: str):
         """ Get the summoner given the name """
-        return self.watcher.summoner.by_name(region=self.region, summoner_name=name)
+        return self.flight.do(('summoner', self.region, name), self.watcher.summoner.by_name,
+                              region=self.region, summoner_name=name)
 
     def get_puuid(self, summoner) -> str:
         """ Get the PUUID of the summoner """
@@ -58,7 +67,9 @@ def get_matches_with_puuid(self, player_puuid: str, queue: int = 420, count: int
         """
         # TODO: Allow multiple queue types and return a collection of matches with different
         # queue types.
-        return self.watcher.match.matchlist_by_puuid(
+        return self.flight.do(
+            ('matchlist', self.region, player_puuid, queue, count),
+            self.watcher.match.matchlist_by_puuid,
             region=self.region,
             puuid=player_puuid,
             queue=queue,
@@ -66,14 +77,22 @@ def get_matches_with_puuid(self, player_puuid: str, queue: int = 420, count: int
         )
 
     def get_match_by_match_id(self, match_id: str):
-        return self.watcher.match.by_id(region=self.region, match_id=match_id)
+        return self.flight.do(('match', self.region, match_id), self.watcher.match.by_id,
+                              region=self.region, match_id=match_id)
 
     def get_current_champion_list(self, want_full: bool = False):
+        return self.flight.do(('champions', self.region, want_full),
+                              self._get_current_champion_list, want_full)
+
+    def _get_current_champion_list(self, want_full: bool = False):
         versions = self.watcher.data_dragon.versions_for_region(self.region)
         champion_verison = versions['n']['champion']
         return self.watcher.data_dragon.champions(champion_verison, full=want_full)
 
     def get_summoner_data(self, name: str):
+        return self.flight.do(('summoner_data', self.region, name), self._get_summoner_data, name)
+
+    def _get_summoner_data(self, name: str):
         return self.watcher.league.by_summoner(
             self.region,
             self.get_summoner(name=name)['id']
@@ -86,16 +105,28 @@ class League(commands.Cog):
     def __init__(self, bot: CustomBot):
         self.bot = bot
         self.watcher = LeagueAPI()
-        self.league_cache = f"{PROJ_CACHE_PATH}/{__class__.__name__}"
-        self.CHAMPIONS_PATH = f"{self.league_cache}/champion.json"
         # self.patch.start()
 
+    async def cog_load(self) -> None:
+        """ 
+        Downloads the champion list while the bot starts, for the first unbox. A cog
+        loaded after that (lazily) leaves it to the first unbox.
+        """
+        if not self.bot.is_ready() and 'data_dragon' not in self.bot.startup:
+            self.bot.startup.add('data_dragon', self._get_champions, optional=True)
+
+    # A new version comes out every few weeks, so an old one is fine while it's refreshed
+    @CustomCache(maxsize=1, ttl=3600, stale_ttl=86400, key=lambda self: 'version',
+                 shared=True, name='league_version')
     async def _get_version(self):
         """ 
         Returns the current version of League of Legends.
         Example response (source: https://ddragon.leagueoflegends.com/api/versions.json):
         [ "13.9.1", "13.8.1", "13.7.1", ...]
         """
+        return await self.watcher.flight.do_async(self.watcher.VERSION_URL, self._fetch_version)
+
+    async def _fetch_version(self):
         async with HTTPClient(loop=self.bot.loop, name=Helper.get_func_name()) as session:
             data = await session.get(self.watcher.VERSION_URL)
             data = await data.json()
@@ -103,38 +134,70 @@ async def _get_version(self):
         version = data[0]
         return version if version is not None else None
 
+    @CustomCache(maxsize=16, ttl=86400, stale_ttl=86400, key=lambda self, specified_lang: specified_lang,
+                 shared=True, name='league_language')
     async def _get_language(self, specified_lang: str):
         """ 
         Returns a language specified in the JSON response.
         See full list here:
         https://developer.riotgames.com/docs/lol#data-dragon_languages
         """
-        async with HTTPClient(loop=self.bot.loop, name=Helper.get_func_name()) as session:
-            Logger.DEBUG("Beginning to retrieve lang data...")
-            data = await session.get(self.watcher.LANGUAGES_URL)
-            data = await data.json()
+        data = await self.watcher.flight.do_async(self.watcher.LANGUAGES_URL, self._fetch_languages)
         Logger.DEBUG("Got language!")
         for lang in data:
             if specified_lang == lang:
                 return lang
         return None
 
+    async def _fetch_languages(self) -> list:
+        async with HTTPClient(loop=self.bot.loop, name=Helper.get_func_name()) as session:
+            Logger.DEBUG("Beginning to retrieve lang data...")
+            data = await session.get(self.watcher.LANGUAGES_URL)
+            return await data.json()
+
+    # Data Dragon URLs contain the version, so their data never changes. It's kept
+    # on disk too, which saves downloading the large champion list after a restart.
+    @CustomCache(maxsize=32, ttl=7 * 86400, key=lambda self, url: url,
+                 disk_path=f"{PROJ_CACHE_PATH}/League", disk_maxsize=500,
+                 shared=True, name='league_data_dragon')
+    async def _get_data_dragon_json(self, url: str) -> dict:
+        async with HTTPClient(loop=self.bot.loop, name=Helper.get_func_name()) as session:
+            res = await session.get(url)
+            return await res.json()
+
+    async def _get_champions(self) -> Tuple[str, str, dict]:
+        """ Gets the current version, the language and the champion list from Data Dragon """
+        version = await self._get_version()
+        lang = await self._get_language(specified_lang="en_US")
+        CHAMPS_URL = self.watcher.DATA_DRAGON_URL + \
+            f"/cdn/{version}/data/{lang}/champion.json"
+        Logger.DEBUG("URL to champion JSON file: %s", CHAMPS_URL)
+        return version, lang, await self._get_data_dragon_json(CHAMPS_URL)
+
     @commands.cooldown(1.0, 5.0, commands.BucketType.guild)
-    @commands.command(brief="Displays basic stats from League.", description="Displays basic stats from League. \n\nNote that the region is set to NA." +
-                      " This does not support other regions at the moment.\n\nIn the usage below, also note that [args...] enables this command to accept names with spaces.\n\n" +
-                      ">stats only records ranked data! This command is useful for those who usually play ranked.")
-    async def stats(self, ctx: commands.Context, summoner: str, *args) -> None:
+    @commands.hybrid_command(brief="Displays basic stats from League.", description="Displays basic stats from League.",
+                             help="Note that the region is set to NA. This does not support other regions at the moment.\n\n" +
+                             "The summoner's name can contain spaces.\n\n" +
+                             ">stats only records ranked data! This command is useful for those who usually play ranked.")
+    @app_commands.describe(summoner="The summoner's name")
+    @cached_response(ttl=60, ignore_case=True)
+    async def stats(self, ctx: commands.Context, *, summoner: str) -> None:
         """ Function that displays stats on League. """
-        full_name = Helper.combine_strings(args, summoner)
-        Logger.DEBUG(f"Gathering stats on player {full_name}...")
+        # The name can contain spaces; as the last parameter, it takes the rest of the message
+        full_name = summoner
+        # Riot can take longer than the 3 seconds a slash command has to respond
+        await ctx.defer()
+        Logger.DEBUG("Gathering stats on player %s...", full_name)
         # Example output:
         # {'leagueId': '64de6776-701d-3731-9884-9f22c07f5e6b', 'queueType': 'RANKED_SOLO_5x5', 'tier': 'MASTER', 'rank': 'I',
         # 'summonerId': 'NTT0wwspSKfXamq451ReBqRSLr_mqWZuKOtvcC8t65sV5kA', 'summonerName': 'Doublelift', 'leaguePoints': 336,
         # 'wins': 88, 'losses': 91, 'veteran': False, 'inactive': False, 'freshBlood': False, 'hotStreak': False}
-        summoner_data = self.watcher.get_summoner_data(full_name)[0]
+        summoner_data = (await Helper.run_in_thread(self.watcher.get_summoner_data, full_name))[0]
         Logger.DEBUG(summoner_data)
 
         if len(summoner_data) == 0 or summoner_data is None:
+            # The summoner may play ranked any time
+            ctx.cache_response = False
             await ctx.send(f"No data available for {full_name}")
             return
 
@@ -151,19 +214,21 @@ async def stats(self, ctx: commands.Context, summoner: str, *args) -> None:
         )
 
     @commands.cooldown(5.0, 10.0, commands.BucketType.guild)
-    @commands.command(brief="Pulls data from 10 recent League of Legends (normal/ranked) games.", description="Pulls data from 10 recent League of Legends (normal/ranked) games.\n\nNote that the region is set to NA." +
-                      " This does not support other regions at the moment.\n\nIn the usage below, also note that [args...] enables this command to accept names with spaces.")
-    async def matches(self, ctx: commands.Context, summoner: str, *args) -> None:
-        summoner_name = Helper.combine_strings(args, summoner)
-        summoner_info = self.watcher.get_summoner(summoner_name)
+    @commands.hybrid_command(brief="Pulls data from 10 recent League of Legends (normal/ranked) games.", description="Pulls data from 10 recent League of Legends (normal/ranked) games.",
+                             help="Note that the region is set to NA. This does not support other regions at the moment.\n\n" +
+                             "The summoner's name can contain spaces.")
+    @app_commands.describe(summoner="The summoner's name")
+    @admitted(limit=2)
+    async def matches(self, ctx: commands.Context, *, summoner: str) -> None:
+        summoner_name = summoner
+        summoner_info = await Helper.run_in_thread(self.watcher.get_summoner, summoner_name)
         player_puuid = self.watcher.get_puuid(summoner_info)
-        matches = self.watcher.get_matches_with_puuid(
-            player_puuid=player_puuid)
+        matches = await Helper.run_in_thread(self.watcher.get_matches_with_puuid,
+                                             player_puuid=player_puuid)
 
         Logger.INFO(f"Activating {__name__}")
-        Logger.DEBUG(
-            f"summoner: {summoner_name} | summoner PUUID: {summoner_info}")
-        Logger.DEBUG(f"matches: {matches}")
+        Logger.DEBUG("summoner: %s | summoner PUUID: %s", summoner_name, summoner_info)
+        Logger.DEBUG("matches: %s", matches)
 
         # This will be deleted later after the data is loaded
         loading = await ctx.send(f'Loading summoner {summoner_name}...')
@@ -174,16 +239,16 @@ async def matches(self, ctx: commands.Context, summoner: str, *args) -> None:
 
         # Iterate through each match
         for match_id in matches:
-            player_match_data = self.watcher.get_match_by_match_id(match_id)
+            player_match_data = await Helper.run_in_thread(self.watcher.get_match_by_match_id, match_id)
             match_info = player_match_data["info"]
 
             # Get the participant's data if their PUUID matches in the data
             player_data = next((item for item in match_info["participants"] if item.get(
                 "puuid") == player_puuid), None)
             if player_data is None:
-                Logger.DEBUG(f"Match data for {summoner_name} was not found!")
+                Logger.DEBUG("Match data for %s was not found!", summoner_name)
 
-            Logger.DEBUG(f"player_data: {player_data}")
+            Logger.DEBUG("player_data: %s", player_data)
 
             # Set up a dictionary to store the player's information during that
             # match and append it to "data" list
@@ -208,7 +273,7 @@ async def matches(self, ctx: commands.Context, summoner: str, *args) -> None:
             if len(tmp.keys()) != 0:
                 data.append(tmp)
 
-        Logger.DEBUG(f"tmp: {data}")
+        Logger.DEBUG("tmp: %s", data)
 
         # Combine each match's stats into one string and send it to the user
         player_stats = ''
@@ -246,7 +311,8 @@ async def matches(self, ctx: commands.Context, summoner: str, *args) -> None:
                               f'Total KDA (across these matches): {kda}\n' +
                               '```')
 
-    # TODO: Rework the patch notes posting automation some time later
+    # TODO: Rework the patch notes posting automation some time later, as a job
+    # registered with self.bot.jobs in cog_load() rather than a loop of its own
     # @tasks.loop(hours=1.0)
     # async def patch(self):
     #     from bs4 import BeautifulSoup
@@ -355,69 +421,34 @@ async def matches(self, ctx: commands.Context, summoner: str, *args) -> None:
         # self.patch.cancel()
 
     @commands.cooldown(5.0, 10.0, commands.BucketType.guild)
-    @commands.command(aliases=["unboxing"], brief="Randomly unboxes a skin.", description="Randomly unboxes a skin.")
+    @commands.hybrid_command(aliases=["unboxing"], brief="Randomly unboxes a skin.", description="Randomly unboxes a skin.")
+    @admitted(limit=4)
     async def unbox(self, ctx: commands.Context) -> None:
         """ 
         Simulates Hextech Chest unboxing from League. 
         It only outputs skins, not essence or anything else at the moment. 
         """
-        champions_data = None
-        version = await self._get_version()
-        lang = await self._get_language(specified_lang="en_US")
-        CHAMPS_URL = self.watcher.DATA_DRAGON_URL + \
-            f"/cdn/{version}/data/{lang}/champion.json"
-        Logger.DEBUG(f"URL to champion JSON file: {CHAMPS_URL}")
-        async with HTTPClient(loop=self.bot.loop, name=Helper.get_func_name()) as session:
-            res = await session.get(CHAMPS_URL)
-            res = await res.json()
-
-        Helper.mkdir(self.league_cache)
-
-        # Use the cached response instead if it exists. Else, create one
-        # and cache it.
-        if Helper.path_contains_valid_file(self.CHAMPIONS_PATH):
-            Logger.DEBUG(
-                f"Path {self.CHAMPIONS_PATH} exists! Retrieving cached response...")
-            champions_data = JSONHelper.get_json_as_dict(self.CHAMPIONS_PATH)
-
-            # TODO: Make a task to routinely update the cached champions list every day.
-            # That way, this would reduce need to fetch res every time this command is called.
-            if res['version'] != champions_data['version']:
-                Logger.DEBUG(f"{res['version']}, {champions_data['version']}")
-                Logger.DEBUG('version does not match, updating file now')
-                JSONHelper.cache_response(res, self.CHAMPIONS_PATH)
-                champions_data = JSONHelper.get_json_as_dict(
-                    self.CHAMPIONS_PATH)
-
-        # This would occur only once if this program is being set up for the
-        # first time. After it's set up, this will most likely not be executed ever,
-        # unless the cached response is deleted for some reason.
-        else:
-            Logger.DEBUG(self.CHAMPIONS_PATH)
-            JSONHelper.cache_response(res, self.CHAMPIONS_PATH)
-            champions_data = JSONHelper.get_json_as_dict(self.CHAMPIONS_PATH)
+        version, lang, champions_data = await self._get_champions()
 
         # Get all the champion names in League of Legends
         champions_data = list(champions_data["data"].keys())
-        Logger.DEBUG(f"champion names: {champions_data}")
+        Logger.DEBUG("champion names: %s", champions_data)
         random_champ = random.choice(champions_data)
 
         # Get URL to a randomly chosen champion's data and fetch it
         CHAMP_URL = self.watcher.DATA_DRAGON_URL + \
             f"/cdn/{version}/data/{lang}/champion/{random_champ}.json"
-        Logger.DEBUG(f"Champion selected: {random_champ}, {CHAMP_URL}")
-        async with HTTPClient(loop=self.bot.loop, name=Helper.get_func_name()) as session:
-            random_champ_data = await session.get(CHAMP_URL)
-            random_champ_data = await random_champ_data.json()
+        Logger.DEBUG("Champion selected: %s, %s", random_champ, CHAMP_URL)
+        random_champ_data = await self._get_data_dragon_json(CHAMP_URL)
 
         skins = random_champ_data["data"][random_champ]["skins"]
-        Logger.DEBUG(f"Retrieved skins for {random_champ}!")
+        Logger.DEBUG("Retrieved skins for %s!", random_champ)
 
         # Want to start from 1 because the user shouldn't win default
         # skins.
         random_skin = random.randint(1, len(skins)-1)
         random_skin = skins[random_skin]
-        Logger.DEBUG(f"Random skin picked: {random_skin}")
+        Logger.DEBUG("Random skin picked: %s", random_skin)
 
         # The URL was found using the random champion's name and the ID of the random skin.
         # See more: https://developer.riotgames.com/docs/lol#data-dragon_champion-splash-assets
@@ -2,11 +2,13 @@
 from datetime import datetime
 
 import discord
+from discord import app_commands
 from discord.ext import commands
 
 from config import TIMEZONE
 from log import Logger
 
+from ..utils.admission import admitted
 from ..utils.imageUtils import ImageText
 
 
@@ -82,14 +84,19 @@ async def send_meme(self, ctx: commands.Context, meme: discord.File):
         if meme is None:
             Logger.CTX_ERROR(ctx, meme)
 
-    @commands.command(help="Creates a meme based on the short Tyler1 meme.")
-    async def small(self, ctx: commands.Context, *, arg) -> None:
+    @commands.hybrid_command(help="Creates a meme based on the short Tyler1 meme.")
+    @app_commands.describe(arg="Your caption")
+    @admitted(limit=4)
+    async def small(self, ctx: commands.Context, *, arg: str) -> None:
         meme = await self.write_text_to_img(ctx, './src/imgs/shortMeme.png', arg, 100, 'yellow')
         await self.send_meme(ctx, meme)
 
-    @commands.command(help="Creates a meme based on Tyler1 being progressively scared. In order to use, separate each caption with a delimiter (by default, ';')")
+    @commands.hybrid_command(description="Creates a meme based on Tyler1 being progressively scared.",
+                             help="In order to use, separate each caption with a delimiter (by default, ';')")
+    @app_commands.describe(arg="Your set of captions. Be sure to separate each one with ';'")
+    @admitted(limit=4)
     async def aye(self, ctx: commands.Context, *,
-                  arg=commands.parameter(description="Your set of captions. Be sure to separate each one with ';'")) -> None:
+                  arg: str = commands.parameter(description="Your set of captions. Be sure to separate each one with ';'")) -> None:
         meme = await self.write_text_to_img(ctx, './src/imgs/ayeMeme.png', arg, 270)
         await self.send_meme(ctx, meme)
 
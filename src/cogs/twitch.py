@@ -1,12 +1,23 @@
-import os
+import asyncio
 
-from discord.ext import commands, tasks
+import discord
+from discord.ext import commands
 
 from config import ADMIN_ROLE, STAFF_ROLE, TWITCH_USERS_PATH
 from log import Logger
 
 from ..bot import CustomBot
 from ..subsystems.sys_twitch import TwitchNotification
+from ..utils.command_cache import cached_response
+from ..utils.helper import Helper
+from ..utils.message_scheduler import BACKGROUND
+
+# Number of Twitch users listed per message. Keeps each message below
+# Discord's character limit.
+USERS_PAGE_SIZE = 50
+
+# Seconds between checks of who's streaming
+POLL_INTERVAL = 150
 
 
 class Twitch(commands.Cog):
@@ -16,7 +27,13 @@ def __init__(self, bot: CustomBot) -> None:
         """ Initialize bot and twitch subsystem """
         self.bot = bot
         self.twitch = TwitchNotification(database=self.bot.database)
-        self.check_if_streamers_online.start()
+
+    async def cog_load(self) -> None:
+        """ Authenticates with Twitch in a thread, so other cogs keep loading meanwhile """
+        await Helper.run_in_thread(self.twitch.authenticate)
+        # Only one process of the cluster polls Twitch and notifies every guild
+        self.bot.jobs.add('twitch_notifications', self.check_if_streamers_online, POLL_INTERVAL,
+                          jitter=15.0, timeout=120.0, max_runtime=60.0, leader_only=True)
 
     @commands.command(name='add', aliases=['set', 'insert', 'ins', 'push'],
                       help='Adds a Twitch profile to the database.')
@@ -29,50 +46,39 @@ async def set_twitch_user(self, ctx: commands.Context, twitch_name: str):
         starting with custom ctx.send messages for error logging and other purposes
         """
         author = ctx.author.mention
-        data = self.twitch.get_data_from_db(TWITCH_USERS_PATH)
-        twitch_id = self.twitch.get_twitch_id(twitch_name)
-        if twitch_id is not None:
-            if data is None:
-                await self.twitch.add_twitch_user(twitch_name, twitch_id, TWITCH_USERS_PATH)
-                await ctx.send(f"{author}: Added `{twitch_name}` to the database!")
-            else:
-                users = [data[key]['user'] for key in data]
-                if twitch_name not in users:
-                    await self.twitch.add_twitch_user(twitch_name, twitch_id, TWITCH_USERS_PATH)
-                    await ctx.send(f"{author}: Added `{twitch_name}` to the database!")
-                else:
-                    await ctx.send(f"{author}: Cannot add `{twitch_name}` to the database. Username is already in the database.")
-        else:
+        twitch_id = await self.twitch.get_twitch_id_async(twitch_name)
+        if twitch_id is None:
             await ctx.send(f"{author}: Cannot add `{twitch_name}` to the database. Username is invalid.")
+            return
+        # Checking the ID as well catches the same account added under a different capitalization
+        if (await self.twitch.find_twitch_user(twitch_name, TWITCH_USERS_PATH) is not None or
+                await self.twitch.find_twitch_user_by_id(twitch_id, TWITCH_USERS_PATH) is not None):
+            await ctx.send(f"{author}: Cannot add `{twitch_name}` to the database. Username is already in the database.")
+            return
+        await self.twitch.add_twitch_user(twitch_name, twitch_id, TWITCH_USERS_PATH)
+        self.bot.response_cache.invalidate('get')
+        await ctx.send(f"{author}: Added `{twitch_name}` to the database!")
 
     @commands.command(name='update', help='Updates a Twitch profile on the database.')
     @commands.has_any_role(ADMIN_ROLE, STAFF_ROLE)
     async def update_twitch_user(self, ctx: commands.Context, old_twitch_name: str, new_twitch_name: str):
         """ Updates a Twitch profile on the database """
         author = ctx.author.mention
-        data = self.twitch.get_data_from_db(TWITCH_USERS_PATH)
-        if data is not None:
-            for key in data:
-                # If the old twitch name matches the value in the database, update it with
-                # new twitch name
-                user = data[key]['user']
-                if new_twitch_name == user:
-                    await ctx.send(f"{author}: No duplicates allowed!")
-                    break
-                if old_twitch_name == user:
-                    if self.twitch.get_twitch_id(new_twitch_name) is not None:
-                        # Ensure that the path points to the user key
-                        await self.twitch.update_twitch_user(old_twitch_name, new_twitch_name, TWITCH_USERS_PATH+f'/{key}')
-                        await ctx.send(f"{author}: Updated `{old_twitch_name}` to `{new_twitch_name}` on the database!")
-                        break
-                    else:
-                        await ctx.send(f"{author}: {new_twitch_name} is not a valid name.")
-                        break
-                else:
-                    await ctx.send(f"{author}: Could not find {old_twitch_name}!")
-                    break
-        else:
-            await ctx.send(f"{author}: Database is empty. Have you tried adding some Twitch users first?")
+        if await self.twitch.find_twitch_user(new_twitch_name, TWITCH_USERS_PATH) is not None:
+            await ctx.send(f"{author}: No duplicates allowed!")
+            return
+        old_twitch_user = await self.twitch.find_twitch_user(old_twitch_name, TWITCH_USERS_PATH)
+        if old_twitch_user is None:
+            await ctx.send(f"{author}: Could not find {old_twitch_name}!")
+            return
+        if await self.twitch.get_twitch_id_async(new_twitch_name) is None:
+            await ctx.send(f"{author}: {new_twitch_name} is not a valid name.")
+            return
+        key, _ = old_twitch_user
+        # Ensure that the path points to the user key
+        await self.twitch.update_twitch_user(old_twitch_name, new_twitch_name, TWITCH_USERS_PATH+f'/{key}')
+        self.bot.response_cache.invalidate('get')
+        await ctx.send(f"{author}: Updated `{old_twitch_name}` to `{new_twitch_name}` on the database!")
 
     @commands.command(name='delete', aliases=['del', 'remove', 'rm', 'pop'],
                       help='Delete your Twitch profile from the live notifs list.')
@@ -80,75 +86,103 @@ async def update_twitch_user(self, ctx: commands.Context, old_twitch_name: str,
     async def delete_twitch_user(self, ctx: commands.Context, twitch_name: str):
         """ Deletes the key of the specified Twitch user """
         author = ctx.author.mention
-        data = self.twitch.get_data_from_db(TWITCH_USERS_PATH)
-        has_name = False
-        for key in data:
-            # If the name matches any of the users in the database, delete it and set
-            # flag to True
-            if twitch_name == data[key]['user']:
-                has_name = True
-                await self.twitch.delete_twitch_user(key=key, twitch_user=twitch_name, path=TWITCH_USERS_PATH)
-                await ctx.send(f"{author}: Deleted `{twitch_name}` from the database!")
-        # If flag is still False, let the user know
-        if not has_name:
+        twitch_user = await self.twitch.find_twitch_user(twitch_name, TWITCH_USERS_PATH)
+        if twitch_user is None:
             await ctx.send(f"{author}: Can't find `{twitch_name}`!")
-
-    @commands.command(name='get', aliases=['get_users', 'getUsers'], help='Gets all Twitch users in the database.')
+            return
+        key, _ = twitch_user
+        await self.twitch.delete_twitch_user(key=key, twitch_user=twitch_name, path=TWITCH_USERS_PATH)
+        self.bot.response_cache.invalidate('get')
+        await ctx.send(f"{author}: Deleted `{twitch_name}` from the database!")
+
+    @commands.hybrid_command(name='get', aliases=['get_users', 'getUsers'], help='Gets all Twitch users in the database.')
+    @cached_response(ttl=60)
     async def get_twitch_users(self, ctx: commands.Context):
+        """ 
+        Sends the Twitch users one page at a time, so neither the bot nor a
+        single message has to hold the whole list.
+        """
+        # Goes out with the first page
+        header = f"{ctx.author.mention}: List of Twitch users in the database: \n"
         users_list = ''
-        data = self.twitch.get_data_from_db(TWITCH_USERS_PATH)
-        # Iterate through the data and add every value of 'user' to this
-        # amazing string
-        for index, key in enumerate(data):
-            users_list += f"{index+1}: {data[key]['user']}\n"
-        await ctx.send(f"{ctx.author.mention}: List of Twitch users in the database: ")
-        await ctx.send(f"```{users_list}```")
-
-    @tasks.loop(minutes=2.5)
+        count = 0
+        users = self.bot.database.iter_children_async(TWITCH_USERS_PATH, page_size=USERS_PAGE_SIZE)
+        async for _, streamer_info in users:
+            count += 1
+            users_list += f"{count}: {streamer_info['user']}\n"
+            if count % USERS_PAGE_SIZE == 0:
+                await self.bot.scheduler.reply(ctx, f"{header}```{users_list}```")
+                header = users_list = ''
+        if users_list:
+            await self.bot.scheduler.reply(ctx, f"{header}```{users_list}```")
+        elif count == 0:
+            await self.bot.scheduler.reply(ctx, f"{header}```No Twitch users yet!```")
+
+    @commands.command(name='notifs', aliases=['notifications'],
+                      help='Sends Twitch notifications to a channel, or stops them if none is given.')
+    @commands.check_any(commands.is_owner(), commands.has_guild_permissions(manage_guild=True))
+    @commands.guild_only()
+    async def set_notifications_channel(self, ctx: commands.Context,
+                                        channel: discord.TextChannel = None):
+        """ Picks the channel of the server that gets Twitch notifications """
+        default_id = self.bot.guild_manager.default_notification_channel_id
+        await self.bot.guild_manager.set_notification_channel(
+            ctx.guild.id, channel.id if channel is not None else None,
+            has_default_channel=default_id is not None and ctx.guild.get_channel(default_id) is not None)
+        if channel is None:
+            await ctx.send(f"{ctx.author.mention}: Stopped sending Twitch notifications to this server.")
+        else:
+            await ctx.send(f"{ctx.author.mention}: Sending Twitch notifications to {channel.mention}!")
+
     async def check_if_streamers_online(self):
-        try:
-            channel = self.bot.get_channel(int(
-                os.getenv('TWITCH_NOTIFICATIONS_CHANNEL_ID')))
-            streamers = self.bot.database.read('/twitch_users')
-            for streamer in streamers:
-                streamer_info = streamers[streamer]
-                user, user_id = streamer_info['user'], streamer_info['user_id']
-                notif_msg = f":red_circle: **LIVE**\n`{user}` is now streaming on Twitch!\nhttps://www.twitch.tv/{user}"
-                # Check if they're online or not. If they are, send the notification message to a provided
-                # webhook
-                status = await self.twitch.check_twitch_user_status(user_id)
-                # messages = await channel.history(limit=10).flatten()
-                messages = [message async for message in channel.history(limit=10)]
+        """ Job that notifies the guilds of streamers going live, and cleans up after them """
+        # Sent through the API, so channels of guilds on other workers' shards work too
+        channels = [self.bot.get_partial_messageable(channel_id)
+                    for channel_id in self.bot.guild_manager.notification_channel_ids()]
+        if not channels:
+            return
+        # Read once per round, rather than once per streamer
+        history = {}
+        for channel in channels:
+            try:
+                history[channel.id] = [message async for message in channel.history(limit=10)]
+            except discord.HTTPException as e:
+                Logger.WARNING(f"Can't read notifications channel {channel.id}: {e}")
+        channels = [channel for channel in channels if channel.id in history]
+        # Queued as they're found, and waited for at the end
+        pending = []
+        deleted = set()
+        async for _, streamer_info in self.bot.database.iter_children_async(TWITCH_USERS_PATH):
+            user, user_id = streamer_info['user'], streamer_info['user_id']
+            notif_msg = f":red_circle: **LIVE**\n`{user}` is now streaming on Twitch!\nhttps://www.twitch.tv/{user}"
+            # Check if they're online or not. If they are, send the notification message to
+            # every channel
+            status = await self.twitch.check_twitch_user_status(user_id)
+            for channel in channels:
+                messages = history[channel.id]
                 if status is True:
                     # Check if the messages have already been sent to the channel
-                    # Logger.DEBUG(f"messages: {messages}")
-                    messages = [msg.content for msg in messages]
-                    if not (any(notif_msg in msg for msg in messages)):
-                        # Send message to webhook if it exists
-                        Logger.DEBUG(
-                            f"{str(user)} started streaming. Sending to channel now.")
-                        await channel.send(notif_msg)
+                    if not (any(notif_msg in msg.content for msg in messages)):
+                        Logger.DEBUG("%s started streaming. Sending to channel now.", user)
+                        # Each on its own, so it's deleted without the others when its streamer goes offline
+                        pending.append(self.bot.scheduler.submit(channel, notif_msg, BACKGROUND,
+                                                                 merge=False))
                     else:
-                        Logger.DEBUG(
-                            f"notif message about {str(user)} already sent!")
+                        Logger.DEBUG("notif message about %s already sent!", user)
                 else:
-                    # If offline, clean the channel.
+                    # If offline, clean the channel
                     for message in messages:
-                        if notif_msg == message.content:
-                            Logger.DEBUG(
-                                f'Deleting notification for: {str(user)}')
-                            await message.delete()
-        except Exception as e:
-            Logger.ERROR(f"Error in Live Notifs Loop: {str(e)}")
+                        if notif_msg in message.content and message.id not in deleted:
+                            Logger.DEBUG("Deleting notification for: %s", user)
+                            deleted.add(message.id)
+                            pending.append(self.bot.scheduler.delete(message, BACKGROUND))
+        for result in await asyncio.gather(*pending, return_exceptions=True):
+            if isinstance(result, Exception):
+                Logger.ERROR(f"Could not update a Twitch notification: {result}")
 
     def cog_unload(self):
-        """ Cancel the task when unloading this cog """
-        self.check_if_streamers_online.cancel()
-
-    @check_if_streamers_online.before_loop
-    async def before_check_if_streamers_online(self):
-        """ Wait for bot to be ready before starting the task """
-        await self.bot.wait_until_ready()
+        """ Stop the job when unloading this cog """
+        self.bot.jobs.remove('twitch_notifications')
 
 
 async def setup(bot: CustomBot):
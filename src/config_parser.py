@@ -39,6 +39,10 @@ def get_bot_db_value(self, option: str):
         """ Retrieves an option from section bot_db """
         return self._get_value(section="bot_db", option=option)
 
+    def get_log_value(self, option: str):
+        """ Retrieves an option from section log """
+        return self._get_value(section="log", option=option)
+
     def get_sections(self):
         return self._config.sections()
 
@@ -0,0 +1,99 @@
+from typing import Dict, List
+
+from discord.ext import commands
+from discord.utils import maybe_coroutine
+
+from log import Logger
+
+from ..utils.cog_manifest import CogSpec, CommandSpec
+from ..utils.single_flight import SingleFlight
+
+
+def _make_stub(extension: str, spec: CommandSpec) -> commands.Command:
+    """ A command that loads the cog it belongs to, then invokes the real command """
+
+    async def stub(cog, ctx: commands.Context) -> None:
+        await ctx.bot.cog_manager.load(extension)
+        # Parsed again, now by the real command and its checks
+        await ctx.bot.invoke(await ctx.bot.get_context(ctx.message))
+
+    kwargs = {'help': spec.help, 'brief': spec.brief, 'description': spec.description}
+    # discord.py would take help=None for an empty help text
+    kwargs = {key: value for key, value in kwargs.items() if value is not None}
+    return commands.command(name=spec.name, aliases=spec.aliases, hidden=spec.hidden,
+                            **kwargs)(stub)
+
+
+def _already_loaded() -> None:
+    """ Takes the place of a cog's cog_load() once it has run """
+
+
+def make_stand_in(spec: CogSpec) -> commands.Cog:
+    """ A cog with the name, description and commands of the real one, all stubs """
+    attrs = {f"stub_{i}": _make_stub(spec.extension, command)
+             for i, command in enumerate(spec.commands)}
+    attrs['__doc__'] = spec.description or ''
+    attrs['__module__'] = __name__
+    return commands.CogMeta(spec.name, (commands.Cog,), attrs)()
+
+
+class CogManager:
+    """
+    Loads cogs lazily. Until a lazy cog is used, a stand-in takes its place: a cog
+    with the same name, description and commands, built from the cog's manifest
+    without importing its module (or anything that module imports). The first
+    command invoked through a stand-in replaces it with the real cog, then runs
+    the real command. The help command lists the stand-ins like any other cog.
+
+    The stand-in stays until the real cog is ready to take its commands over (see
+    replace_stand_in), so commands invoked while it loads wait for it.
+    """
+
+    def __init__(self, bot: commands.Bot) -> None:
+        self.bot = bot
+        # extension: stand-in cog
+        self._stand_ins: Dict[str, commands.Cog] = {}
+        # Commands invoked while their cog loads wait for that one load
+        self._flight = SingleFlight()
+
+    @property
+    def pending(self) -> List[str]:
+        """ Extensions that haven't been loaded yet """
+        return list(self._stand_ins)
+
+    async def add_stand_in(self, spec: CogSpec) -> None:
+        stand_in = make_stand_in(spec)
+        await self.bot.add_cog(stand_in)
+        self._stand_ins[spec.extension] = stand_in
+        Logger.DEBUG("Cog %s will be loaded on first use", spec.extension)
+
+    async def load(self, extension: str) -> None:
+        """ Replaces the stand-in of extension with the real cog, unless that's done """
+        if extension in self._stand_ins:
+            await self._flight.do_async(extension, self._load, extension)
+
+    async def replace_stand_in(self, cog: commands.Cog) -> None:
+        """
+        Called by the bot before adding a cog. If the cog takes the place of a
+        stand-in, runs its cog_load() with the stand-in still there, then removes
+        the stand-in, since both would register the same commands.
+        """
+        stand_in = self.bot.get_cog(cog.qualified_name)
+        if stand_in is None or stand_in is cog or stand_in not in self._stand_ins.values():
+            return
+        await maybe_coroutine(cog.cog_load)
+        # Already run; adding the cog would run it again
+        cog.cog_load = _already_loaded
+        await self.bot.remove_cog(stand_in.qualified_name)
+
+    async def _load(self, extension: str) -> None:
+        stand_in = self._stand_ins[extension]
+        try:
+            await self.bot.load_extension(extension)
+        except Exception:
+            # Keep the stubs, so the next use tries again
+            if self.bot.get_cog(stand_in.qualified_name) is None:
+                await self.bot.add_cog(stand_in)
+            raise
+        del self._stand_ins[extension]
+        Logger.INFO("Loaded cog %s on first use", extension)
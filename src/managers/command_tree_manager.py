@@ -0,0 +1,63 @@
+import hashlib
+import json
+from datetime import datetime, timezone
+from typing import Optional
+
+import discord
+from discord import app_commands
+
+from log import Logger
+
+from ..subsystems.sys_firebase import Database
+
+
+class CommandTreeManager:
+    """
+    Syncs the bot's slash commands with Discord only when they changed. Syncing
+    replaces every command Discord knows about and is heavily rate limited, so
+    doing it on every start is wasteful: commands rarely change between restarts.
+
+    The commands are hashed as they'd be sent to Discord. The hash of the last
+    successful sync is stored in the database at path (per guild, or 'global'),
+    and a sync only happens when the hash of the commands differs from it.
+    """
+
+    def __init__(self, database: Database, path: str) -> None:
+        self.database = database
+        self.path = path
+
+    @staticmethod
+    def signature(tree: app_commands.CommandTree, guild: discord.abc.Snowflake = None) -> str:
+        """ A hash of the commands of the tree, as Discord would receive them """
+        payload = sorted((command.to_dict() for command in tree.get_commands(guild=guild)),
+                         key=lambda command: (command['type'], command['name']))
+        encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _scope(guild: Optional[discord.abc.Snowflake]) -> str:
+        return str(guild.id) if guild is not None else 'global'
+
+    async def sync(self, tree: app_commands.CommandTree,
+                   guild: discord.abc.Snowflake = None) -> bool:
+        """ Syncs the tree if its commands changed since the last sync. Returns True if it did. """
+        signature = self.signature(tree, guild)
+        try:
+            synced = await self.database.read_async(f"{self.path}/{self._scope(guild)}")
+        except Exception as e:
+            # Syncing for nothing is better than leaving stale commands
+            Logger.WARNING(f"Could not read the last command tree sync: {e}")
+            synced = None
+        if synced and synced.get('hash') == signature:
+            Logger.INFO("Slash commands are up to date, skipping sync")
+            return False
+
+        commands = await tree.sync(guild=guild)
+        Logger.INFO("Synced %d slash commands", len(commands))
+        await self.database.update_async(self.path, {
+            self._scope(guild): {
+                'hash': signature,
+                'synced_at': datetime.now(tz=timezone.utc).isoformat(),
+            }
+        })
+        return True
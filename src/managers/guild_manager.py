@@ -0,0 +1,205 @@
+from time import monotonic
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from log import Logger
+
+from ..subsystems.sys_firebase import Database
+from ..utils.single_flight import SingleFlight
+
+
+class GuildSettings:
+    """
+    The settings of one guild, as stored at guilds/<guild ID>/settings. Settings
+    that aren't stored are None, and fall back to the bot's defaults.
+
+    Greeted users are stored as a comma-separated string, since Firebase drops
+    empty lists and a guild may want to greet no one.
+
+    has_default_channel marks the guild that has the default notification channel:
+    its own choice of channel (or of none) replaces the default.
+    """
+
+    def __init__(self, prefix: str = None, greeting_user_ids: Iterable[str] = None,
+                 notification_channel_id: int = None,
+                 disabled_commands: Iterable[str] = None,
+                 has_default_channel: bool = False) -> None:
+        self.prefix = prefix
+        self.greeting_user_ids: Optional[Set[str]] = (
+            {str(user_id) for user_id in greeting_user_ids}
+            if greeting_user_ids is not None else None)
+        self.notification_channel_id = notification_channel_id
+        self.disabled_commands: Set[str] = set(disabled_commands or ())
+        self.has_default_channel = has_default_channel
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'GuildSettings':
+        channel_id = data.get('notification_channel_id')
+        greeting_user_ids = data.get('greeting_user_ids')
+        return cls(
+            prefix=data.get('prefix'),
+            greeting_user_ids=([user_id for user_id in greeting_user_ids.split(',') if user_id]
+                               if greeting_user_ids is not None else None),
+            notification_channel_id=int(channel_id) if channel_id else None,
+            disabled_commands=data.get('disabled_commands'),
+            has_default_channel=bool(data.get('has_default_channel')),
+        )
+
+    def to_dict(self) -> dict:
+        """ The settings as they're stored """
+        return {
+            'prefix': self.prefix,
+            'greeting_user_ids': (','.join(sorted(self.greeting_user_ids))
+                                  if self.greeting_user_ids is not None else None),
+            'notification_channel_id': self.notification_channel_id,
+            'disabled_commands': sorted(self.disabled_commands),
+            'has_default_channel': self.has_default_channel or None,
+        }
+
+
+class GuildManager:
+    """
+    Keeps the state of every guild in memory, keyed by guild ID, so handling an
+    event only takes a lookup in a dict, no matter how many guilds the bot is in.
+    The table is filled with one read at startup and updated in place whenever
+    a setting is changed through the bot.
+
+    Each guild is stored under path/<guild ID>/settings. Guilds without a stored
+    setting use the defaults given here, which come from the bot's config.
+
+    Loading failures and refreshes (refresh_after, for when other workers of a
+    cluster can change the settings too) work like those of PrefixManager.
+    """
+
+    def __init__(self, database: Database, path: str,
+                 default_greeting_user_ids: Iterable[str] = (),
+                 default_notification_channel_id: int = None,
+                 retry_after: float = 60.0,
+                 on_change: Callable[[set], None] = None,
+                 refresh_after: float = None) -> None:
+        self.database = database
+        self.path = path
+        self.default_greeting_user_ids = {str(user_id) for user_id in default_greeting_user_ids}
+        self.default_notification_channel_id = default_notification_channel_id
+        self.retry_after = retry_after
+        self.on_change = on_change
+        self.refresh_after = refresh_after
+        self._flight = SingleFlight()
+
+        # guild ID: settings
+        self._guilds: Dict[int, GuildSettings] = {}
+        self._loaded = False
+        self._loaded_at: Optional[float] = None
+        self._failed_at: Optional[float] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def prefixes(self) -> set:
+        """ Every prefix set by a guild """
+        return {settings.prefix for settings in self._guilds.values() if settings.prefix}
+
+    def needs_reload(self) -> bool:
+        """ Same as PrefixManager.needs_reload() """
+        if self._failed_at is not None and monotonic() - self._failed_at < self.retry_after:
+            return False
+        if not self._loaded:
+            return True
+        return (self.refresh_after is not None
+                and monotonic() - self._loaded_at >= self.refresh_after
+                and not self._flight.in_flight('load'))
+
+    async def load(self) -> bool:
+        """ Fills the table from the database. Returns False if it could not be read. """
+        return await self._flight.do_async('load', self._load)
+
+    async def _load(self) -> bool:
+        try:
+            data = await self.database.read_async(self.path)
+        except Exception as e:
+            self._failed_at = monotonic()
+            Logger.ERROR(f"Could not load guild settings, retrying in {self.retry_after}s: {e}")
+            return False
+
+        self._failed_at = None
+        self._loaded = True
+        self._loaded_at = monotonic()
+
+        guilds = {}
+        for guild_id, guild in (data or {}).items():
+            if isinstance(guild, dict) and isinstance(guild.get('settings'), dict):
+                guilds[int(guild_id)] = GuildSettings.from_dict(guild['settings'])
+        self._guilds = guilds
+        self._notify()
+        Logger.DEBUG(f"Loaded the settings of {len(guilds)} guild(s)")
+        return True
+
+    def get(self, guild_id: Optional[int]) -> GuildSettings:
+        """ The settings of a guild. Guilds without any (and DMs) get empty ones. """
+        settings = self._guilds.get(guild_id)
+        return settings if settings is not None else GuildSettings()
+
+    def get_prefix(self, guild_id: Optional[int]) -> Optional[str]:
+        """ The prefix set by a guild, or None to use the default """
+        return self.get(guild_id).prefix
+
+    def greeting_user_ids(self, guild_id: int) -> Set[str]:
+        """ IDs of the users to greet when they join a voice channel of the guild """
+        greeting_user_ids = self.get(guild_id).greeting_user_ids
+        return greeting_user_ids if greeting_user_ids is not None else self.default_greeting_user_ids
+
+    def notification_channel_ids(self) -> List[int]:
+        """ The channel of every guild that wants Twitch notifications, each once """
+        channel_ids = {settings.notification_channel_id for settings in self._guilds.values()
+                       if settings.notification_channel_id is not None}
+        # Unless the guild that has it chose another channel, or none
+        replaced = any(settings.has_default_channel for settings in self._guilds.values())
+        if self.default_notification_channel_id is not None and not replaced:
+            channel_ids.add(self.default_notification_channel_id)
+        return sorted(channel_ids)
+
+    def is_enabled(self, guild_id: Optional[int], command: str) -> bool:
+        """ Checks if a guild has not turned off a command """
+        settings = self._guilds.get(guild_id)
+        return settings is None or command not in settings.disabled_commands
+
+    async def _update(self, guild_id: int, **fields) -> None:
+        """ Stores settings of a guild, then applies them in memory """
+        await self.database.update_async(f"{self.path}/{guild_id}/settings", fields, wait=True)
+        self._guilds[guild_id] = GuildSettings.from_dict({**self.get(guild_id).to_dict(), **fields})
+
+    async def set_prefix(self, guild_id: int, prefix: Optional[str]) -> None:
+        """ Changes the prefix of a guild. None goes back to the default. """
+        await self._update(guild_id, prefix=prefix)
+        self._notify()
+
+    async def set_greeting_user_ids(self, guild_id: int, user_ids: Optional[Iterable[str]]) -> None:
+        """ Changes who is greeted in a guild. None goes back to the default. """
+        await self._update(guild_id, greeting_user_ids=(
+            ','.join(sorted(str(user_id) for user_id in user_ids)) if user_ids is not None else None))
+
+    async def set_notification_channel(self, guild_id: int, channel_id: Optional[int],
+                                       has_default_channel: bool = False) -> None:
+        """
+        Changes where a guild gets Twitch notifications. None turns them off.
+        has_default_channel tells that the default channel is in that guild, so the
+        guild's choice replaces it.
+        """
+        if has_default_channel:
+            await self._update(guild_id, notification_channel_id=channel_id, has_default_channel=True)
+        else:
+            await self._update(guild_id, notification_channel_id=channel_id)
+
+    async def set_command_enabled(self, guild_id: int, command: str, enabled: bool) -> None:
+        """ Turns a command on or off in a guild """
+        disabled = set(self.get(guild_id).disabled_commands)
+        if enabled:
+            disabled.discard(command)
+        else:
+            disabled.add(command)
+        await self._update(guild_id, disabled_commands=sorted(disabled) or None)
+
+    def _notify(self) -> None:
+        if self.on_change is not None:
+            self.on_change(self.prefixes)
@@ -0,0 +1,143 @@
+from time import monotonic
+from typing import Callable, Dict, Optional
+
+from log import Logger
+
+from ..subsystems.sys_firebase import Database
+from ..utils.single_flight import SingleFlight
+
+
+class PrefixManager:
+    """
+    Keeps the command prefixes in memory, keyed by guild ID, so resolving the
+    prefix of a message never requires a round trip to the database. The table
+    is filled once at startup and refreshed whenever a prefix is changed through
+    the bot.
+
+    Settings stored without a guild ID act as the global (default) prefix.
+
+    If the database can't be reached, the failure is remembered for a while and
+    the current prefix is served in the meantime. That way, an outage can never
+    turn message traffic into a storm of reads and writes.
+
+    on_change is called with the set of all prefixes whenever they change.
+
+    When other processes can change the prefixes (e.g. other workers of a
+    cluster), refresh_after makes the table reload once it's that many seconds
+    old. Concurrent loads share one read.
+    """
+
+    def __init__(self, database: Database, path: str, default_prefix: str = '>',
+                 retry_after: float = 60.0,
+                 on_change: Callable[[set], None] = None,
+                 refresh_after: float = None) -> None:
+        self.database = database
+        self.path = path
+        self.default_prefix = default_prefix
+        self.retry_after = retry_after
+        self.on_change = on_change
+        self.refresh_after = refresh_after
+        self._flight = SingleFlight()
+
+        # guild ID: command prefix
+        self._prefixes: Dict[int, str] = {}
+        self._global_prefix = default_prefix
+        # Unique key of the global settings in the database
+        self._global_key: Optional[str] = None
+        self._loaded = False
+        self._loaded_at: Optional[float] = None
+        self._failed_at: Optional[float] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def prefixes(self) -> set:
+        """ Every prefix that is currently in use """
+        return {self._global_prefix, *self._prefixes.values()}
+
+    def needs_reload(self) -> bool:
+        """
+        Checks if the table should be (re)loaded. After a failed load, this stays
+        False until retry_after seconds have passed.
+        """
+        if self._failed_at is not None and monotonic() - self._failed_at < self.retry_after:
+            return False
+        if not self._loaded:
+            return True
+        # A refresh in progress keeps serving the current table meanwhile
+        return (self.refresh_after is not None
+                and monotonic() - self._loaded_at >= self.refresh_after
+                and not self._flight.in_flight('load'))
+
+    async def load(self) -> bool:
+        """
+        Fills the table from the database. Returns False if the database
+        could not be read.
+        """
+        return await self._flight.do_async('load', self._load)
+
+    async def _load(self) -> bool:
+        try:
+            data = await self.database.read_async(self.path)
+        except Exception as e:
+            self._failed_at = monotonic()
+            Logger.ERROR(f"Could not load command prefixes, retrying in {self.retry_after}s: {e}")
+            return False
+
+        self._failed_at = None
+        self._loaded = True
+        self._loaded_at = monotonic()
+
+        if not data:
+            Logger.DEBUG(f"No command prefixes found! Creating default: {self.default_prefix}")
+            await self._create_global_prefix(self.default_prefix)
+            return True
+
+        prefixes = {}
+        for key, settings in data.items():
+            if not isinstance(settings, dict) or 'cmd_prefix' not in settings:
+                continue
+            guild_id = settings.get('guild_id')
+            if guild_id is None:
+                self._global_key = key
+                self._global_prefix = settings['cmd_prefix']
+            else:
+                prefixes[int(guild_id)] = settings['cmd_prefix']
+        self._prefixes = prefixes
+        self._notify()
+        Logger.DEBUG(f"Loaded {len(prefixes)} guild prefix(es), global prefix: {self._global_prefix}")
+        return True
+
+    def get_prefix(self, guild_id: int = None) -> str:
+        """ Resolves the command prefix for a guild """
+        return self._prefixes.get(guild_id, self._global_prefix)
+
+    async def set_prefix(self, cmd_prefix: str) -> None:
+        """ Changes the global command prefix in the database and in memory """
+        if self._global_key is None:
+            await self._create_global_prefix(cmd_prefix)
+            return
+        await self.database.update_async(self.path, {
+            self._global_key: {'cmd_prefix': cmd_prefix}
+        }, wait=True)
+        self._global_prefix = cmd_prefix
+        self._notify()
+
+    async def _create_global_prefix(self, cmd_prefix: str) -> None:
+        """ Creates the global command prefix in the database """
+        try:
+            self._global_key = await self.database.add_async(self.path, {
+                'cmd_prefix': cmd_prefix
+            }, wait=True)
+            Logger.DEBUG(f"Added {cmd_prefix} to the database!")
+        except Exception as e:
+            Logger.CRITICAL("Could not create command prefix!")
+            Logger.CRITICAL(str(e))
+        self._global_prefix = cmd_prefix
+        self._notify()
+
+    def _notify(self) -> None:
+        if self.on_change is not None:
+            self.on_change(self.prefixes)
@@ -0,0 +1,79 @@
+from typing import Callable, List
+
+
+def key_order(key: str):
+    """ 
+    Sort key matching how the database orders keys: keys that parse as 32-bit
+    integers come first in numerical order, then the rest lexicographically.
+    """
+    try:
+        number = int(key)
+        if -2**31 <= number < 2**31 and str(number) == key:
+            return (0, number, '')
+    except ValueError:
+        pass
+    return (1, 0, key)
+
+
+class DatabaseBackend:
+    """
+    Storage behind the Database subsystem. A backend stores a JSON-like tree
+    addressed by '/'-separated paths, following the semantics of Firebase's
+    Realtime Database: writing None (or an empty dict) deletes a path, and
+    empty nodes don't exist.
+
+    Every method is blocking. Database runs them on its thread pool.
+    """
+
+    # False if the backend can't notify about changes, see listen()
+    supports_listen = False
+
+    def get(self, path: str):
+        """ Returns the data at path, or None if there isn't any """
+        raise NotImplementedError
+
+    def get_keys(self, path: str) -> List[str]:
+        """ Returns the keys of the children at path, in no particular order """
+        raise NotImplementedError
+
+    def get_page(self, path: str, limit: int, start_at: str = None,
+                 from_end: bool = False) -> dict:
+        """
+        Returns up to limit children at path ordered by key, starting at start_at
+        (inclusive). If from_end is True, the children are taken from the end, up
+        to start_at.
+        """
+        raise NotImplementedError
+
+    def query_by_child(self, path: str, child: str, value) -> dict:
+        """ Returns the children at path whose child equals value """
+        raise NotImplementedError
+
+    def update(self, path: str, data: dict) -> None:
+        """
+        Replaces each child of path named by a key of data with its value. Keys
+        may be paths themselves, which allows writing to several locations at once.
+        """
+        raise NotImplementedError
+
+    def delete(self, path: str) -> None:
+        """ Removes the data at path """
+        raise NotImplementedError
+
+    def transaction(self, path: str, update: Callable):
+        """
+        Atomically replaces the data at path with update(data) and returns the
+        new data. No other write to path can happen in between. update may be
+        called more than once, so it must not have side effects.
+        """
+        raise NotImplementedError
+
+    def listen(self, path: str, callback: Callable):
+        """
+        Calls callback on every change below path, from a background thread.
+        Returns a registration with a close() method.
+        """
+        raise NotImplementedError(f"{type(self).__name__} can't listen for changes")
+
+    def close(self) -> None:
+        """ Releases the backend's resources """
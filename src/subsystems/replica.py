@@ -0,0 +1,319 @@
+import heapq
+import json
+import os
+import threading
+from copy import deepcopy
+from time import monotonic
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from log import Logger
+
+from .db_backend import key_order
+
+# Returned by Replica.get() when the replica can't answer a read
+MISSING = object()
+
+
+class _Index:
+    """ Keys of the entries of a node by the value of one of their children """
+
+    def __init__(self, child: str) -> None:
+        self.child = child
+        # child value: keys of the entries with that value, in insertion order
+        self._keys: Dict[object, Dict[str, None]] = {}
+        # key: child value
+        self._values: Dict[str, object] = {}
+
+    def build(self, node) -> None:
+        self._keys.clear()
+        self._values.clear()
+        if isinstance(node, dict):
+            for key, entry in node.items():
+                self.update(key, entry)
+
+    def update(self, key: str, entry) -> None:
+        """ Indexes the new entry at key, dropping the old one """
+        if key in self._values:
+            value = self._values.pop(key)
+            keys = self._keys[value]
+            del keys[key]
+            if not keys:
+                del self._keys[value]
+        if not isinstance(entry, dict) or self.child not in entry:
+            return
+        value = entry[self.child]
+        try:
+            self._keys.setdefault(value, {})[key] = None
+        except TypeError:
+            # Lists and dicts can't be looked up by value
+            return
+        self._values[key] = value
+
+    def first(self, value) -> Optional[str]:
+        try:
+            keys = self._keys.get(value)
+        except TypeError:
+            return None
+        return next(iter(keys)) if keys else None
+
+
+class Replica:
+    """
+    In-memory copy of a few database subtrees. Each subtree is subscribed to with a
+    change listener so the copy stays live, and reads of those paths are served
+    from memory instead of making a round trip to the database.
+
+    The copy is saved to a snapshot on disk. On the next start, the snapshot is
+    loaded right away so reads can be answered before the listeners have caught up
+    with the database.
+
+    Listeners call back from their own threads, so every access goes through a lock.
+    """
+
+    def __init__(self, paths: Iterable[str], snapshot_path: str = None,
+                 snapshot_interval: float = 30.0) -> None:
+        self.paths = [self._split(path) for path in paths]
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+
+        # root path: data of the subtree
+        self._data: Dict[str, object] = {}
+        # Subtrees that received their initial data from the database
+        self._synced = set()
+        self._registrations = []
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = monotonic()
+        # (root, path below it, child): index of the node at that path
+        self._indexes: Dict[Tuple[str, Tuple[str, ...], str], _Index] = {}
+
+    @staticmethod
+    def _split(path: str) -> Tuple[str, ...]:
+        return tuple(segment for segment in path.split('/') if segment)
+
+    def _locate(self, path: str) -> Optional[Tuple[str, Tuple[str, ...]]]:
+        """ Finds the subtree containing path. Returns its root and the rest of the path. """
+        segments = self._split(path)
+        for root in self.paths:
+            if segments[:len(root)] == root:
+                return '/'.join(root), segments[len(root):]
+        return None
+
+    def covers(self, path: str) -> bool:
+        """ Checks if reads of path can be served from memory """
+        located = self._locate(path)
+        return located is not None and located[0] in self._data
+
+    @property
+    def synced(self) -> bool:
+        """ True once every subtree received its initial data from the database """
+        return len(self._synced) == len(self.paths)
+
+    @staticmethod
+    def _get_at(data, segments: Tuple[str, ...]):
+        for segment in segments:
+            if not isinstance(data, dict):
+                return None
+            data = data.get(segment)
+        return data
+
+    @staticmethod
+    def _set_at(data, segments: Tuple[str, ...], value):
+        """ Returns data with value set at segments. A value of None removes it. """
+        if not segments:
+            return value
+        node = data if isinstance(data, dict) else {}
+        child = Replica._set_at(node.get(segments[0]), segments[1:], value)
+        if child is None or child == {}:
+            node.pop(segments[0], None)
+        else:
+            node[segments[0]] = child
+        return node if node else None
+
+    def get(self, path: str):
+        """ Returns a copy of the data at path, or MISSING if it's not replicated """
+        located = self._locate(path)
+        if located is None:
+            return MISSING
+        root, segments = located
+        with self._lock:
+            if root not in self._data:
+                return MISSING
+            return deepcopy(self._get_at(self._data[root], segments))
+
+    def keys(self, path: str):
+        """ Returns the keys of the children at path in database order, or MISSING if it's not replicated """
+        located = self._locate(path)
+        if located is None:
+            return MISSING
+        root, segments = located
+        with self._lock:
+            if root not in self._data:
+                return MISSING
+            node = self._get_at(self._data[root], segments)
+            keys: List[str] = list(node) if isinstance(node, dict) else []
+        return sorted(keys, key=key_order)
+
+    def page(self, path: str, limit: int, start_after: str = None, from_end: bool = False):
+        """
+        Returns a copy of up to limit children at path, like Database.read_page(),
+        or MISSING if path is not replicated. Only the children on the page are
+        copied, and they're selected without sorting the whole node.
+        """
+        located = self._locate(path)
+        if located is None:
+            return MISSING
+        root, segments = located
+        with self._lock:
+            if root not in self._data:
+                return MISSING
+            node = self._get_at(self._data[root], segments)
+            if not isinstance(node, dict):
+                return {}
+            keys: Iterable[str] = node
+            if start_after is not None:
+                start = key_order(start_after)
+                if from_end:
+                    keys = (key for key in keys if key_order(key) < start)
+                else:
+                    keys = (key for key in keys if key_order(key) > start)
+            if from_end:
+                keys = heapq.nlargest(limit, keys, key=key_order)[::-1]
+            else:
+                keys = heapq.nsmallest(limit, keys, key=key_order)
+            return {key: deepcopy(node[key]) for key in keys}
+
+    def find(self, path: str, child: str, value):
+        """
+        Finds the entry below path whose child equals value, using an index of
+        child values to keys. Returns (key, data) or None, or MISSING if path is
+        not replicated. The index is built on the first lookup and then kept up
+        to date by every write below path, so lookups are O(1).
+        """
+        located = self._locate(path)
+        if located is None:
+            return MISSING
+        root, segments = located
+        with self._lock:
+            if root not in self._data:
+                return MISSING
+            node = self._get_at(self._data[root], segments)
+            index = self._indexes.get((root, segments, child))
+            if index is None:
+                index = _Index(child)
+                index.build(node)
+                self._indexes[(root, segments, child)] = index
+            key = index.first(value)
+            if key is None:
+                return None
+            return key, deepcopy(node[key])
+
+    def _reindex(self, root: str, segments: Tuple[str, ...]) -> None:
+        """ Updates the indexes affected by a write at segments below root """
+        for (index_root, path, child), index in self._indexes.items():
+            if index_root != root:
+                continue
+            if segments[:len(path)] == path and len(segments) > len(path):
+                # Only one entry of the indexed node changed
+                key = segments[len(path)]
+                index.update(key, self._get_at(self._data.get(root), path + (key,)))
+            elif path[:len(segments)] == segments:
+                # The whole node was replaced
+                index.build(self._get_at(self._data.get(root), path))
+
+    def apply(self, path: str, value) -> None:
+        """ Sets value at path if it's replicated. Used to apply the bot's own writes right away. """
+        located = self._locate(path)
+        if located is None:
+            return
+        root, segments = located
+        with self._lock:
+            if root not in self._data:
+                return
+            self._data[root] = self._set_at(self._data[root], segments, deepcopy(value))
+            self._reindex(root, segments)
+            self._dirty = True
+
+    def _on_event(self, root: str, event_type: str, path: str, data) -> None:
+        """ Applies an event from a change listener """
+        segments = self._split(path)
+        with self._lock:
+            if event_type == 'put':
+                self._data[root] = self._set_at(self._data.get(root), segments, data)
+                self._reindex(root, segments)
+            elif event_type == 'patch':
+                for key, value in (data or {}).items():
+                    self._data[root] = self._set_at(self._data.get(root), segments + self._split(key),
+                                                    value)
+                    self._reindex(root, segments + self._split(key))
+            else:
+                return
+            caught_up = root not in self._synced
+            if caught_up:
+                self._synced.add(root)
+                Logger.INFO(f"Replica of `{root}` caught up with the database")
+            self._dirty = True
+            save = caught_up or monotonic() - self._saved_at >= self.snapshot_interval
+        if save:
+            self.save_snapshot()
+
+    def start(self, listen: Callable[[str, Callable], object]) -> None:
+        """
+        Subscribes to every subtree. listen is called with the path and a callback
+        taking an event with event_type, path and data attributes, and returns
+        a registration with a close() method.
+        """
+        for root in self.paths:
+            root = '/'.join(root)
+
+            def callback(event, root=root):
+                self._on_event(root, event.event_type, event.path, event.data)
+
+            self._registrations.append(listen(root, callback))
+            Logger.DEBUG(f"Listening for changes at `{root}`")
+
+    def stop(self) -> None:
+        """ Closes the listeners and saves the snapshot """
+        for registration in self._registrations:
+            registration.close()
+        self._registrations = []
+        self.save_snapshot()
+
+    def load_snapshot(self) -> bool:
+        """ Loads the snapshot saved by a previous run. Returns False if there isn't one. """
+        if self.snapshot_path is None or not os.path.isfile(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            Logger.WARNING(f"Could not load replica snapshot: {e}")
+            return False
+        roots = {'/'.join(root) for root in self.paths}
+        with self._lock:
+            for root, data in snapshot.items():
+                # The snapshot may have been saved with other paths configured
+                if root in roots and root not in self._data:
+                    self._data[root] = data
+        Logger.INFO(f"Loaded replica snapshot of {len(snapshot)} path(s) from {self.snapshot_path}")
+        return True
+
+    def save_snapshot(self) -> None:
+        """ Writes the replicated data to disk if it changed """
+        if self.snapshot_path is None:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                snapshot = json.dumps(self._data)
+                self._dirty = False
+                self._saved_at = monotonic()
+            tmp_path = f"{self.snapshot_path}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(snapshot)
+                os.replace(tmp_path, self.snapshot_path)
+            except OSError as e:
+                Logger.ERROR(f"Could not save replica snapshot: {e}")
@@ -9,7 +9,9 @@
 from config import PROJ_CACHE_PATH
 from log import Logger
 
+from ..utils.custom_cache import CustomCache
 from ..utils.helper import Helper
+from ..utils.single_flight import SingleFlight
 
 
 class AssetsStorage:
@@ -36,6 +38,18 @@ def __init__(self) -> None:
         self.class_name = __class__.__name__
         self._audio_cache_path = f"{PROJ_CACHE_PATH}/{self.class_name}"
         self._audio_file_path = ""
+        # Concurrent listings of the same folder share one request
+        self.flight = SingleFlight(self.class_name)
+        # (prefix, delimiter): blobs. Cleared whenever the bot changes the bucket.
+        # Blobs can't be shared with other processes, but clearing it is announced
+        self._index = CustomCache(maxsize=64, ttl=600, shared=True, name='assets_index')
+
+    def warm_index(self) -> None:
+        """ Lists the audio clips ahead of the first command that needs them """
+        self.get_blobs(prefix="audio/", return_as_list=True)
+
+    def invalidate_index(self) -> None:
+        self._index.clear()
 
     def remove_audio_file(self):
         """ Removes the file stored at this path. """
@@ -90,6 +104,7 @@ def upload_from_memory(self, contents, dst_blob_name: str,
             blob_name = f"{category}/{dst_blob_name}"
         blob = self.get_blob(blob_name)
         blob.upload_from_string(contents, content_type=content_type)
+        self.invalidate_index()
 
     def download_to_file_with_name(self, blob_name: str, filename: str):
         """ 
@@ -154,6 +169,7 @@ def delete_obj(self, blob_name: str) -> bool:
         blob.reload()
         generation_match_precondition = blob.generation
         blob.delete(if_generation_match=generation_match_precondition)
+        self.invalidate_index()
         return True
 
     def rename_obj(self, old_blob_name: str, new_blob_name: str):
@@ -174,6 +190,7 @@ def rename_obj(self, old_blob_name: str, new_blob_name: str):
             new_name=new_blob_name,
             if_generation_match=destination_generation_match_precondition)
         self._storage_bucket.delete_blob(old_blob_name)
+        self.invalidate_index()
 
     def get_blobs(self, prefix: str = None, delimiter: str = None,
                   return_as_list: bool = False):
@@ -209,15 +226,30 @@ def get_blobs(self, prefix: str = None, delimiter: str = None,
 
         Source for comments above:     
         https://cloud.google.com/storage/docs/listing-objects#storage-list-objects-python
+
+        Lists are kept for a few minutes and shared by concurrent callers asking
+        for the same prefix and delimiter. Iterators can only be consumed once,
+        so they never are.
         """
+        if return_as_list:
+            key = (prefix, delimiter)
+            blobs = self._index.get(key)
+            if blobs is None:
+                blobs = self.flight.do(('list_blobs', prefix, delimiter),
+                                       self._list_blobs, prefix, delimiter)
+                self._index.add(key, blobs)
+            return list(blobs)
+        return self._storage_bucket.list_blobs(
+            prefix=prefix,
+            delimiter=delimiter
+        )
+
+    def _list_blobs(self, prefix: str = None, delimiter: str = None) -> List[Blob]:
         iterator = self._storage_bucket.list_blobs(
             prefix=prefix,
             delimiter=delimiter
         )
-        if return_as_list:
-            blobs = [blob for blob in iterator]
-            return blobs
-        return iterator
+        return [blob for blob in iterator]
 
     def list_blobs_as_str(self, prefix: str):
         """ Gets all the blobs for a specific prefix, then prepare a list
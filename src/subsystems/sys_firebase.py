@@ -1,44 +1,182 @@
 # from utils.custom_cache import CustomCache
-from firebase_admin import db
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+
+from firebase_admin import db, exceptions
 
 from log import Logger
 
+from ..utils.push_key import generate_push_key
+from .db_backend import DatabaseBackend, key_order
+from .replica import MISSING, Replica
+from .write_buffer import WriteBuffer
+
+
+class FirebaseBackend(DatabaseBackend):
+    """ Backend that stores the data in Firebase's Realtime Database """
+
+    supports_listen = True
+
+    def _get_ref(self, path: str) -> db.reference:
+        """ Get database reference. """
+        return db.reference(path)
+
+    def get(self, path: str):
+        """ Retrieve any specified data from the database """
+        return self._get_ref(path).get()
+
+    def get_keys(self, path: str) -> List[str]:
+        """ Retrieve only the keys of the children, without their data """
+        data = self._get_ref(path).get(shallow=True)
+        return list(data) if isinstance(data, dict) else []
+
+    def get_page(self, path: str, limit: int, start_at: str = None,
+                 from_end: bool = False) -> dict:
+        query = self._get_ref(path).order_by_key()
+        if from_end:
+            if start_at is not None:
+                query = query.end_at(start_at)
+            return query.limit_to_last(limit).get()
+        if start_at is not None:
+            query = query.start_at(start_at)
+        return query.limit_to_first(limit).get()
+
+    def query_by_child(self, path: str, child: str, value) -> dict:
+        """ 
+        Retrieve only the entries whose child equals value. The query runs on the
+        server, which needs an index on the child to answer it efficiently:
+        https://firebase.google.com/docs/database/security/indexing-data
+        """
+        return self._get_ref(path).order_by_child(child).equal_to(value).get()
+
+    def update(self, path: str, data: dict) -> None:
+        """ Update any existing data from the database """
+        try:
+            self._get_ref(path).update(data)
+        except exceptions.InvalidArgumentError as e:
+            # Rejected by the server, e.g. for a key with '.', so retrying won't help
+            raise ValueError(str(e)) from e
+
+    def delete(self, path: str) -> None:
+        """ Remove specified data from the database """
+        self._get_ref(path).delete()
+
+    def transaction(self, path: str, update):
+        """ Retried by Firebase with the latest data until no other write conflicts """
+        return self._get_ref(path).transaction(update)
+
+    def listen(self, path: str, callback):
+        return self._get_ref(path).listen(callback)
+
 
 class Database():
     """ 
-    Database Subsystem that accesses the bot's cloud database 
+    Database Subsystem that accesses the bot's database, Firebase's Realtime
+    Database by default or a local one through another DatabaseBackend.
     See below link for list of data types supported for this DB:
     https://firebase.google.com/docs/firestore/manage-data/data-types
     """
 
-    def __init__(self) -> None:
-        """ Set up Firebase Realtime Database """
+    def __init__(self, max_workers: int = 4, timeout: float = 10.0,
+                 write_behind: bool = False, flush_interval: float = 0.05,
+                 max_batch: int = 100, journal_path: str = None,
+                 replica_paths: list = None, snapshot_path: str = None,
+                 backend: DatabaseBackend = None) -> None:
+        """ 
+        Set up Firebase Realtime Database 
+
+        firebase_admin only offers blocking calls. The *_async methods run them on a
+        bounded thread pool so a slow response never stalls the event loop.
+        At most max_workers calls are in flight at once, and each call raises
+        asyncio.TimeoutError after timeout seconds.
+
+        With write_behind on, add_async, update_async and delete_async queue their
+        writes in a WriteBuffer, which merges them into one multi-location update
+        every flush_interval seconds or every max_batch paths.
+
+        With replica_paths given, those subtrees are kept in memory by a Replica and
+        reads below them never leave the process. The replica starts from the
+        snapshot at snapshot_path and catches up once start_replica() is called.
+        Backends that can't listen for changes don't support a replica.
+
+        The data is stored by backend, Firebase unless another one is given.
+        """
         # Set up cache
         # self._cache = CustomCache()
-        pass
-
-    def _get_ref(self, path: str) -> db.reference:
-        """ Get database reference. """
-        return db.reference(path)
+        self.timeout = timeout
+        self._backend = backend if backend is not None else FirebaseBackend()
+        self._max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix=__class__.__name__)
+        self._semaphore = None
+        self._loop = None
+        self._write_buffer = None
+        if write_behind:
+            self._write_buffer = WriteBuffer(
+                commit=lambda updates: self._run(self._backend.update, '/', updates),
+                journal_path=journal_path,
+                flush_interval=flush_interval,
+                max_batch=max_batch
+            )
+        self._replica = None
+        if replica_paths and self._backend.supports_listen:
+            self._replica = Replica(replica_paths, snapshot_path=snapshot_path)
+            self._replica.load_snapshot()
 
-    def _push_update(self, ref: db.reference, data: dict) -> None:
+    def start_replica(self) -> None:
         """ 
-        Push any new updates to the database, which is basically
-        another way of adding new data.
+        Subscribes the replica to its subtrees in the background. Until it has
+        caught up, reads are served from the snapshot (or go to the database
+        if there was none).
         """
-        ref.push().update(data)
+        if self._replica is not None:
+            self._executor.submit(self._replica.start, self._backend.listen)
 
-    def _update(self, ref: db.reference, data: dict) -> None:
-        """ Update any existing data from the database """
-        ref.update(data)
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """ Creates the semaphore for the running event loop if needed """
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self._max_workers)
+            self._loop = loop
+        return self._semaphore
 
-    def _remove(self, ref: db.reference, key) -> None:
-        """ Remove specified data given a key from the database """
-        ref.child(key).delete()
+    async def _run(self, func, *args, **kwargs):
+        """ 
+        Runs a blocking call on the executor and waits for it without blocking
+        the event loop. A call that times out keeps its slot until its thread
+        finishes, so timeouts can't pile up more work on the executor.
+        """
+        semaphore = self._get_semaphore()
+        await semaphore.acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+        except BaseException:
+            semaphore.release()
+            raise
+        future.add_done_callback(lambda _: semaphore.release())
+        return await asyncio.wait_for(asyncio.shield(future), self.timeout)
 
-    def _get_data(self, ref: db.reference) -> dict:
-        """ Retrieve any specified data from the database """
-        return ref.get()
+    async def flush(self) -> None:
+        """ Commits any writes that are still queued """
+        if self._write_buffer is not None:
+            await self._write_buffer.flush()
+
+    async def close(self) -> None:
+        """ 
+        Commits any queued writes, then stops the executor. Calls that are still
+        running are left to finish.
+        """
+        try:
+            if self._write_buffer is not None:
+                await self._write_buffer.close()
+        finally:
+            if self._replica is not None:
+                self._replica.stop()
+            self._executor.shutdown(wait=False)
+            self._backend.close()
 
     def get_key_value_pair(self, data: dict, target: dict) -> list:
         """ 
@@ -57,32 +195,210 @@ def get_key_value_pair(self, data: dict, target: dict) -> list:
     # def cache(self):
     #     return self._cache
 
-    def add(self, path: str, data: dict) -> None:
-        """ Add data at a specific path in the database """
-        Logger.DEBUG(f"Data to be added: {data}")
-        Logger.DEBUG(f"Adding data at: {path}")
+    def add(self, path: str, data: dict) -> str:
+        """ 
+        Add data at a specific path in the database. Returns the
+        unique key generated for the data.
+        """
+        Logger.DEBUG("Data to be added: %s", data)
+        Logger.DEBUG("Adding data at: %s", path)
         # if data not in self._cache:
         #     cache_key = ()
         #     self._cache[cache_key] = data
-        self._push_update(ref=self._get_ref(path), data=data)
+        # Generating the key locally saves the round trip that push() makes
+        key = generate_push_key()
+        self._backend.update(path, {key: data})
+        self._apply_to_replica(path, {key: data})
+        return key
 
     def update(self, path: str, data: dict) -> None:
         """ Update data at a specific path in the database """
-        Logger.DEBUG(f"New data that will update old: {data}")
-        Logger.DEBUG(f"Updating data at: {path}")
-        self._update(ref=self._get_ref(path), data=data)
+        Logger.DEBUG("New data that will update old: %s", data)
+        Logger.DEBUG("Updating data at: %s", path)
+        self._backend.update(path, data)
+        self._apply_to_replica(path, data)
 
     def delete(self, path: str, key) -> None:
         """ Remove data from a specific path in the database """
-        Logger.DEBUG(f"Key of the data that will be removed: {key}")
-        Logger.DEBUG(f"Deleting data from: {path}")
-        self._remove(ref=self._get_ref(path), key=key)
+        Logger.DEBUG("Key of the data that will be removed: %s", key)
+        Logger.DEBUG("Deleting data from: %s", path)
+        self._backend.delete(f"{path}/{key}")
+        self._apply_to_replica(path, {key: None})
+
+    def transaction(self, path: str, update) -> object:
+        """ 
+        Atomically replaces the data at path with update(data), e.g. to claim
+        something only if nobody else has. Returns the new data.
+        """
+        Logger.DEBUG("Running a transaction at: %s", path)
+        data = self._backend.transaction(path, update)
+        if self._replica is not None:
+            self._replica.apply(path, data)
+        return data
+
+    def _apply_to_replica(self, path: str, data: dict) -> None:
+        """ Applies the bot's own writes to the replica without waiting for the listener """
+        if self._replica is not None:
+            for key, value in data.items():
+                self._replica.apply(f"{path}/{key}", value)
 
     # @CustomCache()
     def read(self, path: str) -> dict:
         """ Get data from a specific path in the database """
-        Logger.DEBUG(f"Reading data from: {path}")
-        data = self._get_data(ref=self._get_ref(path))
+        if self._replica is not None:
+            data = self._replica.get(path)
+            if data is not MISSING:
+                return data
+        Logger.DEBUG("Reading data from: %s", path)
+        data = self._backend.get(path)
         # if data not in self.cache:
         #     self.cache.add()
         return data
+
+    def find_by_child(self, path: str, child: str, value) -> Optional[Tuple[str, dict]]:
+        """ 
+        Finds the entry at path whose child equals value, e.g. the Twitch user with
+        a given name. Returns its unique key and its data, or None if there isn't one.
+        Replicated paths are looked up in memory, others are queried on the server.
+        """
+        if self._replica is not None:
+            result = self._replica.find(path, child, value)
+            if result is not MISSING:
+                return result
+        Logger.DEBUG("Querying %s by %s", path, child)
+        data = self._backend.query_by_child(path, child, value)
+        for key in data or {}:
+            return key, data[key]
+        return None
+
+    async def find_by_child_async(self, path: str, child: str, value) -> Optional[Tuple[str, dict]]:
+        """ Non-blocking version of find_by_child() """
+        if self._replica is not None:
+            result = self._replica.find(path, child, value)
+            if result is not MISSING:
+                return result
+        await self._flush_pending()
+        return await self._run(self.find_by_child, path, child, value)
+
+    def keys(self, path: str) -> List[str]:
+        """ Lists the keys of the children at path in order, without downloading their data """
+        if self._replica is not None:
+            keys = self._replica.keys(path)
+            if keys is not MISSING:
+                return keys
+        Logger.DEBUG("Reading keys from: %s", path)
+        return sorted(self._backend.get_keys(path), key=key_order)
+
+    def read_page(self, path: str, limit: int, start_after: str = None,
+                  from_end: bool = False) -> dict:
+        """ 
+        Reads up to limit children at path, ordered by key, that come after the key
+        start_after. Pass the last key of a page to get the next page. If from_end is
+        True, pages are read backwards: the children come before start_after, and the
+        first key of a page is passed to get the previous one.
+        """
+        if self._replica is not None:
+            page = self._replica.page(path, limit, start_after, from_end)
+            if page is not MISSING:
+                return page
+        # start_at/end_at are inclusive, so one more child is read and the cursor dropped
+        fetch_limit = limit if start_after is None else limit + 1
+        Logger.DEBUG("Reading page of %d from: %s", limit, path)
+        data = self._backend.get_page(path, fetch_limit, start_after, from_end) or {}
+        keys = [key for key in sorted(data, key=key_order) if key != start_after]
+        keys = keys[-limit:] if from_end else keys[:limit]
+        return {key: data[key] for key in keys}
+
+    def iter_children(self, path: str, page_size: int = 100) -> Iterator[Tuple[str, object]]:
+        """ Iterates over the children at path one page at a time, yielding (key, data) """
+        start_after = None
+        while True:
+            page = self.read_page(path, page_size, start_after)
+            yield from page.items()
+            if len(page) < page_size:
+                return
+            start_after = list(page)[-1]
+
+    async def keys_async(self, path: str) -> List[str]:
+        """ Non-blocking version of keys() """
+        if self._replica is not None and self._replica.covers(path):
+            return self.keys(path)
+        await self._flush_pending()
+        return await self._run(self.keys, path)
+
+    async def read_page_async(self, path: str, limit: int, start_after: str = None,
+                              from_end: bool = False) -> dict:
+        """ Non-blocking version of read_page() """
+        if self._replica is not None and self._replica.covers(path):
+            return self.read_page(path, limit, start_after, from_end)
+        await self._flush_pending()
+        return await self._run(self.read_page, path, limit, start_after, from_end)
+
+    async def iter_children_async(self, path: str,
+                                  page_size: int = 100) -> AsyncIterator[Tuple[str, object]]:
+        """ Non-blocking version of iter_children() """
+        start_after = None
+        while True:
+            page = await self.read_page_async(path, page_size, start_after)
+            for key, value in page.items():
+                yield key, value
+            if len(page) < page_size:
+                return
+            start_after = list(page)[-1]
+
+    async def _flush_pending(self) -> None:
+        """ Commits queued writes so a read from the database includes them """
+        if self._write_buffer is not None and len(self._write_buffer) > 0:
+            await self._write_buffer.flush()
+
+    async def add_async(self, path: str, data: dict, wait: bool = False) -> str:
+        """ 
+        Non-blocking version of add(). With write-behind, the write is committed
+        in the background unless wait is True, which waits for the commit and
+        raises if the database rejected the write.
+        """
+        if self._write_buffer is None:
+            return await self._run(self.add, path, data)
+        key = generate_push_key()
+        written = self._write_buffer.set(f"{path}/{key}", data)
+        self._apply_to_replica(path, {key: data})
+        if wait:
+            await written
+        return key
+
+    async def update_async(self, path: str, data: dict, wait: bool = False) -> None:
+        """ Non-blocking version of update(). See add_async() for wait. """
+        if self._write_buffer is None:
+            await self._run(self.update, path, data)
+            return
+        written = [self._write_buffer.set(f"{path}/{key}", value) for key, value in data.items()]
+        self._apply_to_replica(path, data)
+        if wait:
+            await asyncio.gather(*written)
+
+    async def delete_async(self, path: str, key, wait: bool = False) -> None:
+        """ Non-blocking version of delete(). See add_async() for wait. """
+        if self._write_buffer is None:
+            await self._run(self.delete, path, key)
+            return
+        written = self._write_buffer.set(f"{path}/{key}", None)
+        self._apply_to_replica(path, {key: None})
+        if wait:
+            await written
+
+    async def transaction_async(self, path: str, update) -> object:
+        """ Non-blocking version of transaction(). Queued writes are committed first. """
+        await self._flush_pending()
+        return await self._run(self.transaction, path, update)
+
+    async def read_async(self, path: str) -> dict:
+        """ 
+        Non-blocking version of read(). Replicated paths are answered from memory.
+        Otherwise, queued writes are committed first so the result always includes them.
+        """
+        if self._replica is not None:
+            data = self._replica.get(path)
+            if data is not MISSING:
+                return data
+        await self._flush_pending()
+        return await self._run(self.read, path)
@@ -0,0 +1,178 @@
+import json
+import sqlite3
+import threading
+from typing import Iterable, List, Tuple
+
+from log import Logger
+
+from .db_backend import DatabaseBackend, key_order
+
+
+class SQLiteBackend(DatabaseBackend):
+    """
+    Backend that stores the data in a local SQLite file, so the bot can run and
+    be benchmarked without network access or Firebase credentials.
+
+    The tree is flattened into one row per leaf value, keyed by its full path
+    (e.g. `twitch_users/<key>/user`) and stored as JSON. Because '/' sorts right
+    before '0', everything below a path is the contiguous key range
+    [path + '/', path + '0'), so subtree reads and deletes are index range scans.
+
+    The database runs in WAL mode with synchronous=NORMAL: readers never wait on
+    the writer, and a commit only syncs the log when it's checkpointed.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        # The connection is shared by the threads of the Database's executor
+        self._conn = sqlite3.connect(file_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS nodes (path TEXT PRIMARY KEY, value TEXT NOT NULL) "
+                "WITHOUT ROWID")
+            # Lets query_by_child() look up leaves by value
+            self._conn.execute("CREATE INDEX IF NOT EXISTS nodes_value ON nodes (value)")
+        Logger.DEBUG(f"Opened SQLite database at {file_path}")
+
+    @staticmethod
+    def _normalize(path: str) -> str:
+        return '/'.join(segment for segment in path.split('/') if segment)
+
+    @staticmethod
+    def _join(path: str, key: str) -> str:
+        return SQLiteBackend._normalize(f"{path}/{key}")
+
+    def _rows(self, path: str) -> List[Tuple[str, str]]:
+        """ Returns the leaf rows at or below path """
+        if not path:
+            return self._conn.execute("SELECT path, value FROM nodes").fetchall()
+        return self._conn.execute(
+            "SELECT path, value FROM nodes WHERE path = ? OR (path >= ? AND path < ?)",
+            (path, f"{path}/", f"{path}0")).fetchall()
+
+    @staticmethod
+    def _build(path: str, rows: Iterable[Tuple[str, str]]):
+        """ Turns leaf rows back into the tree below path """
+        tree = None
+        offset = len(path) + 1 if path else 0
+        for row_path, value in rows:
+            if row_path == path:
+                return json.loads(value)
+            if tree is None:
+                tree = {}
+            segments = row_path[offset:].split('/')
+            node = tree
+            for segment in segments[:-1]:
+                node = node.setdefault(segment, {})
+            node[segments[-1]] = json.loads(value)
+        return tree
+
+    def _get(self, path: str):
+        return self._build(path, self._rows(path))
+
+    def get(self, path: str):
+        path = self._normalize(path)
+        with self._lock:
+            return self._get(path)
+
+    def _get_keys(self, path: str) -> List[str]:
+        if not path:
+            rows = self._conn.execute(
+                "SELECT DISTINCT substr(path, 1, instr(path || '/', '/') - 1) FROM nodes")
+        else:
+            start = len(path) + 2
+            rows = self._conn.execute(
+                "SELECT DISTINCT substr(path, ?, instr(substr(path, ?) || '/', '/') - 1) "
+                "FROM nodes WHERE path >= ? AND path < ?",
+                (start, start, f"{path}/", f"{path}0"))
+        return [row[0] for row in rows]
+
+    def get_keys(self, path: str) -> List[str]:
+        path = self._normalize(path)
+        with self._lock:
+            return self._get_keys(path)
+
+    def get_page(self, path: str, limit: int, start_at: str = None,
+                 from_end: bool = False) -> dict:
+        path = self._normalize(path)
+        with self._lock:
+            keys = sorted(self._get_keys(path), key=key_order)
+            if start_at is not None:
+                start = key_order(start_at)
+                if from_end:
+                    keys = [key for key in keys if key_order(key) <= start]
+                else:
+                    keys = [key for key in keys if key_order(key) >= start]
+            keys = keys[-limit:] if from_end else keys[:limit]
+            return {key: self._get(self._join(path, key)) for key in keys}
+
+    def query_by_child(self, path: str, child: str, value) -> dict:
+        path = self._normalize(path)
+        prefix = f"{path}/" if path else ''
+        with self._lock:
+            if path:
+                rows = self._conn.execute(
+                    "SELECT path FROM nodes WHERE value = ? AND path >= ? AND path < ?",
+                    (json.dumps(value), prefix, f"{path}0")).fetchall()
+            else:
+                rows = self._conn.execute("SELECT path FROM nodes WHERE value = ?",
+                                          (json.dumps(value),)).fetchall()
+            result = {}
+            for (row_path,) in rows:
+                segments = row_path[len(prefix):].split('/')
+                if len(segments) == 2 and segments[1] == child:
+                    result[segments[0]] = self._get(f"{prefix}{segments[0]}")
+            return result
+
+    def _delete(self, path: str) -> None:
+        """ Removes path, everything below it and any leaf above it """
+        segments = path.split('/')
+        ancestors = ['/'.join(segments[:i]) for i in range(1, len(segments))]
+        self._conn.executemany("DELETE FROM nodes WHERE path = ?",
+                               [(ancestor,) for ancestor in ancestors + [path]])
+        self._conn.execute("DELETE FROM nodes WHERE path >= ? AND path < ?",
+                           (f"{path}/", f"{path}0"))
+
+    def _set(self, path: str, value) -> None:
+        if not path:
+            raise ValueError("Cannot write to the root of the database")
+        self._delete(path)
+        self._conn.executemany("INSERT INTO nodes (path, value) VALUES (?, ?)",
+                               self._flatten(path, value))
+
+    @staticmethod
+    def _flatten(path: str, value) -> Iterable[Tuple[str, str]]:
+        """ Yields a row for each leaf of value. None and empty dicts have none. """
+        if isinstance(value, dict):
+            for key, child in value.items():
+                yield from SQLiteBackend._flatten(SQLiteBackend._join(path, str(key)), child)
+        elif value is not None:
+            yield path, json.dumps(value)
+
+    def update(self, path: str, data: dict) -> None:
+        path = self._normalize(path)
+        with self._lock, self._conn:
+            for key, value in data.items():
+                self._set(self._join(path, str(key)), value)
+
+    def delete(self, path: str) -> None:
+        path = self._normalize(path)
+        with self._lock, self._conn:
+            self._set(path, None)
+
+    def transaction(self, path: str, update):
+        path = self._normalize(path)
+        with self._lock, self._conn:
+            # Takes the write lock before reading, so other processes using the
+            # file can't write in between
+            self._conn.execute("BEGIN IMMEDIATE")
+            value = update(self._get(path))
+            self._set(path, value)
+            return value
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
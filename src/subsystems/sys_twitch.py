@@ -4,6 +4,8 @@
 
 from log import Logger
 
+from ..utils.custom_cache import CustomCache
+from ..utils.helper import Helper
 from .sys_firebase import Database
 
 
@@ -16,10 +18,14 @@ class TwitchNotification():
 
     def __init__(self, database: Database) -> None:
         self.twitch = Twitch(os.getenv('TWITCH_CLIENT_ID'),
-                             os.getenv('TWITCH_CLIENT_SECRET'))
-        self.twitch.authenticate_app([])
+                             os.getenv('TWITCH_CLIENT_SECRET'),
+                             authenticate_app=False)
         self.database = database
 
+    def authenticate(self) -> None:
+        """ Gets an app access token. Blocks until Twitch responds. """
+        self.twitch.authenticate_app([])
+
     def _get_twitch_stream(self, user_id: str) -> any:
         """ Get data about any active streams """
         return self.twitch.get_streams(user_id=user_id)
@@ -48,15 +54,23 @@ def get_twitch_id(self, user):
         """ Get numerical id of the user """
         return self._get_id(user)
 
+    # Logins rarely change hands, so a stale ID is fine while it's refreshed
+    @CustomCache(maxsize=256, ttl=3600, stale_ttl=86400, key=lambda self, user: user.lower(),
+                 shared=True, name='twitch_ids')
+    async def get_twitch_id_async(self, user):
+        """ Non-blocking, cached version of get_twitch_id() """
+        return await Helper.run_in_thread(self.get_twitch_id, user)
+
     async def add_twitch_user(self, twitch_user: str, twitch_id, path: str) -> None:
         """ Adds Twitch user to the database """
         try:
-            self.database.add(
+            await self.database.add_async(
                 path=path,
                 data={
                     "user": twitch_user,
                     "user_id": twitch_id
-                }
+                },
+                wait=True
             )
             Logger.DEBUG(f"Added {twitch_user} (ID: {twitch_id}) to database!")
         except Exception as e:
@@ -67,12 +81,13 @@ async def add_twitch_user(self, twitch_user: str, twitch_id, path: str) -> None:
     async def update_twitch_user(self, old_twitch_user: str, new_twitch_user: str, path: str) -> None:
         """ Updates Twitch user on the database """
         try:
-            self.database.update(
+            await self.database.update_async(
                 path=path,
                 data={
                     "user": new_twitch_user,
-                    "user_id": self.get_twitch_id(new_twitch_user)
-                }
+                    "user_id": await self.get_twitch_id_async(new_twitch_user)
+                },
+                wait=True
             )
             Logger.DEBUG(f"Updated {old_twitch_user} to {new_twitch_user}!")
         except Exception as e:
@@ -82,12 +97,20 @@ async def update_twitch_user(self, old_twitch_user: str, new_twitch_user: str, p
     async def delete_twitch_user(self, twitch_user: str, key, path: str) -> None:
         """ Deletes the key of the Twitch user on the database """
         try:
-            self.database.delete(path=path, key=key)
+            await self.database.delete_async(path=path, key=key, wait=True)
             Logger.DEBUG(f"Deleted {twitch_user}!")
         except Exception as e:
             Logger.CRITICAL(f"Could not delete {twitch_user}")
             Logger.CRITICAL(e)
 
-    def get_data_from_db(self, path: str):
+    async def find_twitch_user(self, twitch_user: str, path: str):
+        """ Finds a Twitch user in the database by name. Returns its key and data, or None. """
+        return await self.database.find_by_child_async(path, 'user', twitch_user)
+
+    async def find_twitch_user_by_id(self, twitch_id: str, path: str):
+        """ Finds a Twitch user in the database by ID. Returns its key and data, or None. """
+        return await self.database.find_by_child_async(path, 'user_id', twitch_id)
+
+    async def get_data_from_db(self, path: str):
         """ Get data from database """
-        return self.database.read(path)
+        return await self.database.read_async(path)
@@ -0,0 +1,247 @@
+import asyncio
+import json
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from log import Logger
+
+from ..utils.helper import Helper
+
+
+class WriteBuffer:
+    """
+    Write-behind buffer for the database. Writes are queued in memory and merged
+    into a single multi-location update, which is committed every flush_interval
+    seconds or as soon as max_batch paths are pending, whichever comes first.
+
+    Queued writes are appended to a local journal (JSON lines) at the start of
+    each flush, before the commit, so writes that were queued but not committed
+    yet survive a crash. They're appended and synced to disk in one batch, in a
+    thread, rather than one by one on the event loop; the price is that a crash
+    loses the writes of the last flush_interval at most. The journal is replayed
+    when the buffer is created and rewritten after each successful commit.
+
+    A commit that fails with ValueError, meaning the database rejected a write
+    as invalid (e.g. a key with '.' or '$'), is split in halves until the
+    invalid writes are found. Those are dropped with an error, so they don't
+    block the others; any other error keeps the batch for a retry.
+
+    Paths are absolute and separated by '/'. A value of None deletes the path.
+    """
+
+    def __init__(self, commit: Callable[[Dict[str, Any]], Awaitable[None]],
+                 journal_path: str = None, flush_interval: float = 0.05,
+                 max_batch: int = 100) -> None:
+        self._commit = commit
+        self.journal_path = journal_path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
+        # path: value
+        self._pending: Dict[str, Any] = {}
+        # path: futures of the writes merged into its pending value
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        self._journal = None
+        # Journal lines of the writes queued since the last flush
+        self._journal_lines: List[str] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Future] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._loop = None
+
+        self.writes = 0
+        self.commits = 0
+
+        if self.journal_path is not None:
+            self._replay_journal()
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    @staticmethod
+    def _normalize(path: str) -> str:
+        return '/'.join(segment for segment in path.split('/') if segment)
+
+    def _merge(self, path: str, value) -> str:
+        """
+        Merges a write into the pending ones. Firebase rejects updates where one
+        path is the ancestor of another, so a write below a pending path is folded
+        into that path's value, and a write above pending paths replaces them.
+        Returns the pending path the write ended up in.
+        """
+        segments = path.split('/')
+        for i in range(1, len(segments)):
+            ancestor = '/'.join(segments[:i])
+            if ancestor in self._pending:
+                node = self._pending[ancestor]
+                node = dict(node) if isinstance(node, dict) else {}
+                self._pending[ancestor] = node
+                for segment in segments[i:-1]:
+                    child = node.get(segment)
+                    child = dict(child) if isinstance(child, dict) else {}
+                    node[segment] = child
+                    node = child
+                if value is None:
+                    node.pop(segments[-1], None)
+                else:
+                    node[segments[-1]] = value
+                return ancestor
+
+        descendant_prefix = path + '/'
+        for pending_path in [p for p in self._pending if p.startswith(descendant_prefix)]:
+            del self._pending[pending_path]
+            # Committed along with path from now on
+            waiters = self._waiters.pop(pending_path, None)
+            if waiters is not None:
+                self._waiters.setdefault(path, []).extend(waiters)
+        self._pending[path] = value
+        return path
+
+    def _replay_journal(self) -> None:
+        """ Loads writes that were queued but not committed before the last shutdown """
+        if not os.path.isfile(self.journal_path):
+            return
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Most likely the last line, cut off by a crash
+                    Logger.WARNING(f"Skipping corrupt line in {self.journal_path}")
+                    continue
+                self._merge(entry['path'], entry['value'])
+        if self._pending:
+            Logger.INFO(f"Recovered {len(self._pending)} pending write(s) from {self.journal_path}")
+
+    def _append_journal(self, lines: List[str]) -> None:
+        if self._journal is None or not lines:
+            return
+        self._journal.write(''.join(lines))
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _rewrite_journal(self, pending: Dict[str, Any]) -> None:
+        """ Replaces the journal with the writes that are still pending """
+        if self._journal is None:
+            return
+        self._journal.close()
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for path, value in pending.items():
+                f.write(json.dumps({'path': path, 'value': value}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+
+    def set(self, path: str, value) -> asyncio.Future:
+        """
+        Queues a write of value at path. The write is committed in the background;
+        the returned future can be awaited to know when, and raises ValueError if
+        the database rejected it.
+        """
+        path = self._normalize(path)
+        if not path:
+            raise ValueError("Cannot write to the root of the database")
+        if self._journal is not None:
+            self._journal_lines.append(json.dumps({'path': path, 'value': value}) + '\n')
+        future = asyncio.get_running_loop().create_future()
+        # Nobody has to await it, so its error mustn't be reported as never retrieved
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._waiters.setdefault(self._merge(path, value), []).append(future)
+        self.writes += 1
+        self._schedule_flush()
+        return future
+
+    def _schedule_flush(self) -> None:
+        loop = asyncio.get_running_loop()
+        if len(self._pending) >= self.max_batch:
+            self._start_flush(loop)
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.flush_interval, self._start_flush, loop)
+
+    def _start_flush(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._background_flush())
+
+    async def _background_flush(self) -> None:
+        try:
+            await self.flush()
+        except Exception as e:
+            Logger.ERROR(f"Could not commit {len(self._pending)} pending write(s), retrying: {e}")
+            loop = asyncio.get_running_loop()
+            if self._flush_handle is None:
+                self._flush_handle = loop.call_later(max(self.flush_interval, 1.0),
+                                                     self._start_flush, loop)
+
+    def _get_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._flush_lock is None or self._loop is not loop:
+            self._flush_lock = asyncio.Lock()
+            self._loop = loop
+        return self._flush_lock
+
+    async def _commit_valid(self, batch: Dict[str, Any]) -> Dict[str, ValueError]:
+        """
+        Commits batch, or the writes of it the database accepts if it rejects
+        some with ValueError. Returns the rejected paths and their errors.
+        """
+        try:
+            await self._commit(batch)
+            return {}
+        except ValueError as e:
+            if len(batch) == 1:
+                return {path: e for path in batch}
+        items = list(batch.items())
+        half = len(items) // 2
+        rejected = await self._commit_valid(dict(items[:half]))
+        rejected.update(await self._commit_valid(dict(items[half:])))
+        return rejected
+
+    async def flush(self) -> None:
+        """
+        Commits every pending write in one update. If the commit fails, the writes
+        are put back in front of anything queued in the meantime and the error is
+        raised, unless the database rejected them as invalid (see the class).
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        async with self._get_lock():
+            if not self._pending:
+                return
+            # Journaled first, so they're recovered if the commit fails and the bot crashes
+            lines, self._journal_lines = self._journal_lines, []
+            await Helper.run_in_thread(self._append_journal, lines)
+            batch, self._pending = self._pending, {}
+            waiters, self._waiters = self._waiters, {}
+            try:
+                rejected = await self._commit_valid(batch)
+            except BaseException:
+                newer, self._pending = self._pending, batch
+                newer_waiters, self._waiters = self._waiters, waiters
+                for path, value in newer.items():
+                    path_waiters = newer_waiters.get(path, [])
+                    self._waiters.setdefault(self._merge(path, value), []).extend(path_waiters)
+                raise
+            self.commits += 1
+            Logger.DEBUG("Committed %d write(s) in one update", len(batch) - len(rejected))
+            for path, error in rejected.items():
+                Logger.ERROR("Dropped the write to %s, rejected by the database: %s", path, error)
+                for waiter in waiters.pop(path, []):
+                    if not waiter.done():
+                        waiter.set_exception(error)
+            for path_waiters in waiters.values():
+                for waiter in path_waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
+            # Writes queued meanwhile may end up journaled twice, which replays the same
+            await Helper.run_in_thread(self._rewrite_journal, dict(self._pending))
+
+    async def close(self) -> None:
+        """ Commits the pending writes and closes the journal """
+        await self.flush()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
@@ -0,0 +1,173 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import wraps
+from time import monotonic
+from typing import Deque, Dict, Hashable, Optional
+
+from discord.ext import commands
+
+from log import Logger
+
+
+class CommandBusy(Exception):
+    """ A command couldn't be admitted: its wait queue is full or it waited too long """
+
+
+class _Waiter:
+    __slots__ = ('command', 'guild_id', 'limit', 'future', 'queued_at')
+
+    def __init__(self, command: str, guild_id: Optional[int], limit: int,
+                 future: asyncio.Future) -> None:
+        self.command = command
+        self.guild_id = guild_id
+        self.limit = limit
+        self.future = future
+        self.queued_at = monotonic()
+
+
+class AdmissionController:
+    """
+    Caps how many heavy commands run at once: max_running in total, per_guild in
+    each guild, and a per-command limit given by each command (see @admitted).
+    Commands over a limit wait their turn, first come first served per command
+    and guild, in a queue of at most max_queued. Once it's full, or after waiting max_wait
+    seconds, they're turned away instead of piling up on the event loop.
+    """
+
+    def __init__(self, max_running: int = 8, per_guild: int = 2, max_queued: int = 16) -> None:
+        self.max_running = max_running
+        self.per_guild = per_guild
+        self.max_queued = max_queued
+        self._running = 0
+        self._by_command: Dict[str, int] = {}
+        self._by_guild: Dict[Optional[int], int] = {}
+        self._waiters: Deque[_Waiter] = deque()
+
+        self.admitted = 0
+        self.rejected = 0
+        self.queued = 0
+        self._waited = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'running': self._running,
+            'waiting': len(self._waiters),
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'avg_wait_ms': self._waited / self.queued * 1000 if self.queued else 0.0,
+            'max_wait_ms': self.max_wait * 1000,
+        }
+
+    def _fits(self, command: str, guild_id: Optional[int], limit: int) -> bool:
+        return (self._running < self.max_running
+                and self._by_command.get(command, 0) < limit
+                # DMs aren't limited per guild
+                and (guild_id is None or self._by_guild.get(guild_id, 0) < self.per_guild))
+
+    def _take(self, command: str, guild_id: Optional[int]) -> None:
+        self._running += 1
+        self._by_command[command] = self._by_command.get(command, 0) + 1
+        if guild_id is not None:
+            self._by_guild[guild_id] = self._by_guild.get(guild_id, 0) + 1
+        self.admitted += 1
+
+    @staticmethod
+    def _drop(counts: Dict[Hashable, int], key: Hashable) -> None:
+        counts[key] -= 1
+        if counts[key] == 0:
+            del counts[key]
+
+    def _release(self, command: str, guild_id: Optional[int]) -> None:
+        self._running -= 1
+        self._drop(self._by_command, command)
+        if guild_id is not None:
+            self._drop(self._by_guild, guild_id)
+        self._admit_waiters()
+
+    def _admit_waiters(self) -> None:
+        # Waiters go in order per command and guild; a blocked one holds back the later ones
+        blocked = set()
+        for waiter in list(self._waiters):
+            key = (waiter.command, waiter.guild_id)
+            if waiter.future.done():
+                self._waiters.remove(waiter)
+            elif key not in blocked and self._fits(waiter.command, waiter.guild_id, waiter.limit):
+                self._waiters.remove(waiter)
+                self._take(waiter.command, waiter.guild_id)
+                waiter.future.set_result(None)
+            else:
+                blocked.add(key)
+
+    async def _acquire(self, command: str, guild_id: Optional[int], limit: int,
+                       max_wait: float) -> None:
+        if (self._fits(command, guild_id, limit)
+                and not any(waiter.command == command and waiter.guild_id == guild_id
+                            for waiter in self._waiters)):
+            self._take(command, guild_id)
+            return
+        if len(self._waiters) >= self.max_queued:
+            self.rejected += 1
+            raise CommandBusy(command)
+
+        waiter = _Waiter(command, guild_id, limit, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), max_wait)
+        except asyncio.TimeoutError:
+            if not waiter.future.done():
+                waiter.future.cancel()
+                self._waiters.remove(waiter)
+                self.rejected += 1
+                raise CommandBusy(command) from None
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Admitted just as it was cancelled
+                self._release(command, guild_id)
+            else:
+                waiter.future.cancel()
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            raise
+        wait = monotonic() - waiter.queued_at
+        self.queued += 1
+        self._waited += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    @asynccontextmanager
+    async def slot(self, command: str, guild_id: Optional[int], limit: int, max_wait: float):
+        """ Runs the block once the command is admitted. Raises CommandBusy if it isn't. """
+        await self._acquire(command, guild_id, limit, max_wait)
+        try:
+            yield
+        finally:
+            self._release(command, guild_id)
+
+
+def admitted(limit: int = 2, max_wait: float = 10.0):
+    """
+    Runs a command callback through the bot's AdmissionController, with at most
+    limit of it running at once across guilds. Place it below @commands.command.
+    Invocations that aren't admitted get a quick reply saying the bot is busy.
+
+    Slash commands are deferred before waiting, since Discord drops interactions
+    left unanswered for 3 seconds, so the command itself mustn't defer again.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapped(self, ctx: commands.Context, *args, **kwargs):
+            name = ctx.command.qualified_name
+            if ctx.interaction is not None and not ctx.interaction.response.is_done():
+                await ctx.defer()
+            try:
+                async with ctx.bot.admission.slot(name, ctx.guild.id if ctx.guild else None,
+                                                  limit, max_wait):
+                    return await func(self, ctx, *args, **kwargs)
+            except CommandBusy:
+                Logger.WARNING("Turned away %s: too many heavy commands running", name)
+                await ctx.bot.scheduler.reply(
+                    ctx, f"{ctx.author.mention}: I'm busy with too many of those right now, try again in a bit!")
+        return wrapped
+    return decorator
@@ -0,0 +1,134 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import time
+from typing import Callable, Dict, List
+
+from log import Logger
+
+from .http_utils import HTTPClient
+
+DISCORD_API_URL = "https://discord.com/api/v10"
+
+
+def shard_ranges(shard_count: int, processes: int) -> List[List[int]]:
+    """ Splits the shard IDs into contiguous ranges of (nearly) equal size, one per process """
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+async def fetch_recommended_shard_count(token: str) -> int:
+    """ Asks Discord how many shards the bot should run with """
+    loop = asyncio.get_running_loop()
+    async with HTTPClient(loop=loop, name="Gateway") as session:
+        async with session.get(f"{DISCORD_API_URL}/gateway/bot",
+                               headers={'Authorization': f"Bot {token}"}) as response:
+            return (await response.json())['shards']
+
+
+def cancel_on_sigterm(task: asyncio.Task) -> None:
+    """
+    Cancels task on SIGTERM, so a worker running the bot in it closes the bot
+    (flushing writes, releasing the lease...) like it does on Ctrl+C. Later
+    SIGTERMs are ignored rather than cutting that close short.
+    """
+    loop = asyncio.get_running_loop()
+
+    def cancel() -> None:
+        loop.remove_signal_handler(signal.SIGTERM)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        task.cancel()
+
+    try:
+        loop.add_signal_handler(signal.SIGTERM, cancel)
+    except NotImplementedError:
+        # Windows' event loops have no signal handlers, and terminate() can't be caught there anyway
+        pass
+
+
+class Cluster:
+    """
+    Runs the bot in several worker processes, each connected with its own
+    contiguous range of shards, so gateway traffic and CPU-heavy commands are
+    spread across cores.
+
+    target is called in each worker as target(shard_ids, shard_count), and must be
+    a module-level function since workers are spawned, not forked. Each worker
+    also gets its index in the BOT_CLUSTER_ID environment variable, which keeps
+    its log and journal files apart from the others'.
+
+    Workers that exit are restarted after restart_delay seconds. Interrupting or
+    terminating the launcher stops every worker: they get SIGTERM (or the same
+    Ctrl+C), which target should handle by closing the bot (see cancel_on_sigterm),
+    and the ones still running after stop_timeout seconds are killed.
+    """
+
+    def __init__(self, target: Callable[[List[int], int], None], shard_count: int,
+                 processes: int, restart_delay: float = 5.0, stop_timeout: float = 30.0) -> None:
+        self.target = target
+        self.shard_count = shard_count
+        self.ranges = shard_ranges(shard_count, processes)
+        self.restart_delay = restart_delay
+        self.stop_timeout = stop_timeout
+        self._context = multiprocessing.get_context('spawn')
+        # cluster ID: worker process
+        self._workers: Dict[int, multiprocessing.Process] = {}
+        self._stopping = False
+
+    def _start_worker(self, cluster_id: int) -> None:
+        shard_ids = self.ranges[cluster_id]
+        # Spawned processes inherit the environment as it is when they start
+        os.environ['BOT_CLUSTER_ID'] = str(cluster_id)
+        worker = self._context.Process(target=self.target, args=(shard_ids, self.shard_count),
+                                       name=f"cluster-{cluster_id}")
+        worker.start()
+        self._workers[cluster_id] = worker
+        Logger.INFO("Started cluster %d (pid %d) with shards %d-%d of %d", cluster_id, worker.pid,
+                    shard_ids[0], shard_ids[-1], self.shard_count)
+
+    def stop(self, *_) -> None:
+        """ Asks every worker to close """
+        self._stopping = True
+        for worker in self._workers.values():
+            if worker.is_alive():
+                worker.terminate()
+
+    def run(self) -> None:
+        """ Starts every worker and restarts the ones that exit, until stopped """
+        signal.signal(signal.SIGTERM, self.stop)
+        for cluster_id in range(len(self.ranges)):
+            self._start_worker(cluster_id)
+        try:
+            while not self._stopping:
+                time.sleep(1)
+                for cluster_id, worker in list(self._workers.items()):
+                    if worker.is_alive() or self._stopping:
+                        continue
+                    Logger.ERROR("Cluster %d exited with code %s, restarting in %.0fs",
+                                 cluster_id, worker.exitcode, self.restart_delay)
+                    time.sleep(self.restart_delay)
+                    if not self._stopping:
+                        self._start_worker(cluster_id)
+        except KeyboardInterrupt:
+            # The workers got the same Ctrl+C and are closing already; another
+            # signal would cut that short
+            self._stopping = True
+        finally:
+            self._join()
+
+    def _join(self) -> None:
+        deadline = time.monotonic() + self.stop_timeout
+        for cluster_id, worker in self._workers.items():
+            worker.join(max(0.0, deadline - time.monotonic()))
+            if worker.is_alive():
+                Logger.WARNING("Cluster %d didn't close within %.0fs, killing it", cluster_id, self.stop_timeout)
+                worker.kill()
+                worker.join()
@@ -0,0 +1,110 @@
+import ast
+from typing import List, Optional
+
+# Decorators of methods that have to run without anyone invoking a command, or
+# of slash commands, which Discord has to know before anyone can invoke them. Their
+# cogs can't wait to be loaded until a command is invoked.
+_EAGER_DECORATORS = ('loop', 'listener', 'hybrid_command', 'hybrid_group')
+
+
+def _adds_job(func: ast.AST) -> bool:
+    """ Whether a method registers a background job, e.g. self.bot.jobs.add(...) """
+    return any(isinstance(node, ast.Call) and _dotted_name(node.func).endswith('jobs.add')
+               for node in ast.walk(func))
+
+
+class CommandSpec:
+    """ A command as declared by its @commands.command decorator """
+
+    def __init__(self, name: str, aliases: List[str] = None, help: str = None,
+                 brief: str = None, description: str = None, hidden: bool = False) -> None:
+        self.name = name
+        self.aliases = aliases or []
+        self.help = help
+        self.brief = brief
+        self.description = description
+        self.hidden = hidden
+
+
+class CogSpec:
+    """
+    What a cog module declares, read without importing it: the cog's name and
+    description, its commands, and whether it can be loaded lazily. Cogs with
+    background tasks, event listeners or slash commands can't.
+    """
+
+    def __init__(self, extension: str, name: str, description: Optional[str],
+                 commands: List[CommandSpec], lazy: bool) -> None:
+        self.extension = extension
+        self.name = name
+        self.description = description
+        self.commands = commands
+        self.lazy = lazy
+
+
+def _dotted_name(node: ast.AST) -> str:
+    """ commands.command for both @commands.command and @commands.command(...) """
+    if isinstance(node, ast.Call):
+        node = node.func
+    if isinstance(node, ast.Attribute):
+        return f"{_dotted_name(node.value)}.{node.attr}"
+    if isinstance(node, ast.Name):
+        return node.id
+    return ''
+
+
+def _literal(node: ast.AST):
+    """ Evaluates a literal, including strings joined with +. None if it isn't one. """
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left, right = _literal(node.left), _literal(node.right)
+        if isinstance(left, str) and isinstance(right, str):
+            return left + right
+        return None
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        return None
+
+
+def _read_command(func: ast.AST, decorator: ast.AST) -> CommandSpec:
+    kwargs = {}
+    if isinstance(decorator, ast.Call):
+        kwargs = {keyword.arg: _literal(keyword.value) for keyword in decorator.keywords
+                  if keyword.arg is not None}
+    docstring = ast.get_docstring(func)
+    return CommandSpec(
+        name=kwargs.get('name') or func.name,
+        aliases=list(kwargs.get('aliases') or []),
+        # Like discord.py, the docstring is the help text unless there is one
+        help=kwargs.get('help') or docstring,
+        brief=kwargs.get('brief'),
+        description=kwargs.get('description'),
+        hidden=bool(kwargs.get('hidden')),
+    )
+
+
+def read_cog(file_path: str, extension: str) -> Optional[CogSpec]:
+    """ Reads the first cog declared in a module, or None if there isn't one """
+    with open(file_path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=file_path)
+
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        if not any(_dotted_name(base).split('.')[-1] == 'Cog' for base in node.bases):
+            continue
+        commands = []
+        lazy = True
+        for item in node.body:
+            if not isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                continue
+            for decorator in item.decorator_list:
+                decorator_name = _dotted_name(decorator).split('.')[-1]
+                if decorator_name == 'command':
+                    commands.append(_read_command(item, decorator))
+                elif decorator_name in _EAGER_DECORATORS:
+                    lazy = False
+            if _adds_job(item):
+                lazy = False
+        return CogSpec(extension, node.name, ast.get_docstring(node), commands, lazy)
+    return None
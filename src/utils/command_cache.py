@@ -0,0 +1,103 @@
+from functools import wraps
+from typing import Hashable, List, Optional, Tuple
+
+from discord.ext import commands
+
+from log import Logger
+
+from .custom_cache import CustomCache
+
+# Stands in for the author's mention in cached responses, so a response cached
+# for one user mentions whoever asks next
+_AUTHOR_MENTION = '\x00author\x00'
+
+
+class ResponseCache:
+    """
+    Rendered responses of read-only commands, keyed by command, normalized
+    arguments and guild. Commands opt in with @cached_response. Commands that
+    change what those responses show call invalidate() with their names.
+    """
+
+    def __init__(self, maxsize: int = 256) -> None:
+        self._cache = CustomCache(maxsize=maxsize)
+
+    @property
+    def stats(self) -> dict:
+        return self._cache.stats
+
+    def get(self, key: Hashable) -> Optional[List[str]]:
+        return self._cache.get(key)
+
+    def add(self, key: Hashable, responses: List[str], ttl: float) -> None:
+        self._cache.add(key, responses, ttl=ttl)
+
+    def invalidate(self, *command_names: str) -> None:
+        """ Drops the cached responses of the given commands, or of every command if none are given """
+        for key in self._cache.keys():
+            if not command_names or key[0] in command_names:
+                del self._cache[key]
+        Logger.DEBUG("Invalidated cached responses of: %s", ', '.join(command_names) or 'all commands')
+
+
+def _normalize(arg, ignore_case: bool) -> Hashable:
+    if isinstance(arg, str):
+        arg = ' '.join(arg.split())
+        return arg.casefold() if ignore_case else arg
+    # Discord objects (members, channels, etc.) are keyed by ID
+    return getattr(arg, 'id', arg)
+
+
+def _make_key(ctx: commands.Context, args: tuple, kwargs: dict,
+              ignore_case: bool) -> Tuple[str, tuple, Optional[int]]:
+    normalized = tuple(_normalize(arg, ignore_case) for arg in args)
+    normalized += tuple(sorted((name, _normalize(arg, ignore_case)) for name, arg in kwargs.items()))
+    return ctx.command.qualified_name, normalized, ctx.guild.id if ctx.guild else None
+
+
+def cached_response(ttl: float = 30.0, ignore_case: bool = False):
+    """
+    Caches what a command callback sends for ttl seconds, per command, arguments
+    and guild. Place it below @commands.command. Repeat invocations replay the
+    cached messages instead of running the callback.
+
+    Only plain text responses are cached. If the callback sends files, embeds or
+    views, or raises, nothing is cached. Neither is a response the callback
+    marks as an error with ctx.cache_response = False (e.g. "summoner not
+    found"), which Logger.CTX_ERROR does too. With ignore_case, arguments that
+    only differ in case share a response (e.g. summoner names).
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapped(self, ctx: commands.Context, *args, **kwargs):
+            cache: ResponseCache = ctx.bot.response_cache
+            key = _make_key(ctx, args, kwargs, ignore_case)
+            responses = cache.get(key)
+            if responses is not None:
+                for content in responses:
+                    await ctx.send(content.replace(_AUTHOR_MENTION, ctx.author.mention))
+                return
+
+            recorded = []
+            cacheable = True
+            send = ctx.send
+
+            async def recording_send(content=None, **send_kwargs):
+                nonlocal cacheable
+                if send_kwargs or content is None:
+                    cacheable = False
+                else:
+                    recorded.append(str(content).replace(ctx.author.mention, _AUTHOR_MENTION))
+                return await send(content, **send_kwargs)
+
+            ctx.send = recording_send
+            ctx.cache_response = True
+            try:
+                result = await func(self, ctx, *args, **kwargs)
+            finally:
+                ctx.send = send
+            if cacheable and recorded and ctx.cache_response:
+                cache.add(key, recorded, ttl)
+            return result
+        return wrapped
+    return decorator
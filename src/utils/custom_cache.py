@@ -1,75 +1,642 @@
-from time import time
+import asyncio
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import deque
+from functools import wraps
+from inspect import iscoroutinefunction
+from time import monotonic, time
+from typing import Callable, Hashable, Optional
+from uuid import uuid4
+from weakref import WeakKeyDictionary
 
-from cachetools import TTLCache
+from cachetools import LFUCache, LRUCache, TLRUCache
 
 from log import Logger
 
+from .helper import Helper
+from .shared_cache import SharedCacheBackend
+from .single_flight import SingleFlight
+
+# Returned by the tiers when a key isn't cached
+_MISSING = object()
+
+# How long a process computing a shared value keeps the others waiting for it, in seconds
+_FILL_TIMEOUT = 10.0
+
+# How long a shared store that failed a call is skipped for, in seconds
+_RETRY_AFTER = 30.0
+
+# Shared store: until when (monotonic time) it's skipped
+_down_until = WeakKeyDictionary()
+
+
+def _digest(key) -> Optional[str]:
+    """ A name for key that's the same in every process """
+    try:
+        return hashlib.sha1(pickle.dumps(key)).hexdigest()
+    except (pickle.PicklingError, TypeError, AttributeError):
+        # Keys containing objects like clients or cogs only live in memory
+        return None
+
+
+class _Entry:
+    """ A cached value with the time it goes stale and the time it expires """
+
+    __slots__ = ('value', 'fresh_until', 'expires')
+
+    def __init__(self, value, fresh_until: float, expires: float) -> None:
+        self.value = value
+        self.fresh_until = fresh_until
+        self.expires = expires
+
+
+def _counting(cache_class):
+    """ Subclasses a cachetools cache to report entries evicted to make room """
+
+    class CountingCache(cache_class):
+
+        def __init__(self, *args, on_evict: Callable = None, **kwargs) -> None:
+            super().__init__(*args, **kwargs)
+            self.on_evict = on_evict
+
+        def popitem(self):
+            key, entry = super().popitem()
+            if self.on_evict is not None:
+                self.on_evict(key, entry)
+            return key, entry
+
+    CountingCache.__name__ = cache_class.__name__
+    return CountingCache
+
+
+_POLICIES = {
+    'lru': _counting(LRUCache),
+    'lfu': _counting(LFUCache),
+    'ttl': _counting(TLRUCache),
+}
+
+
+class _DiskTier:
+    """
+    Second tier of a CustomCache: entries pickled to files in a folder, one per
+    key. Keeps at most maxsize files and removes the least recently written ones.
+
+    Its methods run in threads, and processes may share the folder, so files
+    are written under unique temporary names and may vanish at any time. The
+    size is this process' estimate, corrected whenever the folder is pruned.
+    """
+
+    def __init__(self, path: str, maxsize: int) -> None:
+        self.path = path
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        # The folder is created on the first write
+        self._size = len(self._entries()) if os.path.isdir(path) else 0
+
+    def _entries(self) -> list:
+        """ Files of the entries, leaving out the ones being written """
+        return [f for f in os.scandir(self.path) if f.name.endswith('.pickle')]
+
+    def _file(self, key) -> Optional[str]:
+        digest = _digest(key)
+        return self._file_of(digest) if digest is not None else None
+
+    def _file_of(self, digest: str) -> str:
+        return os.path.join(self.path, f"{digest}.pickle")
+
+    def get(self, key):
+        file_path = self._file(key)
+        if file_path is None or not os.path.isfile(file_path):
+            return _MISSING
+        try:
+            with open(file_path, 'rb') as f:
+                stored_key, entry = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return _MISSING
+        if stored_key != key:
+            return _MISSING
+        if entry.expires <= time():
+            self.delete(key)
+            return _MISSING
+        return entry
+
+    def set(self, key, entry: _Entry) -> None:
+        file_path = self._file(key)
+        if file_path is None:
+            return
+        existed = os.path.isfile(file_path)
+        tmp_path = None
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((key, entry), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, file_path)
+        except (OSError, pickle.PicklingError, TypeError, AttributeError) as e:
+            Logger.WARNING(f"Could not write cache entry to {self.path}: {e}")
+            if tmp_path is not None:
+                self._remove(tmp_path)
+            return
+        if not existed:
+            with self._lock:
+                self._size += 1
+                if self._size > self.maxsize:
+                    self._prune()
+
+    @staticmethod
+    def _remove(file_path: str) -> bool:
+        """ Removes a file unless it's gone already. Returns True if it was there. """
+        try:
+            os.remove(file_path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def delete(self, key) -> None:
+        digest = _digest(key)
+        if digest is not None:
+            self.delete_digest(digest)
+
+    def delete_digest(self, digest: str) -> None:
+        if self._remove(self._file_of(digest)):
+            with self._lock:
+                self._size = max(0, self._size - 1)
+
+    def _prune(self) -> None:
+        """ Removes the oldest files above maxsize. Called with the lock held. """
+        files = []
+        for f in self._entries():
+            try:
+                files.append((f.stat().st_mtime, f.path))
+            except FileNotFoundError:
+                continue
+        files.sort()
+        for _, file_path in files[:len(files) - self.maxsize]:
+            self._remove(file_path)
+        self._size = min(len(files), self.maxsize)
+
+    def clear(self) -> None:
+        if os.path.isdir(self.path):
+            for f in self._entries():
+                self._remove(f.path)
+        with self._lock:
+            self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class _SharedTier:
+    """
+    Last tier of a CustomCache: entries stored as JSON in a store that every
+    process shares (see SharedCacheBackend), under cache:<namespace>:<digest of
+    the key>.
+    Deletes and clears are broadcast, so other processes drop their copy of the
+    entry from their first tiers the next time they use the cache. Writes aren't:
+    they fill the cache rather than change what it should hold.
+
+    JSON, unlike pickle, can't run code when it's read, so whoever can write to
+    the store can at most poison the cached values; it should still be private
+    to the bot. Values that don't survive a round trip through JSON unchanged
+    (e.g. tuples, or objects holding a client) aren't shared, and each process
+    keeps its own copy. An unreachable store is a miss, and once a call
+    fails the store is skipped for _RETRY_AFTER seconds rather than waited on again.
+
+    The methods block for a round trip to the store. Coroutine functions use
+    their _async versions, which run them in a thread instead.
+    """
+
+    def __init__(self, backend: SharedCacheBackend, namespace: str) -> None:
+        self.backend = backend
+        self.namespace = namespace
+        # Tells this cache's own broadcasts apart from other processes'
+        self.origin = uuid4().hex
+        # Digests of keys other processes changed (None for all of them), not applied yet
+        self.invalidated = deque()
+        backend.listen(self._on_message)
+
+    def _name(self, digest: str) -> str:
+        return f"cache:{self.namespace}:{digest}"
+
+    @property
+    def skipped(self) -> bool:
+        """ Whether the store failed recently, and is skipped until it's retried """
+        return monotonic() < _down_until.get(self.backend, 0.0)
+
+    def _call(self, method: str, *args, default=None):
+        if self.skipped:
+            return default
+        try:
+            return getattr(self.backend, method)(*args)
+        except Exception as e:
+            _down_until[self.backend] = monotonic() + _RETRY_AFTER
+            Logger.WARNING(f"Shared cache {self.namespace} could not {method}, " +
+                           f"skipping the store for {_RETRY_AFTER:g}s: {e}")
+            return default
+
+    async def _in_thread(self, method: Callable, *args, default=None):
+        """ Runs one of the methods below in a thread, unless the store is skipped """
+        if self.skipped:
+            return default
+        return await Helper.run_in_thread(method, *args)
+
+    def get(self, key):
+        digest = _digest(key)
+        data = self._call('get', self._name(digest)) if digest is not None else None
+        if data is None:
+            return _MISSING
+        try:
+            stored = json.loads(data)
+            entry = _Entry(stored['value'], float(stored['fresh_until']), float(stored['expires']))
+        except (ValueError, TypeError, KeyError):
+            return _MISSING
+        if entry.expires <= time():
+            return _MISSING
+        return entry
+
+    def set(self, key, entry: _Entry) -> None:
+        digest = _digest(key)
+        if digest is None:
+            return
+        try:
+            data = json.dumps({'value': entry.value, 'fresh_until': entry.fresh_until,
+                               'expires': entry.expires})
+            if json.loads(data)['value'] != entry.value:
+                return
+        except (ValueError, TypeError):
+            return
+        self._call('set', self._name(digest), data.encode('utf-8'), entry.expires - time())
+
+    def delete(self, key) -> None:
+        digest = _digest(key)
+        if digest is not None:
+            self._call('delete', self._name(digest))
+            self._broadcast(digest)
+
+    def clear(self) -> None:
+        self._call('delete_prefix', self._name(''))
+        self._broadcast(None)
+
+    def lock(self, key) -> bool:
+        """ Claims computing key's value. True if no other process is, or the store is down. """
+        digest = _digest(key)
+        if digest is None:
+            return True
+        return self._call('add', f"{self._name(digest)}:lock", b'1', _FILL_TIMEOUT, default=True)
+
+    def locked(self, key) -> bool:
+        digest = _digest(key)
+        return (digest is not None and
+                self._call('get', f"{self._name(digest)}:lock") is not None)
+
+    def unlock(self, key) -> None:
+        digest = _digest(key)
+        if digest is not None:
+            self._call('delete', f"{self._name(digest)}:lock")
+
+    async def get_async(self, key):
+        return await self._in_thread(self.get, key, default=_MISSING)
+
+    async def set_async(self, key, entry: _Entry) -> None:
+        await self._in_thread(self.set, key, entry)
+
+    async def lock_async(self, key) -> bool:
+        return await self._in_thread(self.lock, key, default=True)
+
+    async def locked_async(self, key) -> bool:
+        return await self._in_thread(self.locked, key, default=False)
+
+    async def unlock_async(self, key) -> None:
+        await self._in_thread(self.unlock, key)
+
+    def _broadcast(self, digest: Optional[str]) -> None:
+        self._call('publish', json.dumps({'origin': self.origin, 'namespace': self.namespace,
+                                          'key': digest}))
+
+    def _on_message(self, message: str) -> None:
+        try:
+            change = json.loads(message)
+        except ValueError:
+            return
+        if change.get('namespace') == self.namespace and change.get('origin') != self.origin:
+            self.invalidated.append(change.get('key'))
+
 
 class CustomCache:
-    """ 
-    Wrapper around cachetools' TTLCache. Because there are frequent calls being
-    made to the database, a TTLCache is needed to not only reduce the amount of calls made
-    to the database but also help with automatically cleaning the cache to prevent indefinite
-    growth.
-    Read more about Time-to-live (TTL): https://en.wikipedia.org/wiki/Time_to_live 
+    """
+    Two-tier cache. Because there are frequent calls being made to the database
+    and other services, a bounded cache is needed to not only reduce the amount of
+    calls made but also prevent indefinite growth.
+
+    The first tier is in memory and holds at most maxsize entries, evicted by policy:
+        - 'ttl': entries expire after their time-to-live, and the least recently
+          used one is evicted when the cache is full
+        - 'lru': the least recently used entry is evicted
+        - 'lfu': the least frequently used entry is evicted
+    Every entry expires after its TTL whatever the policy. add() takes a TTL per key.
+    Read more about Time-to-live (TTL): https://en.wikipedia.org/wiki/Time_to_live
+
+    With disk_path, entries are also pickled to that folder (up to disk_maxsize of
+    them), which suits large values like Data Dragon JSON. Misses in memory are
+    looked up on disk, which also survives restarts.
+
+    Used as a decorator, it caches the results of a function. Coroutine functions
+    are supported too; their awaited results are cached, and concurrent misses
+    for the same key share one call.
+
+    key is called with the function's arguments and returns the cache key. Pass
+    one when the arguments aren't hashable (dicts, discord objects, etc.).
+
+    With stale_ttl, an expired result of a coroutine function is still returned for
+    up to stale_ttl more seconds while a single background call refreshes it
+    (stale-while-revalidate), so callers never wait on a refresh.
+
+    With shared, entries are also kept in CustomCache.shared_backend (if one is
+    set, e.g. Redis), so the processes of a deployment compute each value once:
+    a miss is looked up there before computing it, and while one process computes
+    it the others wait for its result. The tiers above act as a near-cache that
+    other processes' deletes and clears invalidate; to replace a value everywhere,
+    delete it before adding the new one. name tells apart the entries of different
+    caches, so it must be unique and is required.
     """
 
-    def __init__(self, maxsize=100, ttl=300):
-        self.cache = TTLCache(maxsize, ttl)
+    # Backend of every shared cache, set once at startup. Without one, they aren't shared.
+    shared_backend: Optional[SharedCacheBackend] = None
+
+    def __init__(self, maxsize=100, ttl=300, key: Callable[..., Hashable] = None,
+                 stale_ttl: float = 0, policy: str = 'ttl', disk_path: str = None,
+                 disk_maxsize: int = 1000, shared: bool = False, name: str = None):
+        if policy not in _POLICIES:
+            raise ValueError(f"Unknown cache policy {policy}, use one of {', '.join(_POLICIES)}")
+        if shared and not name:
+            raise ValueError("A shared cache needs a name")
+        cache_class = _POLICIES[policy]
+        if policy == 'ttl':
+            self.cache = cache_class(maxsize, ttu=lambda _, entry, now: entry.expires,
+                                     timer=time, on_evict=self._on_evict)
+        else:
+            self.cache = cache_class(maxsize, on_evict=self._on_evict)
+        self.disk = _DiskTier(disk_path, disk_maxsize) if disk_path is not None else None
         self._maxsize = maxsize
         self._ttl = ttl
-        self.timestamps = {}
+        self._stale_ttl = stale_ttl
+        self._key = key
+        self.policy = policy
+        self.name = name
+        self._shared = shared
+        # Created with the backend, on first use
+        self._shared_tier: Optional[_SharedTier] = None
+        self._flight = SingleFlight()
+        # Keeps the background refreshes from being garbage collected
+        self._refreshes = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_hits = 0
+        self.shared_hits = 0
+
+    @property
+    def shared(self) -> Optional[_SharedTier]:
+        """ The shared tier, or None if the cache isn't shared (or there's no backend) """
+        if self._shared_tier is None and self._shared and CustomCache.shared_backend is not None:
+            self._shared_tier = _SharedTier(CustomCache.shared_backend, self.name)
+        return self._shared_tier
+
+    def _apply_invalidations(self) -> None:
+        """ Drops the entries that other processes changed """
+        shared = self.shared
+        if shared is None or not shared.invalidated:
+            return
+        digests = set()
+        while shared.invalidated:
+            digest = shared.invalidated.popleft()
+            if digest is None:
+                self.cache.clear()
+                if self.disk is not None:
+                    self.disk.clear()
+                return
+            digests.add(digest)
+        for key in list(self.cache.keys()):
+            if _digest(key) in digests:
+                self.cache.pop(key, None)
+        if self.disk is not None:
+            for digest in digests:
+                self.disk.delete_digest(digest)
+
+    def _on_evict(self, key, entry: _Entry) -> None:
+        self.evictions += 1
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'disk_hits': self.disk_hits,
+            'shared_hits': self.shared_hits,
+            'size': len(self),
+            'disk_size': len(self.disk) if self.disk is not None else 0,
+        }
+
+    def _get_memory(self, key):
+        """ Looks up a live entry in memory """
+        self._apply_invalidations()
+        entry = self.cache.get(key, _MISSING)
+        if entry is not _MISSING and entry.expires <= time():
+            # The LRU and LFU policies don't expire entries by themselves
+            del self.cache[key]
+            entry = _MISSING
+        return entry
+
+    def _count(self, entry):
+        if entry is _MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def _get_entry(self, key):
+        """ Looks up a live entry in memory, on disk, then in the shared store. Counts the hit or miss. """
+        entry = self._get_memory(key)
+        if entry is _MISSING and self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not _MISSING:
+                self.disk_hits += 1
+                self.cache[key] = entry
+        if entry is _MISSING and self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not _MISSING:
+                self.shared_hits += 1
+                self.cache[key] = entry
+        return self._count(entry)
+
+    async def _get_entry_async(self, key):
+        """ Like _get_entry(), reading the disk and the shared store in threads, off the event loop """
+        entry = self._get_memory(key)
+        if entry is _MISSING and self.disk is not None:
+            entry = await Helper.run_in_thread(self.disk.get, key)
+            if entry is not _MISSING:
+                self.disk_hits += 1
+                self.cache[key] = entry
+        if entry is _MISSING and self.shared is not None:
+            entry = await self.shared.get_async(key)
+            if entry is not _MISSING:
+                self.shared_hits += 1
+                self.cache[key] = entry
+        return self._count(entry)
+
+    def _make_key(self, func, args, kwargs) -> Hashable:
+        if self._key is not None:
+            return self._key(*args, **kwargs)
+        return (func.__name__, args, frozenset(kwargs.items()))
 
     def __call__(self, func):
+        if iscoroutinefunction(func):
+            return self._wrap_coroutine(func)
+
+        @wraps(func)
         def wrapped_func(*args, **kwargs):
-            cache_key = (func.__name__, args, frozenset(kwargs.items()))
-            if cache_key in self.cache:
-                cached_time = self.timestamps.get(cache_key, 0)
-                current_time = time()
-                diff = current_time - cached_time
-                Logger.DEBUG(
-                    f"cached_time: {cached_time} | current_time: {current_time} | self.cache.ttl: {self.cache.ttl}")
-                Logger.DEBUG(f"diff (current time - cached time): {diff}")
-                if diff < self.cache.ttl:
-                    return self.cache.get(cache_key)
+            cache_key = self._make_key(func, args, kwargs)
+            entry = self._get_entry(cache_key)
+            if entry is not _MISSING and entry.fresh_until > time():
+                return entry.value
             result = func(*args, **kwargs)
             self.add(cache_key, result)
             return result
         return wrapped_func
 
+    async def _wait_for_peer(self, cache_key):
+        """ Waits for the process computing cache_key's value to share it """
+        deadline = time() + _FILL_TIMEOUT
+        while time() < deadline:
+            await asyncio.sleep(0.1)
+            # Checked first: the value is shared before the lock is released
+            locked = await self.shared.locked_async(cache_key)
+            entry = await self.shared.get_async(cache_key)
+            if entry is not _MISSING and entry.fresh_until > time():
+                self.shared_hits += 1
+                self.cache[cache_key] = entry
+                return entry
+            if not locked:
+                # It failed, or its value can't be shared
+                break
+        return _MISSING
+
+    def _wrap_coroutine(self, func):
+        async def load(cache_key, args, kwargs):
+            shared = self.shared
+            if shared is not None and not await shared.lock_async(cache_key):
+                # Another process is computing it
+                entry = await self._wait_for_peer(cache_key)
+                if entry is not _MISSING:
+                    return entry.value
+            try:
+                result = await func(*args, **kwargs)
+                await self._add_async(cache_key, result)
+            finally:
+                if shared is not None:
+                    await shared.unlock_async(cache_key)
+            return result
+
+        async def refresh(cache_key, args, kwargs):
+            try:
+                await self._flight.do_async(cache_key, load, cache_key, args, kwargs)
+            except Exception as e:
+                # The stale value stays until it expires for good
+                Logger.WARNING(f"Could not refresh {func.__name__}: {e}")
+
+        @wraps(func)
+        async def wrapped_func(*args, **kwargs):
+            cache_key = self._make_key(func, args, kwargs)
+            entry = await self._get_entry_async(cache_key)
+            if entry is not _MISSING:
+                if entry.fresh_until > time():
+                    return entry.value
+                if self._stale_ttl > 0:
+                    if not self._flight.in_flight(cache_key):
+                        task = asyncio.ensure_future(refresh(cache_key, args, kwargs))
+                        self._refreshes.add(task)
+                        task.add_done_callback(self._refreshes.discard)
+                    return entry.value
+            return await self._flight.do_async(cache_key, load, cache_key, args, kwargs)
+        return wrapped_func
+
     def __getitem__(self, key):
-        return self.cache[key]
+        entry = self._get_entry(key)
+        if entry is _MISSING:
+            raise KeyError(key)
+        return entry.value
 
     def __setitem__(self, key, value):
-        self.cache[key] = value
+        self.add(key, value)
 
     def __delitem__(self, key):
-        del self.cache[key]
+        found = self.cache.pop(key, _MISSING) is not _MISSING
+        if self.disk is not None and self.disk.get(key) is not _MISSING:
+            self.disk.delete(key)
+            found = True
+        if self.shared is not None:
+            found = found or self.shared.get(key) is not _MISSING
+            self.shared.delete(key)
+        if not found:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        entry = self.cache.get(key, _MISSING)
+        if entry is not _MISSING and entry.expires > time():
+            return True
+        return self.disk is not None and self.disk.get(key) is not _MISSING
 
     def __iter__(self):
-        return iter(self.cache)
+        return iter(self.keys())
 
     def __len__(self):
-        return len(self.cache)
+        now = time()
+        return sum(1 for entry in self.cache.values() if entry.expires > now)
 
     def get(self, key):
-        value = self.cache.get(key)
-        Logger.DEBUG("Retrieving key-value pair from cache:")
-        Logger.DEBUG(f"key: {key} | value: {value}")
-        return value
+        entry = self._get_entry(key)
+        return None if entry is _MISSING else entry.value
+
+    def clear(self):
+        """ Removes every entry, from memory, disk and the shared store """
+        self.cache.clear()
+        if self.disk is not None:
+            self.disk.clear()
+        if self.shared is not None:
+            self.shared.clear()
 
     def search(self, value):
-        if value in self.cache:
+        if value in self:
             return value
         return None
 
-    def add(self, key, value):
-        Logger.DEBUG(
-            "Key-value pair not found in cache, adding it now.")
-        Logger.DEBUG(
-            f"Key-value pair - key: {key} | value: {value}")
-        self.timestamps[key] = time()
-        self.cache[key] = value
+    def _entry(self, value, ttl: float = None) -> _Entry:
+        fresh_until = time() + (self._ttl if ttl is None else ttl)
+        return _Entry(value, fresh_until, fresh_until + self._stale_ttl)
+
+    def add(self, key, value, ttl: float = None):
+        """ Caches value under key. ttl overrides the cache's TTL for this key. """
+        entry = self._entry(value, ttl)
+        self.cache[key] = entry
+        if self.disk is not None:
+            self.disk.set(key, entry)
+        if self.shared is not None:
+            self.shared.set(key, entry)
+
+    async def _add_async(self, key, value) -> None:
+        """ Like add(), writing the disk and the shared store in threads, off the event loop """
+        entry = self._entry(value)
+        self.cache[key] = entry
+        if self.disk is not None:
+            await Helper.run_in_thread(self.disk.set, key, entry)
+        if self.shared is not None:
+            await self.shared.set_async(key, entry)
 
     @property
     def maxsize(self):
@@ -80,7 +647,9 @@ def ttl(self):
         return self._ttl
 
     def keys(self):
-        return list(self.cache.keys())
+        now = time()
+        return [key for key, entry in list(self.cache.items()) if entry.expires > now]
 
     def values(self):
-        return list(self.cache.values())
+        now = time()
+        return [entry.value for entry in list(self.cache.values()) if entry.expires > now]
@@ -0,0 +1,53 @@
+from typing import Iterable
+
+import discord
+
+
+def build_intents(lean: bool, member_intent: bool = False,
+                  message_content: bool = True) -> discord.Intents:
+    """
+    Every intent, or only the ones the bot uses in lean mode: guilds, messages and
+    their content for prefix commands, and voice states for the voice commands and
+    greetings. member_intent adds member join events, which are privileged.
+    Message content is privileged too; slash commands and mentions work without it.
+    """
+    if not lean:
+        return discord.Intents.all()
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.guild_messages = True
+    intents.dm_messages = True
+    intents.message_content = message_content
+    intents.voice_states = True
+    intents.members = member_intent
+    return intents
+
+
+def build_member_cache_flags(lean: bool, intents: discord.Intents,
+                             member_cache: Iterable[str] = ('voice',)) -> discord.MemberCacheFlags:
+    """
+    Which members to keep in memory. In lean mode, only the kinds listed in
+    member_cache ('voice', 'joined') are cached, as far as the intents allow.
+    """
+    if not lean:
+        return discord.MemberCacheFlags.from_intents(intents)
+    member_cache = set(member_cache)
+    return discord.MemberCacheFlags(
+        voice='voice' in member_cache and intents.voice_states,
+        joined='joined' in member_cache and intents.members,
+    )
+
+
+def gateway_options(lean: bool, member_intent: bool = False,
+                    member_cache: Iterable[str] = ('voice',),
+                    message_content: bool = True) -> dict:
+    """
+    Keyword arguments for commands.Bot. Lean mode also skips requesting every
+    member of every guild before the bot is ready; members are fetched when needed.
+    """
+    intents = build_intents(lean, member_intent, message_content)
+    return {
+        'intents': intents,
+        'member_cache_flags': build_member_cache_flags(lean, intents, member_cache),
+        'chunk_guilds_at_startup': not lean,
+    }
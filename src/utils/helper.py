@@ -1,10 +1,17 @@
+import asyncio
 import json
 import os
 import shutil
+import sys
+from functools import partial
 from inspect import currentframe
 from pathlib import Path
 
-from mutagen.mp3 import MP3
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
 
 # from config import PROJ_CACHE_PATH
 from log import Logger
@@ -115,9 +122,29 @@ def mksubdir(directory_path: str, subdirectory_name: str):
         subdirectory_path = path / subdirectory_name
         subdirectory_path.mkdir(parents=True, exist_ok=True)
 
+    @staticmethod
+    async def run_in_thread(func, *args, **kwargs):
+        """ 
+        Runs a blocking function on the default executor so it doesn't stall
+        the event loop, e.g. calls to the Riot API or Cloud Storage.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(func, *args, **kwargs))
+
+    @staticmethod
+    def get_peak_rss_mb():
+        """ Gets the peak memory (resident set size) of the process in MB, or None if unknown """
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
     @staticmethod
     def get_length_of_audio_src(src):
         """ Gets the length of an audio clip """
+        # Imported on first use, most runs never play a clip
+        from mutagen.mp3 import MP3
         return MP3(src).info.length
 
 
@@ -21,14 +21,12 @@ def __init__(self, loop: AbstractEventLoop, status: bool = True,
         self.session_id = id(self.session)
 
     async def close(self):
-        Logger.DEBUG(
-            f"Ending session: [{self.session_name} {self.session_id}]")
+        Logger.DEBUG("Ending session: [%s %s]", self.session_name, self.session_id)
         await self.session.close()
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         await self.close()
 
     async def __aenter__(self):
-        Logger.DEBUG(
-            f"Starting session: [{self.session_name} {self.session_id}]")
+        Logger.DEBUG("Starting session: [%s %s]", self.session_name, self.session_id)
         return self.session
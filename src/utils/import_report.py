@@ -0,0 +1,108 @@
+"""
+Measures what importing the bot's modules costs, using `python -X importtime`.
+Each module is imported in a fresh interpreter, so it pays for everything it
+pulls in, like it does at startup.
+
+Run it from the project's root folder:
+    python -m src.utils.import_report [module ...]
+With no modules given, the core of the bot and every cog are measured.
+"""
+
+import os
+import subprocess
+import sys
+from typing import List, Optional, Tuple
+
+# Prints the peak RSS of the interpreter after the import, when it's known
+_RSS_CODE = """
+try:
+    import resource
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+except ImportError:
+    pass
+"""
+
+
+class ImportTimes:
+    """ What importing a module took: in total, per imported package, and in memory """
+
+    def __init__(self, module: str, imports: List[Tuple[str, int, int]],
+                 peak_rss_mb: Optional[float]) -> None:
+        self.module = module
+        # (package, self, cumulative), in microseconds, in import order
+        self.imports = imports
+        self.peak_rss_mb = peak_rss_mb
+
+    @property
+    def total_ms(self) -> float:
+        """ Cumulative import time of the module """
+        for package, _, cumulative in self.imports:
+            if package == self.module:
+                return cumulative / 1000
+        return sum(self_us for _, self_us, _ in self.imports) / 1000
+
+    def slowest(self, count: int = 5) -> List[Tuple[str, float]]:
+        """ The top-level packages that took the longest to import, with their cumulative time in ms """
+        top_level = {}
+        for package, _, cumulative in self.imports:
+            root = package.split('.')[0]
+            if package == root and root != self.module.split('.')[0]:
+                top_level[root] = max(top_level.get(root, 0), cumulative / 1000)
+        return sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:count]
+
+
+def parse_importtime(output: str) -> List[Tuple[str, int, int]]:
+    """ Reads the lines written by -X importtime: (package, self, cumulative) in microseconds """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # The header
+            continue
+        imports.append((fields[2].strip(), int(fields[0]), int(fields[1])))
+    return imports
+
+
+def _to_mb(max_rss: int) -> float:
+    # Linux reports kilobytes, macOS bytes
+    return max_rss / 1024 ** 2 if sys.platform == 'darwin' else max_rss / 1024
+
+
+def measure(module: str) -> ImportTimes:
+    """ Imports module in a new interpreter and records how long each import took """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}\n{_RSS_CODE}"],
+        capture_output=True, text=True, check=False
+    )
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()
+        raise ImportError(f"Could not import {module}: {error[-1] if error else result.returncode}")
+    output = result.stdout.strip()
+    peak_rss_mb = _to_mb(int(output.splitlines()[-1])) if output else None
+    return ImportTimes(module, parse_importtime(result.stderr), peak_rss_mb)
+
+
+def default_modules(cogs_path: str = "./src/cogs") -> List[str]:
+    cogs = sorted(f"{cogs_path}.{filename[:-3]}".lstrip("./").replace("/", ".")
+                  for filename in os.listdir(cogs_path) if filename.endswith(".py"))
+    return ['src.bot'] + cogs
+
+
+def report(modules: List[str]) -> str:
+    lines = [f"{'module':<20} {'import':>10} {'peak RSS':>10}  slowest imports"]
+    for module in modules:
+        try:
+            times = measure(module)
+        except ImportError as e:
+            lines.append(f"{module:<20} {str(e)}")
+            continue
+        rss = f"{times.peak_rss_mb:.1f} MB" if times.peak_rss_mb is not None else "unknown"
+        slowest = ', '.join(f"{package} {ms:.0f} ms" for package, ms in times.slowest())
+        lines.append(f"{module:<20} {times.total_ms:>7.0f} ms {rss:>10}  {slowest}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(report(sys.argv[1:] or default_modules()))
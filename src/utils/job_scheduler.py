@@ -0,0 +1,182 @@
+import asyncio
+import random
+from collections import deque
+from time import monotonic, time
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+from log import Logger
+
+# Runs of each job kept for >jobs
+HISTORY_SIZE = 20
+
+
+class JobRun:
+    """ When a run started (wall-clock), how long it took, and why it failed if it did """
+
+    __slots__ = ('started_at', 'duration', 'error')
+
+    def __init__(self, started_at: float, duration: float, error: Optional[str]) -> None:
+        self.started_at = started_at
+        self.duration = duration
+        self.error = error
+
+
+class Job:
+    """
+    A coroutine function run every interval seconds, plus up to jitter more so
+    processes started together don't all run it at once. A run is cancelled
+    after timeout seconds, and one that takes longer than max_runtime is logged
+    as overrunning. leader_only jobs only run in the elected leader.
+    """
+
+    def __init__(self, name: str, func: Callable[[], Awaitable], interval: float,
+                 jitter: float = 0.0, timeout: float = None, max_runtime: float = None,
+                 leader_only: bool = False) -> None:
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.timeout = timeout
+        self.max_runtime = max_runtime
+        self.leader_only = leader_only
+
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.overruns = 0
+        self._total = 0.0
+        self.max_duration = 0.0
+        self.history: Deque[JobRun] = deque(maxlen=HISTORY_SIZE)
+        self._schedule: Optional[asyncio.Task] = None
+        self._run: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._run is not None and not self._run.done()
+
+    @property
+    def stats(self) -> dict:
+        last = self.history[-1] if self.history else None
+        return {
+            'runs': self.runs,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'skipped': self.skipped,
+            'overruns': self.overruns,
+            'avg_ms': self._total / self.runs * 1000 if self.runs else 0.0,
+            'max_ms': self.max_duration * 1000,
+            'last_error': last.error if last is not None else None,
+        }
+
+    def next_delay(self) -> float:
+        return self.interval + random.uniform(0, self.jitter)
+
+    def record(self, started_at: float, duration: float, error: Optional[str]) -> None:
+        self.runs += 1
+        self._total += duration
+        self.max_duration = max(self.max_duration, duration)
+        if error is not None:
+            self.failures += 1
+        elif self.max_runtime is not None and duration > self.max_runtime:
+            self.overruns += 1
+        self.history.append(JobRun(started_at, duration, error))
+
+    def cancel(self) -> None:
+        for task in (self._schedule, self._run):
+            if task is not None:
+                task.cancel()
+        self._schedule = self._run = None
+
+
+class JobScheduler:
+    """
+    Runs the bot's background jobs (see Job). A run that's still going when the
+    next is due makes that one be skipped, rather than run alongside it.
+
+    Jobs added before start() wait for it, and every job waits for wait() (e.g.
+    the bot being ready) before its first run. is_leader tells whether this
+    process runs the leader_only jobs, and is asked again before every run.
+    """
+
+    def __init__(self, is_leader: Callable[[], bool] = None,
+                 wait: Callable[[], Awaitable] = None) -> None:
+        self.is_leader = is_leader
+        self.wait = wait
+        self.jobs: Dict[str, Job] = {}
+        self._started = False
+
+    def add(self, name: str, func: Callable[[], Awaitable], interval: float, jitter: float = 0.0,
+            timeout: float = None, max_runtime: float = None, leader_only: bool = False) -> Job:
+        """ Registers a job. Names are unique; remove() the job before adding it again. """
+        if name in self.jobs:
+            raise ValueError(f"Job {name} already exists")
+        job = Job(name, func, interval, jitter, timeout, max_runtime, leader_only)
+        self.jobs[name] = job
+        if self._started:
+            self._start_job(job)
+        return job
+
+    def remove(self, name: str) -> None:
+        """ Stops a job, cancelling its run if one is going """
+        job = self.jobs.pop(name, None)
+        if job is not None:
+            job.cancel()
+
+    def start(self) -> None:
+        self._started = True
+        for job in self.jobs.values():
+            if job._schedule is None:
+                self._start_job(job)
+
+    async def stop(self) -> None:
+        """ Cancels every job and waits for their runs to end """
+        self._started = False
+        tasks = [task for job in self.jobs.values() for task in (job._schedule, job._run)
+                 if task is not None]
+        for job in self.jobs.values():
+            job.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _start_job(self, job: Job) -> None:
+        job._schedule = asyncio.get_running_loop().create_task(self._loop(job))
+
+    async def _loop(self, job: Job) -> None:
+        if self.wait is not None:
+            await self.wait()
+        # The first run is right away, spread out by the jitter only
+        delay = random.uniform(0, job.jitter)
+        while True:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            delay = job.next_delay()
+            if job.leader_only and self.is_leader is not None and not self.is_leader():
+                continue
+            if job.running:
+                job.skipped += 1
+                Logger.WARNING("Skipped a run of %s: the previous one is still going", job.name)
+                continue
+            job._run = asyncio.get_running_loop().create_task(self._run(job))
+
+    async def _run(self, job: Job) -> None:
+        started_at, started = time(), monotonic()
+        error = None
+        try:
+            if job.timeout is None:
+                await job.func()
+            else:
+                await asyncio.wait_for(job.func(), job.timeout)
+        except asyncio.TimeoutError as e:
+            if job.timeout is None:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                job.timeouts += 1
+                error = f"timed out after {job.timeout:g}s"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        duration = monotonic() - started
+        job.record(started_at, duration, error)
+        if error is not None:
+            Logger.ERROR("Job %s failed: %s", job.name, error)
+        elif job.max_runtime is not None and duration > job.max_runtime:
+            Logger.WARNING("Job %s took %.1fs, more than its %gs", job.name, duration, job.max_runtime)
@@ -0,0 +1,155 @@
+import asyncio
+import os
+import socket
+from functools import partial
+from time import monotonic, time
+from typing import Callable, Dict, Optional
+
+from log import Logger
+
+from ..subsystems.sys_firebase import Database
+
+
+def _claim(lease: Optional[dict], holder: str, now: float, duration: float) -> Optional[dict]:
+    """ Takes (or renews) the lease unless someone else holds it and it hasn't expired """
+    if isinstance(lease, dict) and lease.get('holder') != holder and lease.get('expires_at', 0) > now:
+        return lease
+    return {'holder': holder, 'expires_at': now + duration}
+
+
+def _unclaim(lease: Optional[dict], holder: str) -> Optional[dict]:
+    """ Gives the lease up, if it's still held by holder """
+    if isinstance(lease, dict) and lease.get('holder') == holder:
+        return None
+    return lease
+
+
+class LeaseStore:
+    """ Where leases are kept. Claiming one has to be atomic. """
+
+    async def try_acquire(self, name: str, holder: str, duration: float) -> bool:
+        """ Takes or renews the lease for duration seconds. Returns True if holder has it. """
+        raise NotImplementedError
+
+    async def release(self, name: str, holder: str) -> None:
+        """ Gives the lease up, so another holder can take it right away """
+        raise NotImplementedError
+
+
+class DatabaseLeaseStore(LeaseStore):
+    """
+    Keeps leases in the database at path/<name>, claimed through transactions.
+    Expiry times are wall-clock times, since they're compared across machines.
+    """
+
+    def __init__(self, database: Database, path: str) -> None:
+        self.database = database
+        self.path = path
+
+    async def try_acquire(self, name: str, holder: str, duration: float) -> bool:
+        lease = await self.database.transaction_async(
+            f"{self.path}/{name}", partial(_claim, holder=holder, now=time(), duration=duration))
+        return isinstance(lease, dict) and lease.get('holder') == holder
+
+    async def release(self, name: str, holder: str) -> None:
+        await self.database.transaction_async(f"{self.path}/{name}", partial(_unclaim, holder=holder))
+
+
+class LocalLeaseStore(LeaseStore):
+    """ Keeps leases in memory. For a single process (which always wins), and tests. """
+
+    def __init__(self, clock: Callable[[], float] = time) -> None:
+        self.clock = clock
+        # name: lease
+        self._leases: Dict[str, dict] = {}
+
+    async def try_acquire(self, name: str, holder: str, duration: float) -> bool:
+        lease = _claim(self._leases.get(name), holder, self.clock(), duration)
+        self._leases[name] = lease
+        return lease['holder'] == holder
+
+    async def release(self, name: str, holder: str) -> None:
+        if _unclaim(self._leases.get(name), holder) is None:
+            self._leases.pop(name, None)
+
+
+class LeaderElection:
+    """
+    Elects one process to run singleton background tasks (e.g. polling Twitch),
+    among every process of every deployment sharing the lease store.
+
+    The leader holds a lease named name for duration seconds and renews it every
+    third of that. If it dies, its lease runs out and another process takes it
+    over within one lease period (plus a renewal interval at most). A leader
+    that can't renew its lease stops considering itself leader max_skew seconds
+    before the lease may have expired. Others tell that it expired by their own
+    wall clock, so two processes never both believe they lead as long as the
+    clocks of their machines are kept in sync (e.g. by NTP) within max_skew.
+
+    on_change is called with True or False whenever this process gains or loses
+    the lead.
+    """
+
+    def __init__(self, store: LeaseStore, name: str, holder: str = None,
+                 duration: float = 30.0, max_skew: float = 5.0,
+                 on_change: Callable[[bool], None] = None) -> None:
+        self.store = store
+        self.name = name
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}"
+        self.duration = duration
+        self.interval = duration / 3
+        if max_skew >= duration - self.interval:
+            raise ValueError("max_skew must leave time to renew the lease before stepping down")
+        self.max_skew = max_skew
+        self.on_change = on_change
+        # Until when, by this process' clock, the lease is surely still held
+        self._valid_until: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._valid_until is not None and monotonic() < self._valid_until
+
+    async def check(self) -> bool:
+        """ Takes or renews the lease if possible. Returns True if this process leads. """
+        was_leader = self.is_leader
+        started = monotonic()
+        try:
+            if await self.store.try_acquire(self.name, self.holder, self.duration):
+                # Measured from before the claim, so it never outlasts the lease
+                self._valid_until = started + self.duration - self.max_skew
+            else:
+                self._valid_until = None
+        except Exception as e:
+            # The lease may still be held until it runs out, which is_leader accounts for
+            Logger.WARNING(f"Could not renew the {self.name} lease: {e}")
+
+        if self.is_leader != was_leader:
+            Logger.INFO("%s the %s lease as %s", "Took" if self.is_leader else "Lost",
+                        self.name, self.holder)
+            if self.on_change is not None:
+                self.on_change(self.is_leader)
+        return self.is_leader
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check()
+
+    async def start(self) -> None:
+        """ Runs the first election, then keeps renewing or retrying in the background """
+        await self.check()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """ Stops taking part and hands the lease over right away if held """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._valid_until is not None:
+            self._valid_until = None
+            try:
+                await self.store.release(self.name, self.holder)
+            except Exception as e:
+                Logger.WARNING(f"Could not release the {self.name} lease: {e}")
@@ -0,0 +1,67 @@
+import re
+from typing import Iterable, Optional
+
+
+class MessagePrefilter:
+    """
+    Cheap check that runs before any command processing. A message only moves on
+    to prefix resolution and Context creation if it starts with one of the known
+    prefixes or mentions the bot. Everything else (bot messages, ordinary chat)
+    is dropped right away.
+
+    All prefixes and the mention prefix are combined into one compiled pattern that
+    is anchored at the start of the message, so the cost of a check depends on the
+    length of the prefixes rather than the length of the message.
+    """
+
+    def __init__(self, prefixes: Iterable[str] = ()) -> None:
+        self._prefixes = set(prefixes)
+        self._user_id: Optional[int] = None
+        self._pattern = None
+        self.checked = 0
+        self.skipped = 0
+        self._compile()
+
+    def _compile(self) -> None:
+        """ Rebuilds the pattern. Longer prefixes go first so they win over their own prefixes. """
+        alternatives = [re.escape(prefix) for prefix in
+                        sorted(self._prefixes, key=len, reverse=True) if prefix]
+        if self._user_id is not None:
+            alternatives.append(f"<@!?{self._user_id}>")
+        self._pattern = re.compile("|".join(alternatives)) if alternatives else None
+
+    def set_prefixes(self, prefixes: Iterable[str]) -> None:
+        """ Replaces the known prefixes """
+        prefixes = set(prefixes)
+        if prefixes != self._prefixes:
+            self._prefixes = prefixes
+            self._compile()
+
+    def set_user_id(self, user_id: int) -> None:
+        """ Sets the ID of the bot so messages starting with its mention are accepted """
+        if user_id != self._user_id:
+            self._user_id = user_id
+            self._compile()
+
+    def matches(self, content: str) -> bool:
+        """ Checks if the content starts with a known prefix or the bot's mention """
+        return self._pattern is not None and self._pattern.match(content) is not None
+
+    def check(self, content: str, is_bot: bool = False, mentioned: bool = False) -> bool:
+        """
+        Returns True if the message should be processed further. Messages from bots
+        are always rejected, and messages mentioning the bot are always accepted.
+        """
+        self.checked += 1
+        if not is_bot and (mentioned or self.matches(content)):
+            return True
+        self.skipped += 1
+        return False
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'checked': self.checked,
+            'skipped': self.skipped,
+            'passed': self.checked - self.skipped,
+        }
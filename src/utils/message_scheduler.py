@@ -0,0 +1,204 @@
+import asyncio
+import heapq
+from itertools import count
+from time import monotonic
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+import discord
+from discord.ext import commands
+
+# Priorities of outgoing messages: replies to commands go before notifications
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Discord's limit on the length of a message
+MAX_MESSAGE_LENGTH = 2000
+
+
+class TokenBucket:
+    """ Allows capacity actions at once, refilled at capacity per `per` seconds """
+
+    def __init__(self, capacity: int, per: float, clock: Callable[[], float] = monotonic) -> None:
+        self.capacity = capacity
+        self.rate = capacity / per
+        self.clock = clock
+        self._tokens = float(capacity)
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        """ Seconds until an action is allowed """
+        self._refill()
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self) -> None:
+        self._refill()
+        self._tokens -= 1
+
+
+class _Job:
+    """ A message to send (or another call to make) and the callers waiting for it """
+
+    __slots__ = ('content', 'kwargs', 'action', 'merge', 'futures', 'queued_at')
+
+    def __init__(self, content: Optional[str], kwargs: dict,
+                 action: Callable[..., Awaitable], future: asyncio.Future,
+                 merge: bool = True) -> None:
+        self.content = content
+        self.kwargs = kwargs
+        self.action = action
+        self.merge = merge
+        self.futures = [future]
+        self.queued_at = monotonic()
+
+    @property
+    def mergeable(self) -> bool:
+        """ Only plain text can be joined with other messages, if its caller allows it """
+        return self.merge and isinstance(self.content, str) and not self.kwargs
+
+
+class MessageScheduler:
+    """
+    Sends messages through one queue per channel, each drained at the pace of a
+    token bucket that matches Discord's per-channel limit (capacity messages every
+    `per` seconds), instead of hitting 429s and waiting on the library's locks.
+
+    Within a queue, INTERACTIVE messages (replies to commands) go before
+    BACKGROUND ones (notifications), and otherwise keep their order. Plain text
+    messages waiting next to each other with the same priority are merged into
+    one, up to Discord's length limit; their callers all get that message.
+
+    Deletes are queued too, in queues of their own, since Discord limits them
+    separately.
+    """
+
+    def __init__(self, capacity: int = 5, per: float = 5.0) -> None:
+        self.capacity = capacity
+        self.per = per
+        # bucket key: [(priority, order, job)]
+        self._queues: Dict[Hashable, List[tuple]] = {}
+        self._buckets: Dict[Hashable, TokenBucket] = {}
+        self._workers: Dict[Hashable, asyncio.Task] = {}
+        self._order = count()
+
+        self.sent = 0
+        self.merged = 0
+        self._waited = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def depth(self) -> int:
+        """ Messages and deletes waiting to go out """
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'queued': self.depth,
+            'sent': self.sent,
+            'merged': self.merged,
+            'avg_wait_ms': self._waited / self.sent * 1000 if self.sent else 0.0,
+            'max_wait_ms': self.max_wait * 1000,
+        }
+
+    @staticmethod
+    def _key(destination: discord.abc.Messageable) -> Hashable:
+        # Users and members are messaged through their DM channel, which may not be known yet
+        if isinstance(destination, (discord.User, discord.Member)):
+            return ('user', destination.id)
+        if isinstance(destination, commands.Context):
+            return destination.channel.id
+        return destination.id
+
+    def _submit(self, key: Hashable, priority: int, content: Optional[str], kwargs: dict,
+                action: Callable[..., Awaitable], merge: bool = True) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queue = self._queues.setdefault(key, [])
+        heapq.heappush(queue, (priority, next(self._order), _Job(content, kwargs, action, future, merge)))
+        if key not in self._buckets:
+            self._buckets[key] = TokenBucket(self.capacity, self.per)
+        if key not in self._workers:
+            self._workers[key] = loop.create_task(self._drain(key))
+        return future
+
+    def submit(self, destination: discord.abc.Messageable, content: str = None,
+               priority: int = INTERACTIVE, merge: bool = True, **kwargs) -> asyncio.Future:
+        """
+        Queues a message without waiting for it to be sent. Await the returned
+        future for the sent message. Messages submitted one after the other
+        without waiting in between can be merged, unless merge is False (e.g.
+        for messages that are deleted on their own later).
+        """
+        return self._submit(self._key(destination), priority, content, kwargs, destination.send,
+                            merge)
+
+    async def send(self, destination: discord.abc.Messageable, content: str = None,
+                   priority: int = INTERACTIVE, merge: bool = True, **kwargs) -> discord.Message:
+        """ Queues a message and waits until it's sent """
+        return await self.submit(destination, content, priority, merge, **kwargs)
+
+    async def reply(self, ctx: commands.Context, content: str = None, **kwargs) -> discord.Message:
+        """
+        Answers a command. Slash commands answer their interaction, which isn't
+        limited like channels are, so they're sent right away.
+        """
+        if ctx.interaction is not None:
+            return await ctx.send(content, **kwargs)
+        return await self.send(ctx, content, INTERACTIVE, **kwargs)
+
+    def delete(self, message: discord.Message, priority: int = BACKGROUND) -> asyncio.Future:
+        """ Queues deleting a message """
+        return self._submit((message.channel.id, 'delete'), priority, None, {},
+                            lambda: message.delete())
+
+    def _next_batch(self, queue: List[tuple]) -> _Job:
+        """ Takes the next job, merged with the plain text messages right behind it """
+        priority, _, job = heapq.heappop(queue)
+        if not job.mergeable:
+            return job
+        while queue and queue[0][0] == priority and queue[0][2].mergeable:
+            following = queue[0][2]
+            if len(job.content) + 1 + len(following.content) > MAX_MESSAGE_LENGTH:
+                break
+            heapq.heappop(queue)
+            job.content = f"{job.content}\n{following.content}"
+            job.futures.extend(following.futures)
+            self.merged += 1
+        return job
+
+    async def _drain(self, key: Hashable) -> None:
+        queue = self._queues[key]
+        bucket = self._buckets[key]
+        try:
+            while queue:
+                delay = bucket.delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                job = self._next_batch(queue)
+                bucket.take()
+                wait = monotonic() - job.queued_at
+                self._waited += wait
+                self.max_wait = max(self.max_wait, wait)
+                try:
+                    if job.content is None:
+                        result = await job.action(**job.kwargs)
+                    else:
+                        result = await job.action(job.content, **job.kwargs)
+                except Exception as e:
+                    for future in job.futures:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for future in job.futures:
+                        if not future.done():
+                            future.set_result(result)
+                self.sent += 1
+        finally:
+            del self._workers[key]
+            if not queue:
+                del self._queues[key]
@@ -0,0 +1,52 @@
+import threading
+from random import randrange
+from time import time
+
+
+class PushKeyGenerator:
+    """
+    Generates the same kind of unique, chronologically ordered keys that
+    Firebase's push() creates, without asking the server for one. The first
+    8 characters encode the time in milliseconds and the last 12 are random.
+    Keys generated within the same millisecond increment the random part, so
+    they still sort in the order they were generated.
+
+    Based on Firebase's own implementation:
+    https://gist.github.com/mikelehen/3596a30bd69384624c11
+    """
+
+    PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+
+    def __init__(self) -> None:
+        self._last_push_time = 0
+        self._last_rand_chars = [0] * 12
+        self._lock = threading.Lock()
+
+    def generate(self) -> str:
+        with self._lock:
+            now = int(time() * 1000)
+            if now == self._last_push_time:
+                # Increment the random part, carrying over into the previous character
+                i = 11
+                while i >= 0 and self._last_rand_chars[i] == 63:
+                    self._last_rand_chars[i] = 0
+                    i -= 1
+                self._last_rand_chars[i] += 1
+            else:
+                self._last_rand_chars = [randrange(64) for _ in range(12)]
+            self._last_push_time = now
+
+            time_chars = []
+            for _ in range(8):
+                time_chars.append(self.PUSH_CHARS[now % 64])
+                now //= 64
+            rand_chars = [self.PUSH_CHARS[i] for i in self._last_rand_chars]
+            return ''.join(reversed(time_chars)) + ''.join(rand_chars)
+
+
+_generator = PushKeyGenerator()
+
+
+def generate_push_key() -> str:
+    """ Generates a Firebase push key locally """
+    return _generator.generate()
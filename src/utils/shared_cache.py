@@ -0,0 +1,163 @@
+import threading
+from time import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from log import Logger
+
+
+class SharedCacheBackend:
+    """
+    A key-value store shared by every process of the bot, behind CustomCache's
+    shared tier. Values are bytes, and each expires after its TTL (in seconds).
+
+    Changes are announced by publishing messages, which every process listening
+    receives, including the one that published it.
+    """
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        raise NotImplementedError
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        """ Sets key only if it isn't set. Returns True if it was. """
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix: str) -> None:
+        """ Deletes every key that starts with prefix """
+        raise NotImplementedError
+
+    def publish(self, message: str) -> None:
+        raise NotImplementedError
+
+    def listen(self, callback: Callable[[str], None]) -> None:
+        """ Calls callback with every published message, possibly from another thread """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """ Releases the backend's resources """
+
+
+class LocalSharedCache(SharedCacheBackend):
+    """
+    Stand-in for a shared store, kept in this process' memory. Caches using the
+    same instance behave like the caches of separate processes sharing a store.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # key: (value, expiry)
+        self._data: Dict[str, Tuple[bytes, float]] = {}
+        self._listeners: List[Callable[[str], None]] = []
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value, expires = self._data.get(key, (None, 0))
+            if expires <= time():
+                self._data.pop(key, None)
+                return None
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        with self._lock:
+            self._data[key] = (value, time() + ttl)
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        with self._lock:
+            if key in self._data and self._data[key][1] > time():
+                return False
+            self._data[key] = (value, time() + ttl)
+            return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_prefix(self, prefix: str) -> None:
+        with self._lock:
+            for key in [key for key in self._data if key.startswith(prefix)]:
+                del self._data[key]
+
+    def publish(self, message: str) -> None:
+        for listener in list(self._listeners):
+            listener(message)
+
+    def listen(self, callback: Callable[[str], None]) -> None:
+        self._listeners.append(callback)
+
+
+class RedisSharedCache(SharedCacheBackend):
+    """
+    Shared store on a Redis server (or anything speaking its protocol, e.g.
+    Valkey or KeyDB), at a URL like redis://localhost:6379/0. Changes are
+    published on channel, and received by a background thread.
+
+    Calls block, but only for a round trip to the server, and never for longer
+    than socket_timeout seconds.
+    """
+
+    def __init__(self, url: str, channel: str = 'custom_cache:invalidate',
+                 socket_timeout: float = 1.0) -> None:
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("The shared cache needs the redis package: pip install redis") from None
+        self.channel = channel
+        self._client = redis.Redis.from_url(url, socket_timeout=socket_timeout,
+                                            socket_connect_timeout=socket_timeout)
+        self._listeners: List[Callable[[str], None]] = []
+        self._thread = None
+
+    def ping(self) -> None:
+        """ Raises if the server can't be reached """
+        self._client.ping()
+
+    @staticmethod
+    def _ms(ttl: float) -> int:
+        return max(1, int(ttl * 1000))
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._client.set(key, value, px=self._ms(ttl))
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        return bool(self._client.set(key, value, px=self._ms(ttl), nx=True))
+
+    def delete(self, key: str) -> None:
+        self._client.delete(key)
+
+    def delete_prefix(self, prefix: str) -> None:
+        keys = list(self._client.scan_iter(match=f"{prefix}*", count=500))
+        if keys:
+            self._client.delete(*keys)
+
+    def publish(self, message: str) -> None:
+        self._client.publish(self.channel, message)
+
+    def _on_message(self, message: dict) -> None:
+        data = message['data']
+        data = data.decode('utf-8') if isinstance(data, bytes) else data
+        for listener in list(self._listeners):
+            try:
+                listener(data)
+            except Exception as e:
+                Logger.ERROR(f"Shared cache listener failed: {e}")
+
+    def listen(self, callback: Callable[[str], None]) -> None:
+        self._listeners.append(callback)
+        if self._thread is None:
+            pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.channel: self._on_message})
+            self._thread = pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread = None
+        self._client.close()
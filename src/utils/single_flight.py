@@ -0,0 +1,92 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable
+from weakref import WeakValueDictionary
+
+
+class _Call:
+    """ A blocking call in flight, shared by every caller with the same key """
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls. While a call for a key is in flight,
+    other calls with the same key don't start their own; they wait for it and
+    share its result (or its exception). Once it returns, the next call for that
+    key starts a new one, so nothing is cached.
+
+    do() is for blocking calls made from threads, do_async() for coroutines.
+
+    Named instances are listed in SingleFlight.registry so their counters
+    can be reported.
+    """
+
+    registry: 'WeakValueDictionary[str, SingleFlight]' = WeakValueDictionary()
+
+    def __init__(self, name: str = None) -> None:
+        self.name = name
+        self._lock = threading.Lock()
+        # key: call in flight
+        self._calls: Dict[Hashable, _Call] = {}
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+
+        # Calls that were made and calls that shared another one's result
+        self.calls = 0
+        self.merged = 0
+
+        if name is not None:
+            SingleFlight.registry[name] = self
+
+    @property
+    def stats(self) -> dict:
+        return {'calls': self.calls, 'merged': self.merged}
+
+    def in_flight(self, key: Hashable) -> bool:
+        """ Checks if a call for key is running """
+        return key in self._calls or key in self._futures
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs):
+        """ Calls fn(*args, **kwargs) unless a call for key is already in flight """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.merged += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs):
+        """ Awaits fn(*args, **kwargs) unless a call for key is already in flight """
+        future = self._futures.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn(*args, **kwargs))
+            self._futures[key] = future
+            future.add_done_callback(lambda _: self._futures.pop(key, None))
+            self.calls += 1
+        else:
+            self.merged += 1
+        # A caller that gets cancelled must not cancel the call for the others
+        return await asyncio.shield(future)
@@ -0,0 +1,133 @@
+import asyncio
+from inspect import iscoroutinefunction
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from log import Logger
+
+from .helper import Helper
+
+
+class _Step:
+    """ A startup step, its dependencies and how it went """
+
+    def __init__(self, name: str, fn: Callable[[], Any], depends: Iterable[str],
+                 optional: bool) -> None:
+        self.name = name
+        self.fn = fn
+        self.depends = tuple(depends)
+        self.optional = optional
+        # pending, running, done or failed
+        self.state = 'pending'
+        self.started: Optional[float] = None
+        self.duration: Optional[float] = None
+
+
+class StartupGraph:
+    """
+    The steps of the application's startup and their dependencies. run() starts
+    every step as soon as the steps it depends on are done, so independent steps
+    (e.g. authenticating with different services) run at the same time.
+
+    Coroutine functions run on the event loop and other functions in threads.
+    Steps can be added while the graph runs, e.g. by cogs while they load, and
+    the same run picks them up. A later run() only runs the steps added since.
+
+    Optional steps, like warming caches, only log a warning when they fail. When
+    a required step fails, nothing new is started and run() raises once the steps
+    in progress are done.
+
+    Each step's start and duration are recorded for report().
+    """
+
+    def __init__(self) -> None:
+        self._origin = perf_counter()
+        # name: step, in the order they were added
+        self._steps: Dict[str, _Step] = {}
+        self.results: Dict[str, Any] = {}
+
+    def add(self, name: str, fn: Callable[[], Any], depends: Iterable[str] = (),
+            optional: bool = False) -> None:
+        """ Adds a step that calls fn once the steps named in depends are done """
+        if name in self._steps:
+            raise ValueError(f"Startup step {name} already exists")
+        self._steps[name] = _Step(name, fn, depends, optional)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._steps
+
+    @property
+    def names(self) -> List[str]:
+        """ Names of the steps, in the order they were added """
+        return list(self._steps)
+
+    def _is_finished(self, name: str) -> bool:
+        step = self._steps.get(name)
+        if step is None:
+            return False
+        # Whatever depends on an optional step can still start without it
+        return step.state == 'done' or (step.state == 'failed' and step.optional)
+
+    def _is_ready(self, step: _Step) -> bool:
+        return all(self._is_finished(dependency) for dependency in step.depends)
+
+    async def _run_step(self, step: _Step) -> None:
+        step.started = perf_counter()
+        try:
+            if iscoroutinefunction(step.fn):
+                self.results[step.name] = await step.fn()
+            else:
+                self.results[step.name] = await Helper.run_in_thread(step.fn)
+        finally:
+            step.duration = perf_counter() - step.started
+
+    async def run(self) -> None:
+        """ Runs every step that hasn't run yet """
+        running: Dict[asyncio.Future, _Step] = {}
+        error = None
+        while True:
+            if error is None:
+                for step in list(self._steps.values()):
+                    if step.state == 'pending' and self._is_ready(step):
+                        step.state = 'running'
+                        running[asyncio.ensure_future(self._run_step(step))] = step
+            if not running:
+                break
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                step = running.pop(task)
+                e = task.exception()
+                if e is None:
+                    step.state = 'done'
+                    continue
+                step.state = 'failed'
+                if step.optional:
+                    Logger.WARNING("Startup step %s failed: %s", step.name, e)
+                else:
+                    Logger.ERROR("Startup step %s failed: %s", step.name, e)
+                    error = error or e
+        if error is not None:
+            raise error
+
+        blocked = [step.name for step in self._steps.values() if step.state == 'pending']
+        if blocked:
+            raise RuntimeError("Startup steps with missing or circular dependencies: "
+                               + ', '.join(blocked))
+
+    def report(self) -> str:
+        """ Lists when each step started and how long it took, in seconds since the graph was created """
+        lines = [f"Startup took {perf_counter() - self._origin:.2f}s:"]
+        steps = sorted((step for step in self._steps.values() if step.started is not None),
+                       key=lambda step: step.started)
+        width = max((len(step.name) for step in steps), default=0)
+        for step in steps:
+            status = '' if step.state == 'done' else f" ({step.state})"
+            lines.append(f"  {step.name:<{width}}  at {step.started - self._origin:6.2f}s"
+                         f"  took {step.duration or 0:6.2f}s{status}")
+        return '\n'.join(lines)
+
+    @property
+    def timings(self) -> List[tuple]:
+        """ (name, start, duration) of the steps that ran, in seconds """
+        return [(step.name, step.started - self._origin, step.duration)
+                for step in self._steps.values() if step.started is not None]
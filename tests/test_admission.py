@@ -0,0 +1,214 @@
+import asyncio
+
+import pytest
+
+from src.utils.admission import AdmissionController, CommandBusy, admitted
+
+
+class FakeResponse():
+    """ Stand-in for an interaction's response """
+
+    def __init__(self):
+        self.deferred = False
+
+    def is_done(self):
+        return self.deferred
+
+
+class FakeInteraction():
+
+    def __init__(self):
+        self.response = FakeResponse()
+
+
+class FakeBot():
+
+    def __init__(self, admission):
+        self.admission = admission
+        self.replies = []
+        self.scheduler = self
+
+    async def reply(self, ctx, content):
+        self.replies.append(content)
+
+
+class FakeCommand():
+    qualified_name = 'small'
+
+
+class FakeGuild():
+    id = 1
+
+
+class FakeAuthor():
+    mention = '@user'
+
+
+class FakeContext():
+    """ A slash command's context """
+
+    def __init__(self, bot, events):
+        self.bot = bot
+        self.events = events
+        self.command = FakeCommand()
+        self.guild = FakeGuild()
+        self.author = FakeAuthor()
+        self.interaction = FakeInteraction()
+
+    async def defer(self):
+        self.interaction.response.deferred = True
+        self.events.append('defer')
+
+
+class TestAdmissionController():
+
+    def test_limits(self):
+        async def run():
+            admission = AdmissionController(max_running=3, per_guild=2, max_queued=8)
+            started = []
+            release = asyncio.Event()
+
+            async def heavy(command, guild_id, limit=5):
+                async with admission.slot(command, guild_id, limit, max_wait=5.0):
+                    started.append((command, guild_id))
+                    await release.wait()
+
+            tasks = [asyncio.ensure_future(heavy('small', 1)),
+                     asyncio.ensure_future(heavy('small', 1)),
+                     # Over the guild's limit
+                     asyncio.ensure_future(heavy('small', 1)),
+                     # Over the command's limit
+                     asyncio.ensure_future(heavy('matches', 2, limit=1)),
+                     asyncio.ensure_future(heavy('matches', 2, limit=1)),
+                     # Over the global limit
+                     asyncio.ensure_future(heavy('small', 3))]
+            await asyncio.sleep(0.01)
+            assert started == [('small', 1), ('small', 1), ('matches', 2)]
+            assert admission.stats['running'] == 3
+            assert admission.stats['waiting'] == 3
+
+            release.set()
+            await asyncio.gather(*tasks)
+            assert len(started) == 6
+            assert admission.stats['running'] == 0
+            assert admission.stats['waiting'] == 0
+            assert admission.stats['admitted'] == 6
+        asyncio.run(run())
+
+    def test_waiters_admitted_in_order(self):
+        async def run():
+            admission = AdmissionController(max_running=1, per_guild=1, max_queued=8)
+            order = []
+            gate = asyncio.Event()
+
+            async def heavy(name):
+                async with admission.slot('small', 1, 1, max_wait=5.0):
+                    order.append(name)
+                    await gate.wait()
+
+            first = asyncio.ensure_future(heavy('first'))
+            await asyncio.sleep(0)
+            others = []
+            for name in ('second', 'third', 'fourth'):
+                others.append(asyncio.ensure_future(heavy(name)))
+                await asyncio.sleep(0)
+            gate.set()
+            await asyncio.gather(first, *others)
+            assert order == ['first', 'second', 'third', 'fourth']
+        asyncio.run(run())
+
+    def test_full_queue_turns_away(self):
+        async def run():
+            admission = AdmissionController(max_running=1, per_guild=1, max_queued=1)
+            release = asyncio.Event()
+
+            async def heavy():
+                async with admission.slot('small', 1, 1, max_wait=5.0):
+                    await release.wait()
+
+            running = asyncio.ensure_future(heavy())
+            waiting = asyncio.ensure_future(heavy())
+            await asyncio.sleep(0.01)
+            with pytest.raises(CommandBusy):
+                await heavy()
+            assert admission.stats['rejected'] == 1
+
+            release.set()
+            await asyncio.gather(running, waiting)
+            assert admission.stats['admitted'] == 2
+        asyncio.run(run())
+
+    def test_wait_times_out(self):
+        async def run():
+            admission = AdmissionController(max_running=1, per_guild=1, max_queued=4)
+            release = asyncio.Event()
+
+            async def heavy(max_wait):
+                async with admission.slot('small', None, 1, max_wait=max_wait):
+                    await release.wait()
+
+            running = asyncio.ensure_future(heavy(5.0))
+            await asyncio.sleep(0)
+            with pytest.raises(CommandBusy):
+                await heavy(0.01)
+            # It left the queue, and didn't take a slot
+            assert admission.stats['waiting'] == 0
+            assert admission.stats['rejected'] == 1
+
+            release.set()
+            await running
+            assert admission.stats['running'] == 0
+        asyncio.run(run())
+
+    def test_records_wait_times(self):
+        async def run():
+            admission = AdmissionController(max_running=1, per_guild=1, max_queued=4)
+
+            async def heavy():
+                async with admission.slot('small', 1, 1, max_wait=5.0):
+                    await asyncio.sleep(0.02)
+
+            await asyncio.gather(heavy(), heavy())
+            stats = admission.stats
+            # Only the second one waited, for about as long as the first ran
+            assert stats['max_wait_ms'] >= 15
+            assert stats['avg_wait_ms'] == stats['max_wait_ms']
+        asyncio.run(run())
+
+    def test_defers_slash_commands_before_waiting(self):
+        async def run():
+            admission = AdmissionController(max_running=1, per_guild=1, max_queued=4)
+            bot = FakeBot(admission)
+            events = []
+            release = asyncio.Event()
+
+            class Cog():
+                @admitted(limit=1, max_wait=5.0)
+                async def small(self, ctx):
+                    events.append('run')
+                    await release.wait()
+
+            cog = Cog()
+            running = asyncio.ensure_future(cog.small(FakeContext(bot, events)))
+            await asyncio.sleep(0)
+            queued_ctx = FakeContext(bot, events)
+            queued = asyncio.ensure_future(cog.small(queued_ctx))
+            await asyncio.sleep(0.01)
+            # Answered while it waits for its turn
+            assert queued_ctx.interaction.response.is_done()
+            assert events == ['defer', 'run', 'defer']
+            release.set()
+            await asyncio.gather(running, queued)
+            assert events == ['defer', 'run', 'defer', 'run']
+
+            # Turned away, after deferring, so the busy reply can still be sent
+            admission.max_queued = 0
+            release.clear()
+            running = asyncio.ensure_future(cog.small(FakeContext(bot, events)))
+            await asyncio.sleep(0)
+            await cog.small(FakeContext(bot, events))
+            assert bot.replies == ["@user: I'm busy with too many of those right now, try again in a bit!"]
+            assert events[-1] == 'defer'
+            release.set()
+            await running
+        asyncio.run(run())
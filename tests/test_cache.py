@@ -1,8 +1,29 @@
+import asyncio
+import threading
+from random import Random
 from time import sleep
 
 import pytest
 
+from src.utils import custom_cache
 from src.utils.custom_cache import CustomCache
+from src.utils.shared_cache import LocalSharedCache, SharedCacheBackend
+
+
+class DownSharedCache(SharedCacheBackend):
+    """ A shared store that can't be reached, counting the calls made to it """
+
+    def __init__(self):
+        self.calls = 0
+
+    def _fail(self, *args):
+        self.calls += 1
+        raise ConnectionError("Connection refused")
+
+    get = set = add = delete = delete_prefix = publish = _fail
+
+    def listen(self, callback):
+        pass
 
 
 class TestCache():
@@ -137,3 +158,329 @@ def compute_fibonacci(n):
         assert cache[10] == 55
         assert cache[0] == 0
         assert len(cache) == 3
+
+    def test_decorator_key(self):
+        cache = CustomCache(maxsize=5, ttl=10, key=lambda settings: settings['guild_id'])
+        calls = 0
+
+        @cache
+        def get_prefix(settings):
+            nonlocal calls
+            calls += 1
+            return settings['cmd_prefix']
+
+        # Dicts aren't hashable, so they can only be cached through the key function
+        assert get_prefix({'guild_id': 1, 'cmd_prefix': '>'}) == '>'
+        assert get_prefix({'guild_id': 1, 'cmd_prefix': '>'}) == '>'
+        assert calls == 1
+        assert get_prefix.__name__ == 'get_prefix'
+
+    def test_async_decorator(self):
+        calls = 0
+
+        @CustomCache(maxsize=5, ttl=10)
+        async def get_version(region):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return f"{region}-13.9.1"
+
+        async def main():
+            results = await asyncio.gather(*(get_version('na1') for _ in range(5)))
+            results.append(await get_version('na1'))
+            return results
+
+        assert asyncio.run(main()) == ['na1-13.9.1'] * 6
+        # Concurrent misses share one call, and later calls are hits
+        assert calls == 1
+
+    def test_async_stale_while_revalidate(self):
+        calls = 0
+
+        @CustomCache(maxsize=5, ttl=0.1, stale_ttl=10)
+        async def get_version():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return calls
+
+        async def main():
+            first = await get_version()
+            await asyncio.sleep(0.15)
+            # Expired: the stale value is returned right away and one refresh starts
+            stale = await asyncio.gather(*(get_version() for _ in range(3)))
+            await asyncio.sleep(0.1)
+            return first, stale, await get_version()
+
+        first, stale, refreshed = asyncio.run(main())
+        assert first == 1
+        assert stale == [1, 1, 1]
+        assert refreshed == 2
+        assert calls == 2
+
+    def test_async_refresh_error_keeps_stale_value(self):
+        fail = False
+
+        @CustomCache(maxsize=5, ttl=0.05, stale_ttl=10)
+        async def get_version():
+            if fail:
+                raise ConnectionError("Data Dragon is down")
+            return '13.9.1'
+
+        async def main():
+            nonlocal fail
+            await get_version()
+            fail = True
+            await asyncio.sleep(0.1)
+            stale = await get_version()
+            await asyncio.sleep(0.05)
+            return stale, await get_version()
+
+        assert asyncio.run(main()) == ('13.9.1', '13.9.1')
+
+    @pytest.mark.parametrize("policy", ['ttl', 'lru', 'lfu'])
+    def test_policies_are_bounded(self, policy):
+        cache = CustomCache(maxsize=10, policy=policy)
+        for i in range(100):
+            cache.add(i, i)
+        assert len(cache) == 10
+        assert cache.stats['evictions'] == 90
+
+    def test_lru_policy(self):
+        cache = CustomCache(maxsize=2, policy='lru')
+        cache.add("key1", 1)
+        cache.add("key2", 2)
+        cache.get("key1")
+        cache.add("key3", 3)
+        assert cache.keys() == ["key1", "key3"]
+
+    def test_lfu_policy(self):
+        cache = CustomCache(maxsize=2, policy='lfu')
+        cache.add("key1", 1)
+        cache.add("key2", 2)
+        for _ in range(3):
+            cache.get("key2")
+        cache.get("key1")
+        cache.add("key3", 3)
+        assert "key2" in cache
+        assert "key1" not in cache
+
+    def test_lru_policy_still_expires(self):
+        cache = CustomCache(ttl=0.05, policy='lru')
+        cache.add("key1", 1)
+        sleep(0.1)
+        assert cache.get("key1") is None
+        assert len(cache) == 0
+
+    def test_unknown_policy(self):
+        with pytest.raises(ValueError):
+            CustomCache(policy='fifo')
+
+    def test_per_key_ttl(self):
+        cache = CustomCache(ttl=10)
+        cache.add("short", 1, ttl=0.05)
+        cache.add("long", 2)
+        sleep(0.1)
+        assert cache.get("short") is None
+        assert cache.get("long") == 2
+
+    def test_stats(self):
+        cache = CustomCache(maxsize=1)
+        cache.add("key1", 1)
+        cache.get("key1")
+        cache.get("key2")
+        cache.add("key2", 2)
+        assert cache.stats == {'hits': 1, 'misses': 1, 'evictions': 1, 'disk_hits': 0,
+                               'shared_hits': 0, 'size': 1, 'disk_size': 0}
+
+    def test_disk_tier(self, tmp_path):
+        cache = CustomCache(maxsize=1, disk_path=str(tmp_path), disk_maxsize=2)
+        champions = {'version': '13.9.1', 'data': {'Ahri': {'key': '103'}}}
+        cache.add("champions", champions)
+        cache.add("languages", ['en_US'])
+        # Evicted from memory but still on disk
+        assert cache.get("champions") == champions
+        assert cache.stats['disk_hits'] == 1
+
+        # The disk tier survives a new cache, e.g. after a restart
+        cache = CustomCache(maxsize=1, disk_path=str(tmp_path), disk_maxsize=2)
+        assert cache.get("languages") == ['en_US']
+
+        cache.add("versions", ['13.9.1'])
+        assert len(cache.disk) == 2
+        del cache["versions"]
+        assert "versions" not in cache
+
+        cache.clear()
+        assert len(cache) == 0 and len(cache.disk) == 0
+        assert cache.get("languages") is None
+
+    def test_async_disk_tier_off_the_loop(self, tmp_path):
+        cache = CustomCache(maxsize=1, disk_path=str(tmp_path))
+        threads = []
+        disk_get, disk_set = cache.disk.get, cache.disk.set
+
+        def get(key):
+            threads.append(threading.get_ident())
+            return disk_get(key)
+
+        def set(key, entry):
+            threads.append(threading.get_ident())
+            disk_set(key, entry)
+
+        cache.disk.get, cache.disk.set = get, set
+
+        @cache
+        async def get_champions(version):
+            return {'version': version}
+
+        async def main():
+            assert await get_champions('13.9.1') == {'version': '13.9.1'}
+            # Evicts the first from memory, so it's read from disk
+            await get_champions('13.8.1')
+            assert await get_champions('13.9.1') == {'version': '13.9.1'}
+            return threading.get_ident()
+
+        loop_thread = asyncio.run(main())
+        assert cache.stats['disk_hits'] == 1
+        assert threads and loop_thread not in threads
+
+    def test_disk_tier_shared_folder(self, tmp_path):
+        # Two caches on one folder, like processes of a cluster, written from threads
+        caches = [CustomCache(maxsize=1, disk_path=str(tmp_path), disk_maxsize=5) for _ in range(2)]
+
+        def write(cache):
+            for i in range(50):
+                cache.add(f"key{i % 10}", i)
+
+        threads = [threading.Thread(target=write, args=(cache,)) for cache in caches for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not [f for f in tmp_path.iterdir() if f.suffix == '.tmp']
+        assert len(list(tmp_path.iterdir())) <= 10
+
+        # Files the other cache removed already are skipped
+        caches[0].clear()
+        caches[1].disk.delete_digest('0' * 64)
+        caches[1].clear()
+        assert list(tmp_path.iterdir()) == []
+
+    def test_shared_tier(self, monkeypatch):
+        monkeypatch.setattr(CustomCache, 'shared_backend', LocalSharedCache())
+        # Two caches with the same name stand for the same cache in two processes
+        first = CustomCache(shared=True, name='champions')
+        second = CustomCache(shared=True, name='champions')
+        other = CustomCache(shared=True, name='languages')
+        first.add("champions", {'Ahri': '103'})
+        assert second.get("champions") == {'Ahri': '103'}
+        assert second.stats['shared_hits'] == 1
+        assert other.get("champions") is None
+
+        # Deleting in one process drops the copy the other keeps in memory
+        del first["champions"]
+        assert second.get("champions") is None
+        first.add("champions", {'Ahri': '103', 'Akali': '84'})
+        assert second.get("champions") == {'Ahri': '103', 'Akali': '84'}
+
+        first.add("champions", {})
+        second.get("champions")
+        first.clear()
+        assert second.get("champions") is None
+
+    def test_shared_store_down_is_skipped(self, monkeypatch):
+        backend = DownSharedCache()
+        monkeypatch.setattr(CustomCache, 'shared_backend', backend)
+        monkeypatch.setattr(custom_cache, '_RETRY_AFTER', 0.1)
+
+        @CustomCache(shared=True, name='versions', key=lambda: 'version')
+        async def get_version():
+            return '13.9.1'
+
+        other = CustomCache(shared=True, name='languages')
+        assert asyncio.run(get_version()) == '13.9.1'
+        # The lookup failed, and the rest of the miss skipped the store
+        assert backend.calls == 1
+        other.add("languages", ['en_US'])
+        assert other.get("missing") is None
+        assert backend.calls == 1
+
+        # Tried again once it's been skipped for a while
+        sleep(0.1)
+        assert other.get("missing") is None
+        assert backend.calls == 2
+
+    def test_shared_cache_needs_name(self):
+        with pytest.raises(ValueError):
+            CustomCache(shared=True)
+
+    def test_shared_async_computes_once(self, monkeypatch):
+        monkeypatch.setattr(CustomCache, 'shared_backend', LocalSharedCache())
+        calls = []
+
+        def make_worker():
+            @CustomCache(shared=True, name='versions', key=lambda: 'version')
+            async def get_version():
+                calls.append(1)
+                await asyncio.sleep(0.2)
+                return '13.9.1'
+            return get_version
+
+        async def main():
+            # Separate caches, like in separate processes
+            return await asyncio.gather(*(make_worker()() for _ in range(3)))
+
+        assert asyncio.run(main()) == ['13.9.1'] * 3
+        assert len(calls) == 1
+
+    @pytest.mark.parametrize("value", [lambda: None, ('13.9.1',), {1: 'Annie'}])
+    def test_shared_non_json_values_stay_local(self, monkeypatch, value):
+        monkeypatch.setattr(CustomCache, 'shared_backend', LocalSharedCache())
+        first = CustomCache(shared=True, name='blobs')
+        second = CustomCache(shared=True, name='blobs')
+        # Each process fills its own copy, without dropping the other's
+        for _ in range(3):
+            if first.get("audio/") is None:
+                first.add("audio/", value)
+            if second.get("audio/") is None:
+                second.add("audio/", value)
+        assert first.stats['misses'] == 1 and first.stats['hits'] == 2
+        assert second.stats['misses'] == 1 and second.stats['hits'] == 2
+        # Clearing it still reaches the other process
+        first.clear()
+        assert second.get("audio/") is None
+
+    def test_many_hits(self):
+        cache = CustomCache(maxsize=1000)
+        for i in range(1000):
+            cache.add(i, i)
+        for _ in range(50):
+            for i in range(1000):
+                cache.get(i)
+        assert cache.stats['hits'] == 50000
+
+    @pytest.mark.parametrize("policy", ['ttl', 'lru', 'lfu'])
+    def test_churn_stays_bounded(self, policy):
+        cache = CustomCache(maxsize=100, policy=policy)
+        # Skewed keys, like a few popular summoners among many
+        rng = Random(0)
+        keys = [int(rng.paretovariate(1.0)) % 500 for _ in range(20000)]
+        for key in keys:
+            if cache.get(key) is None:
+                cache.add(key, key)
+        assert len(cache) == 100
+        assert cache.stats['hits'] + cache.stats['misses'] == 20000
+
+    def test_decorator_many_calls(self):
+        calls = []
+
+        @CustomCache(maxsize=100)
+        def square(n):
+            calls.append(n)
+            return n * n
+
+        for _ in range(200):
+            for n in range(100):
+                assert square(n) == n * n
+        assert len(calls) == 100
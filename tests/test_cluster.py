@@ -0,0 +1,43 @@
+import asyncio
+import os
+import signal
+import sys
+
+import pytest
+
+from src.utils.cluster import cancel_on_sigterm, shard_ranges
+
+
+class TestCluster():
+
+    def test_shard_ranges(self):
+        assert shard_ranges(8, 2) == [[0, 1, 2, 3], [4, 5, 6, 7]]
+        assert shard_ranges(5, 2) == [[0, 1, 2], [3, 4]]
+        # Never more processes than shards
+        assert shard_ranges(2, 4) == [[0], [1]]
+        ranges = shard_ranges(100, 7)
+        assert sum(ranges, []) == list(range(100))
+        assert max(map(len, ranges)) - min(map(len, ranges)) <= 1
+
+    @pytest.mark.skipif(sys.platform == 'win32', reason="no SIGTERM handlers on Windows")
+    def test_cancel_on_sigterm(self):
+        closed = []
+
+        async def worker():
+            cancel_on_sigterm(asyncio.current_task())
+            try:
+                os.kill(os.getpid(), signal.SIGTERM)
+                await asyncio.sleep(5)
+            finally:
+                # A second SIGTERM doesn't interrupt the close
+                os.kill(os.getpid(), signal.SIGTERM)
+                await asyncio.sleep(0.1)
+                closed.append(True)
+
+        handler = signal.getsignal(signal.SIGTERM)
+        try:
+            with pytest.raises(asyncio.CancelledError):
+                asyncio.run(worker())
+        finally:
+            signal.signal(signal.SIGTERM, handler)
+        assert closed == [True]
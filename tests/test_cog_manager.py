@@ -0,0 +1,109 @@
+import asyncio
+import sys
+
+from src.bot import CustomBot
+from src.managers.cog_manager import make_stand_in
+from src.utils.cog_manifest import read_cog
+from src.utils.import_report import ImportTimes, parse_importtime
+
+
+class TestCogManifest():
+
+    def test_read_cog(self):
+        spec = read_cog('./src/cogs/admin.py', 'src.cogs.admin')
+        assert spec.name == 'Admin' and spec.lazy
+        assert spec.description.strip() == 'Commands that deal with administrative properties and tasks'
+        commands_by_name = {command.name: command for command in spec.commands}
+        assert set(commands_by_name) >= {'setprefix', 'flights', 'upload'}
+        assert 'changeprefix' in commands_by_name['setprefix'].aliases
+        assert commands_by_name['setprefix'].help == 'Change prefix for commands in this server.'
+
+    def test_literal_strings_joined(self, tmp_path):
+        cog_file = tmp_path / 'cog.py'
+        cog_file.write_text(
+            'class Cog(commands.Cog):\n'
+            '    @commands.command(help="a" +\n'
+            '                      "b")\n'
+            '    async def joined(self, ctx):\n'
+            '        pass\n')
+        assert read_cog(str(cog_file), 'cog').commands[0].help == 'ab'
+
+    def test_cogs_that_are_not_lazy(self):
+        # Background tasks
+        assert not read_cog('./src/cogs/twitch.py', 'src.cogs.twitch').lazy
+        assert not read_cog('./src/cogs/voice.py', 'src.cogs.voice').lazy
+        # Slash commands
+        assert not read_cog('./src/cogs/league.py', 'src.cogs.league').lazy
+        interact = read_cog('./src/cogs/interact.py', 'src.cogs.interact')
+        assert interact.lazy and interact.commands[0].hidden
+
+    def test_stand_in(self):
+        spec = read_cog('./src/cogs/interact.py', 'src.cogs.interact')
+        stand_in = make_stand_in(spec)
+        assert stand_in.qualified_name == 'Interact'
+        assert stand_in.description.strip() == 'Interactions with the bot.'
+        assert [command.name for command in stand_in.get_commands()] == ['spam']
+        assert stand_in.get_commands()[0].aliases == ['spamming']
+
+    def test_load_replaces_stand_in(self):
+        bot = CustomBot('Test bot', None, None)
+        manager = bot.cog_manager
+        spec = read_cog('./src/cogs/interact.py', 'src.cogs.interact')
+
+        async def main():
+            await manager.add_stand_in(spec)
+            assert bot.get_command('spam').cog.__module__ == 'src.managers.cog_manager'
+            # Concurrent first uses load it once
+            await asyncio.gather(manager.load(spec.extension), manager.load(spec.extension))
+            await manager.load(spec.extension)
+
+        asyncio.run(main())
+        assert manager.pending == []
+        assert bot.get_command('spam').cog.__module__ == 'src.cogs.interact'
+
+    def test_stand_in_kept_while_loading(self, tmp_path, monkeypatch):
+        cog_file = tmp_path / 'slow_cog.py'
+        cog_file.write_text(
+            'import asyncio\n'
+            'from discord.ext import commands\n'
+            'loaded = asyncio.Event()\n'
+            'cog_loads = []\n'
+            'class Slow(commands.Cog):\n'
+            '    async def cog_load(self):\n'
+            '        cog_loads.append(1)\n'
+            '        await loaded.wait()\n'
+            '    @commands.command()\n'
+            '    async def slow(self, ctx):\n'
+            '        pass\n'
+            'async def setup(bot):\n'
+            '    await bot.add_cog(Slow())\n')
+        monkeypatch.syspath_prepend(str(tmp_path))
+        monkeypatch.delitem(sys.modules, 'slow_cog', raising=False)
+        bot = CustomBot('Test bot', None, None)
+        spec = read_cog(str(cog_file), 'slow_cog')
+
+        async def main():
+            await bot.cog_manager.add_stand_in(spec)
+            loading = asyncio.ensure_future(bot.cog_manager.load('slow_cog'))
+            await asyncio.sleep(0.01)
+            # Still answered by the stub, which waits for the load
+            assert bot.get_command('slow').cog.__module__ == 'src.managers.cog_manager'
+            sys.modules['slow_cog'].loaded.set()
+            await loading
+
+        asyncio.run(main())
+        assert bot.get_command('slow').cog.__module__ == 'slow_cog'
+        assert sys.modules['slow_cog'].cog_loads == [1]
+
+
+class TestImportReport():
+
+    def test_parse_importtime(self):
+        output = ("import time: self [us] | cumulative | imported package\n"
+                  "import time:       100 |        100 |     aiohttp.helpers\n"
+                  "import time:       200 |       2000 |   aiohttp\n"
+                  "import time:       300 |       3000 | src.cogs.games\n")
+        times = ImportTimes('src.cogs.games', parse_importtime(output), None)
+        assert times.imports[0] == ('aiohttp.helpers', 100, 100)
+        assert times.total_ms == 3.0
+        assert times.slowest() == [('aiohttp', 2.0)]
@@ -0,0 +1,100 @@
+import asyncio
+from types import SimpleNamespace
+
+from discord.ext import commands
+
+from src.utils.command_cache import ResponseCache, cached_response
+
+
+class FakeContext():
+    """ Stand-in for commands.Context that records what is sent """
+
+    def __init__(self, bot, command_name, author_id=1, guild_id=10):
+        self.bot = bot
+        self.command = SimpleNamespace(qualified_name=command_name)
+        self.author = SimpleNamespace(mention=f"<@{author_id}>")
+        self.guild = SimpleNamespace(id=guild_id)
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+
+
+class FakeCog():
+
+    def __init__(self):
+        self.calls = 0
+
+    @cached_response(ttl=10, ignore_case=True)
+    async def stats(self, ctx, summoner: str, *args):
+        self.calls += 1
+        await ctx.send(f"{ctx.author.mention}: stats of {summoner}")
+
+    @cached_response(ttl=10)
+    async def find(self, ctx, name: str):
+        self.calls += 1
+        if name == 'missing':
+            ctx.cache_response = False
+            await ctx.send(f"{name} not found")
+            return
+        await ctx.send(f"found {name}")
+
+    @cached_response(ttl=10)
+    async def upload(self, ctx):
+        self.calls += 1
+        await ctx.send("uploaded", file=object())
+
+
+class TestCommandCache():
+
+    def test_replays_response(self):
+        bot = SimpleNamespace(response_cache=ResponseCache())
+        cog = FakeCog()
+        first = FakeContext(bot, 'stats', author_id=1)
+        second = FakeContext(bot, 'stats', author_id=2)
+        asyncio.run(cog.stats(first, 'Doublelift'))
+        asyncio.run(cog.stats(second, ' doublelift '))
+        assert cog.calls == 1
+        assert first.sent == ["<@1>: stats of Doublelift"]
+        # The mention is the one of whoever asked
+        assert second.sent == ["<@2>: stats of Doublelift"]
+
+    def test_keyed_by_guild_and_args(self):
+        bot = SimpleNamespace(response_cache=ResponseCache())
+        cog = FakeCog()
+        asyncio.run(cog.stats(FakeContext(bot, 'stats', guild_id=10), 'a'))
+        asyncio.run(cog.stats(FakeContext(bot, 'stats', guild_id=11), 'a'))
+        asyncio.run(cog.stats(FakeContext(bot, 'stats', guild_id=10), 'b'))
+        assert cog.calls == 3
+
+    def test_invalidate(self):
+        bot = SimpleNamespace(response_cache=ResponseCache())
+        cog = FakeCog()
+        asyncio.run(cog.stats(FakeContext(bot, 'stats'), 'a'))
+        bot.response_cache.invalidate('getobjs')
+        asyncio.run(cog.stats(FakeContext(bot, 'stats'), 'a'))
+        assert cog.calls == 1
+        bot.response_cache.invalidate('stats')
+        asyncio.run(cog.stats(FakeContext(bot, 'stats'), 'a'))
+        assert cog.calls == 2
+
+    def test_files_are_not_cached(self):
+        bot = SimpleNamespace(response_cache=ResponseCache())
+        cog = FakeCog()
+        asyncio.run(cog.upload(FakeContext(bot, 'upload')))
+        asyncio.run(cog.upload(FakeContext(bot, 'upload')))
+        assert cog.calls == 2
+
+    def test_errors_are_not_cached(self):
+        bot = SimpleNamespace(response_cache=ResponseCache())
+        cog = FakeCog()
+        for _ in range(2):
+            asyncio.run(cog.find(FakeContext(bot, 'find'), 'missing'))
+        assert cog.calls == 2
+        for _ in range(2):
+            asyncio.run(cog.find(FakeContext(bot, 'find'), 'a'))
+        assert cog.calls == 3
+
+    def test_command_signature(self):
+        command = commands.command()(FakeCog.stats)
+        assert list(command.clean_params) == ['summoner', 'args']
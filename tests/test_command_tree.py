@@ -0,0 +1,57 @@
+import asyncio
+
+import discord
+from discord import app_commands
+
+from src.managers.command_tree_manager import CommandTreeManager
+from src.subsystems.sys_firebase import Database
+from src.subsystems.sys_sqlite import SQLiteBackend
+
+
+class FakeTree():
+    """ A command tree that counts syncs instead of calling Discord """
+
+    def __init__(self, *commands) -> None:
+        self.commands = list(commands)
+        self.syncs = 0
+
+    def get_commands(self, guild=None):
+        return self.commands
+
+    async def sync(self, guild=None):
+        self.syncs += 1
+        return self.commands
+
+
+def make_command(name: str, description: str) -> app_commands.Command:
+    async def callback(interaction: discord.Interaction, summoner: str) -> None:
+        pass
+    return app_commands.Command(name=name, description=description, callback=callback)
+
+
+class TestCommandTreeManager():
+
+    def test_signature(self):
+        stats, unbox = make_command('stats', 'Stats'), make_command('unbox', 'Unbox')
+        signature = CommandTreeManager.signature(FakeTree(stats, unbox))
+        # The order the commands were added in doesn't matter
+        assert signature == CommandTreeManager.signature(FakeTree(unbox, stats))
+        assert signature != CommandTreeManager.signature(FakeTree(stats, make_command('unbox', 'Open')))
+
+    def test_sync_only_when_changed(self):
+        database = Database(backend=SQLiteBackend(':memory:'))
+        manager = CommandTreeManager(database, 'command_tree')
+        tree = FakeTree(make_command('stats', 'Stats'))
+
+        async def main():
+            assert await manager.sync(tree)
+            # A restart with the same commands
+            assert not await manager.sync(tree)
+            tree.commands.append(make_command('unbox', 'Unbox'))
+            assert await manager.sync(tree)
+            # Guilds are synced separately
+            assert await manager.sync(tree, guild=discord.Object(id=1))
+            await database.close()
+
+        asyncio.run(main())
+        assert tree.syncs == 3
@@ -0,0 +1,123 @@
+import asyncio
+import threading
+from time import sleep
+
+import pytest
+
+from src.subsystems.sys_firebase import Database
+from src.subsystems.sys_sqlite import SQLiteBackend
+
+
+class SlowDatabase(Database):
+    """ Database whose reads block for a while instead of calling Firebase """
+
+    def __init__(self, delay: float, **kwargs):
+        super().__init__(**kwargs)
+        self.delay = delay
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def read(self, path):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        sleep(self.delay)
+        with self._lock:
+            self.running -= 1
+        return {'path': path}
+
+
+class TestDatabase():
+
+    def test_read_async(self):
+        database = SlowDatabase(delay=0.01)
+        assert asyncio.run(database.read_async('twitch_users')) == {'path': 'twitch_users'}
+        asyncio.run(database.close())
+
+    def test_read_async_does_not_block_loop(self):
+        database = SlowDatabase(delay=0.2)
+
+        async def main():
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+
+            ticker = asyncio.ensure_future(tick())
+            await database.read_async('bot_settings')
+            ticker.cancel()
+            return ticks
+
+        assert asyncio.run(main()) > 5
+        asyncio.run(database.close())
+
+    def test_timeout(self):
+        database = SlowDatabase(delay=0.5, timeout=0.05)
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(database.read_async('bot_settings'))
+        asyncio.run(database.close())
+
+    def test_concurrency_cap(self):
+        database = SlowDatabase(delay=0.05, max_workers=2)
+
+        async def main():
+            return await asyncio.gather(*(database.read_async(str(i)) for i in range(8)))
+
+        results = asyncio.run(main())
+        assert len(results) == 8
+        assert database.max_running <= 2
+        asyncio.run(database.close())
+
+
+class CountingBackend(SQLiteBackend):
+    """ In-memory SQLite backend that counts the pages it reads """
+
+    def __init__(self, data: dict):
+        super().__init__(':memory:')
+        self.update('twitch_users', data)
+        self.pages = 0
+
+    def get_page(self, path, limit, start_at=None, from_end=False):
+        self.pages += 1
+        return super().get_page(path, limit, start_at, from_end)
+
+
+class TestPagination():
+
+    def test_keys_order(self):
+        database = Database(backend=CountingBackend({'b': 1, '10': 2, 'a': 3, '9': 4}))
+        assert database.keys('twitch_users') == ['9', '10', 'a', 'b']
+        asyncio.run(database.close())
+
+    def test_read_page(self):
+        database = Database(backend=CountingBackend({f"key{i:02}": i for i in range(10)}))
+        assert database.read_page('twitch_users', 3) == {'key00': 0, 'key01': 1, 'key02': 2}
+        assert database.read_page('twitch_users', 3, start_after='key02') == \
+            {'key03': 3, 'key04': 4, 'key05': 5}
+        assert database.read_page('twitch_users', 3, from_end=True) == \
+            {'key07': 7, 'key08': 8, 'key09': 9}
+        assert database.read_page('twitch_users', 3, start_after='key07', from_end=True) == \
+            {'key04': 4, 'key05': 5, 'key06': 6}
+        asyncio.run(database.close())
+
+    def test_iter_children(self):
+        data = {f"key{i:02}": i for i in range(25)}
+        backend = CountingBackend(data)
+        database = Database(backend=backend)
+        assert dict(database.iter_children('twitch_users', page_size=10)) == data
+        assert backend.pages == 3
+
+        async def main():
+            return [item async for item in database.iter_children_async('twitch_users', page_size=5)]
+
+        assert dict(asyncio.run(main())) == data
+        asyncio.run(database.close())
+
+    def test_iter_children_empty(self):
+        database = Database(backend=CountingBackend({}))
+        assert list(database.iter_children('twitch_users')) == []
+        asyncio.run(database.close())
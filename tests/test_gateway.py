@@ -0,0 +1,31 @@
+from src.utils.gateway import gateway_options
+from src.utils.helper import Helper
+
+
+class TestGateway():
+
+    def test_full_mode(self):
+        options = gateway_options(False)
+        assert options['intents'].presences
+        assert options['intents'].members
+        assert options['chunk_guilds_at_startup']
+
+    def test_lean_mode(self):
+        options = gateway_options(True)
+        intents = options['intents']
+        assert intents.message_content and intents.guild_messages and intents.voice_states
+        assert not intents.presences and not intents.members and not intents.typing
+        assert options['member_cache_flags'].voice
+        assert not options['member_cache_flags'].joined
+        assert not options['chunk_guilds_at_startup']
+
+    def test_lean_member_cache(self):
+        # Joined members can only be cached with the members intent
+        assert not gateway_options(True, member_cache=['joined'])['member_cache_flags'].joined
+        flags = gateway_options(True, member_intent=True, member_cache=['joined'])['member_cache_flags']
+        assert flags.joined and not flags.voice
+        assert gateway_options(True, member_cache=[])['member_cache_flags'].value == 0
+
+    def test_peak_rss(self):
+        rss = Helper.get_peak_rss_mb()
+        assert rss is None or rss > 0
@@ -0,0 +1,119 @@
+import asyncio
+
+from src.managers.guild_manager import GuildManager
+
+
+class FakeDatabase():
+    """ Stand-in for the Database subsystem that records its calls """
+
+    def __init__(self, data=None, fail=False):
+        self.data = data
+        self.fail = fail
+        self.reads = 0
+        self.updates = []
+
+    async def read_async(self, path):
+        self.reads += 1
+        if self.fail:
+            raise ConnectionError("Database is down")
+        return self.data
+
+    async def update_async(self, path, data, wait=False):
+        self.updates.append((path, data))
+
+
+class TestGuildManager():
+
+    def test_load_and_get(self):
+        database = FakeDatabase({
+            '1': {'settings': {'prefix': '!', 'greeting_user_ids': '10,11',
+                               'notification_channel_id': '100', 'disabled_commands': ['rtd']}},
+            '2': {'settings': {'greeting_user_ids': ''}},
+            '3': 'not a guild',
+        })
+        manager = GuildManager(database, 'guilds', default_greeting_user_ids=['99'],
+                               default_notification_channel_id=200)
+        assert asyncio.run(manager.load()) is True
+        assert manager.get_prefix(1) == '!'
+        assert manager.get_prefix(2) is None
+        assert manager.get_prefix(None) is None
+        assert manager.prefixes == {'!'}
+        assert manager.greeting_user_ids(1) == {'10', '11'}
+        # An empty list is a choice, a missing one falls back to the default
+        assert manager.greeting_user_ids(2) == set()
+        assert manager.greeting_user_ids(3) == {'99'}
+        assert manager.notification_channel_ids() == [100, 200]
+        assert manager.is_enabled(1, 'rtd') is False
+        assert manager.is_enabled(2, 'rtd') is True
+        assert manager.is_enabled(None, 'rtd') is True
+        assert manager.needs_reload() is False
+
+    def test_updates_store_one_guild(self):
+        database = FakeDatabase({})
+        changes = []
+        manager = GuildManager(database, 'guilds', on_change=changes.append)
+        asyncio.run(manager.load())
+
+        asyncio.run(manager.set_prefix(5, '$'))
+        asyncio.run(manager.set_command_enabled(5, 'rtd', False))
+        asyncio.run(manager.set_greeting_user_ids(5, [30, 20]))
+        asyncio.run(manager.set_notification_channel(6, 300))
+        assert database.updates == [
+            ('guilds/5/settings', {'prefix': '$'}),
+            ('guilds/5/settings', {'disabled_commands': ['rtd']}),
+            ('guilds/5/settings', {'greeting_user_ids': '20,30'}),
+            ('guilds/6/settings', {'notification_channel_id': 300}),
+        ]
+        assert manager.get_prefix(5) == '$'
+        assert changes[-1] == {'$'}
+        assert manager.is_enabled(5, 'rtd') is False
+        assert manager.is_enabled(6, 'rtd') is True
+        assert manager.greeting_user_ids(5) == {'20', '30'}
+        assert manager.notification_channel_ids() == [300]
+
+        asyncio.run(manager.set_command_enabled(5, 'rtd', True))
+        assert database.updates[-1] == ('guilds/5/settings', {'disabled_commands': None})
+        assert manager.is_enabled(5, 'rtd') is True
+        # Nothing was read again
+        assert database.reads == 1
+
+    def test_notifications_off_in_the_default_channel(self):
+        database = FakeDatabase({})
+        manager = GuildManager(database, 'guilds', default_notification_channel_id=200)
+        asyncio.run(manager.load())
+        # Another guild turning them off doesn't affect the default channel
+        asyncio.run(manager.set_notification_channel(5, None))
+        assert manager.notification_channel_ids() == [200]
+
+        asyncio.run(manager.set_notification_channel(6, None, has_default_channel=True))
+        assert database.updates[-1] == ('guilds/6/settings', {'notification_channel_id': None,
+                                                              'has_default_channel': True})
+        assert manager.notification_channel_ids() == []
+
+        # Survives a reload
+        manager = GuildManager(FakeDatabase({'6': {'settings': {'has_default_channel': True}}}),
+                               'guilds', default_notification_channel_id=200)
+        asyncio.run(manager.load())
+        assert manager.notification_channel_ids() == []
+
+    def test_other_channel_replaces_the_default(self):
+        manager = GuildManager(FakeDatabase({}), 'guilds', default_notification_channel_id=200)
+        asyncio.run(manager.load())
+        asyncio.run(manager.set_notification_channel(5, 300))
+        assert manager.notification_channel_ids() == [200, 300]
+        # The guild that has the default channel picks another one
+        asyncio.run(manager.set_notification_channel(6, 400, has_default_channel=True))
+        assert manager.notification_channel_ids() == [300, 400]
+        # and picking it again keeps it once
+        asyncio.run(manager.set_notification_channel(6, 200, has_default_channel=True))
+        assert manager.notification_channel_ids() == [200, 300]
+
+    def test_negative_cache(self):
+        database = FakeDatabase(fail=True)
+        manager = GuildManager(database, 'guilds', retry_after=60.0)
+        assert asyncio.run(manager.load()) is False
+        assert manager.get_prefix(1) is None
+        assert manager.needs_reload() is False
+
+        manager.retry_after = 0.0
+        assert manager.needs_reload() is True
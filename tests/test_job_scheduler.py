@@ -0,0 +1,156 @@
+import asyncio
+
+import pytest
+
+from src.utils.job_scheduler import JobScheduler
+
+
+class TestJobScheduler():
+
+    def test_runs_every_interval(self):
+        async def run():
+            scheduler = JobScheduler()
+            calls = []
+
+            async def job():
+                calls.append(1)
+
+            scheduler.add('job', job, 0.02)
+            scheduler.start()
+            await asyncio.sleep(0.07)
+            await scheduler.stop()
+            stats = scheduler.jobs['job'].stats
+            # Right away, then every interval
+            assert 3 <= len(calls) <= 4
+            assert stats['runs'] == len(calls)
+            assert stats['failures'] == 0
+        asyncio.run(run())
+
+    def test_waits_until_started_and_ready(self):
+        async def run():
+            ready = asyncio.Event()
+            scheduler = JobScheduler(wait=ready.wait)
+            calls = []
+
+            async def job():
+                calls.append(1)
+
+            scheduler.add('job', job, 10.0)
+            await asyncio.sleep(0.01)
+            assert calls == []
+            scheduler.start()
+            await asyncio.sleep(0.01)
+            assert calls == []
+            ready.set()
+            await asyncio.sleep(0.01)
+            assert calls == [1]
+            await scheduler.stop()
+        asyncio.run(run())
+
+    def test_skips_overlapping_runs(self):
+        async def run():
+            scheduler = JobScheduler()
+            running = []
+
+            async def slow():
+                running.append(1)
+                assert len(running) == 1
+                await asyncio.sleep(0.05)
+                running.pop()
+
+            scheduler.add('slow', slow, 0.02)
+            scheduler.start()
+            await asyncio.sleep(0.09)
+            await scheduler.stop()
+            stats = scheduler.jobs['slow'].stats
+            assert stats['skipped'] >= 2
+            assert stats['failures'] == 0
+        asyncio.run(run())
+
+    def test_records_failures_and_timeouts(self):
+        async def run():
+            scheduler = JobScheduler()
+
+            async def broken():
+                raise ValueError("no")
+
+            async def stuck():
+                await asyncio.sleep(10)
+
+            scheduler.add('broken', broken, 10.0)
+            scheduler.add('stuck', stuck, 10.0, timeout=0.01)
+            scheduler.start()
+            await asyncio.sleep(0.05)
+            await scheduler.stop()
+
+            broken_stats = scheduler.jobs['broken'].stats
+            assert broken_stats['failures'] == 1
+            assert broken_stats['last_error'] == "ValueError: no"
+            stuck_stats = scheduler.jobs['stuck'].stats
+            assert stuck_stats['failures'] == 1
+            assert stuck_stats['timeouts'] == 1
+            assert stuck_stats['last_error'] == "timed out after 0.01s"
+            assert scheduler.jobs['stuck'].history[-1].duration >= 0.01
+        asyncio.run(run())
+
+    def test_overruns(self):
+        async def run():
+            scheduler = JobScheduler()
+
+            async def slow():
+                await asyncio.sleep(0.02)
+
+            scheduler.add('slow', slow, 10.0, max_runtime=0.01)
+            scheduler.start()
+            await asyncio.sleep(0.05)
+            await scheduler.stop()
+            stats = scheduler.jobs['slow'].stats
+            assert stats['overruns'] == 1
+            assert stats['failures'] == 0
+            assert stats['max_ms'] >= 20
+        asyncio.run(run())
+
+    def test_leader_only(self):
+        async def run():
+            leader = [False]
+            scheduler = JobScheduler(is_leader=lambda: leader[0])
+            calls = []
+
+            async def job():
+                calls.append('leader')
+
+            async def everywhere():
+                calls.append('everywhere')
+
+            scheduler.add('job', job, 0.02, leader_only=True)
+            scheduler.add('everywhere', everywhere, 10.0)
+            scheduler.start()
+            await asyncio.sleep(0.01)
+            assert calls == ['everywhere']
+            leader[0] = True
+            await asyncio.sleep(0.03)
+            await scheduler.stop()
+            assert 'leader' in calls
+        asyncio.run(run())
+
+    def test_add_and_remove(self):
+        async def run():
+            scheduler = JobScheduler()
+            calls = []
+
+            async def job():
+                calls.append(1)
+                await asyncio.sleep(10)
+
+            scheduler.start()
+            # Added after start(), so it starts right away
+            scheduler.add('job', job, 10.0)
+            await asyncio.sleep(0.01)
+            assert calls == [1]
+            assert scheduler.jobs['job'].running is True
+            with pytest.raises(ValueError):
+                scheduler.add('job', job, 10.0)
+            scheduler.remove('job')
+            assert 'job' not in scheduler.jobs
+            await scheduler.stop()
+        asyncio.run(run())
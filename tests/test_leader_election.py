@@ -0,0 +1,89 @@
+import asyncio
+
+from src.subsystems.sys_firebase import Database
+from src.subsystems.sys_sqlite import SQLiteBackend
+from src.utils.leader_election import (DatabaseLeaseStore, LeaderElection,
+                                       LocalLeaseStore)
+
+
+class FailingStore(LocalLeaseStore):
+    """ A lease store that can be taken down """
+
+    def __init__(self, clock):
+        super().__init__(clock)
+        self.down = False
+
+    async def try_acquire(self, name, holder, duration):
+        if self.down:
+            raise ConnectionError("Database is down")
+        return await super().try_acquire(name, holder, duration)
+
+
+class TestLeaderElection():
+
+    def test_one_leader(self):
+        now = [1000.0]
+        store = LocalLeaseStore(clock=lambda: now[0])
+        first = LeaderElection(store, 'jobs', holder='a', duration=30)
+        second = LeaderElection(store, 'jobs', holder='b', duration=30)
+        assert asyncio.run(first.check()) is True
+        assert asyncio.run(second.check()) is False
+        # Renewing keeps the lease
+        now[0] += 20
+        assert asyncio.run(first.check()) is True
+        now[0] += 20
+        assert asyncio.run(second.check()) is False
+
+    def test_fail_over_after_lease(self):
+        now = [1000.0]
+        store = LocalLeaseStore(clock=lambda: now[0])
+        changes = []
+        first = LeaderElection(store, 'jobs', holder='a', duration=30)
+        second = LeaderElection(store, 'jobs', holder='b', duration=30, on_change=changes.append)
+        asyncio.run(first.check())
+        # The leader stops renewing, e.g. because it died
+        now[0] += 29
+        assert asyncio.run(second.check()) is False
+        now[0] += 2
+        assert asyncio.run(second.check()) is True
+        assert changes == [True]
+
+    def test_release_hands_over(self):
+        store = LocalLeaseStore()
+        first = LeaderElection(store, 'jobs', holder='a')
+        second = LeaderElection(store, 'jobs', holder='b')
+        asyncio.run(first.check())
+        asyncio.run(first.stop())
+        assert first.is_leader is False
+        assert asyncio.run(second.check()) is True
+
+    def test_steps_down_when_lease_may_expire(self, monkeypatch):
+        clock = [1000.0]
+        monkeypatch.setattr('src.utils.leader_election.monotonic', lambda: clock[0])
+        store = FailingStore(clock=lambda: clock[0])
+        election = LeaderElection(store, 'jobs', holder='a', duration=30)
+        assert asyncio.run(election.check()) is True
+        store.down = True
+        clock[0] += 10
+        # Still within the lease it holds
+        assert asyncio.run(election.check()) is True
+        # Steps down before the lease expires, in case the other machines' clocks are ahead
+        clock[0] += 16
+        assert asyncio.run(election.check()) is False
+
+    def test_database_store(self):
+        database = Database(backend=SQLiteBackend(':memory:'), write_behind=False)
+        store = DatabaseLeaseStore(database, 'leases')
+
+        async def main():
+            assert await store.try_acquire('jobs', 'a', 30) is True
+            assert await store.try_acquire('jobs', 'b', 30) is False
+            assert (await database.read_async('leases/jobs'))['holder'] == 'a'
+            await store.release('jobs', 'b')
+            assert await store.try_acquire('jobs', 'b', 30) is False
+            await store.release('jobs', 'a')
+            assert await database.read_async('leases/jobs') is None
+            assert await store.try_acquire('jobs', 'b', 30) is True
+            await database.close()
+
+        asyncio.run(main())
@@ -0,0 +1,89 @@
+import gzip
+import json
+import logging
+import threading
+
+import pytest
+
+from log import Logger, _CustomLogger
+
+
+@pytest.fixture
+def set_level():
+    """ Sets the level of the bot's logger for one test, then restores it """
+    logger = Logger._logger.logger
+    original = logger.level
+    yield logger.setLevel
+    logger.setLevel(original)
+
+
+class TestLogger():
+
+    def test_disabled_level_is_lazy(self, set_level):
+        set_level(logging.CRITICAL)
+        calls = 0
+
+        def message():
+            nonlocal calls
+            calls += 1
+            return "expensive"
+
+        Logger.DEBUG(message)
+        Logger.DEBUG("%s", message)
+        assert calls == 0
+        assert Logger.is_enabled_for(logging.DEBUG) is False
+        assert Logger.is_enabled_for(logging.CRITICAL) is True
+
+    def test_enabled_level_formats(self, caplog, set_level):
+        set_level(logging.DEBUG)
+        Logger.DEBUG("matches: %s", [1, 2])
+        Logger.DEBUG(lambda: "computed")
+        Logger.DEBUG("100%")
+        assert [record.getMessage() for record in caplog.records] == ["matches: [1, 2]", "computed", "100%"]
+
+    def test_disabled_debug_skips_formatting(self, set_level):
+        set_level(logging.CRITICAL)
+        formatted = 0
+
+        class Matches(list):
+            def __repr__(self):
+                nonlocal formatted
+                formatted += 1
+                return super().__repr__()
+
+        matches = Matches({'championName': 'Ahri', 'kills': i, 'deaths': 2, 'assists': 9} for i in range(10))
+        for _ in range(100):
+            Logger.DEBUG(f"matches: {matches}")
+        # Counts formatting rather than timing it, which is noisy on CI
+        assert formatted == 100
+        for _ in range(100):
+            Logger.DEBUG("matches: %s", matches)
+        assert formatted == 100
+
+    def test_queue_and_json_rotation(self, tmp_path):
+        json_path = tmp_path / 'bot.log.jsonl'
+        logger = _CustomLogger(name='test_json', use_queue=True, json_path=str(json_path),
+                               max_bytes=300, backup_count=2, compress=True)
+        logger.logger.setLevel(logging.DEBUG)
+        logger.logger.propagate = False
+        threads = set()
+
+        class ThreadRecorder(logging.Handler):
+            def emit(self, record):
+                threads.add(threading.get_ident())
+
+        logger.listener.handlers += (ThreadRecorder(),)
+        for i in range(20):
+            logger.info("message %d", i)
+        logger.stop()
+
+        # The records were written by the listener's thread, not this one
+        assert threading.get_ident() not in threads
+        lines = json_path.read_text().splitlines()
+        entries = [json.loads(line) for line in lines]
+        assert entries[-1]['message'] == "message 19"
+        assert entries[-1]['level'] == "INFO"
+        rotated = sorted(tmp_path.glob('bot.log.jsonl.*.gz'))
+        assert len(rotated) == 2
+        with gzip.open(rotated[0], 'rt') as f:
+            assert json.loads(f.readline())['message'].startswith("message")
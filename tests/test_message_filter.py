@@ -0,0 +1,40 @@
+from src.utils.message_filter import MessagePrefilter
+
+
+class TestMessagePrefilter():
+
+    def test_prefixes(self):
+        prefilter = MessagePrefilter(['>', '!!'])
+        assert prefilter.matches(">help")
+        assert prefilter.matches("!!stats")
+        assert not prefilter.matches("!stats")
+        assert not prefilter.matches("hello >help")
+        assert not prefilter.matches("")
+
+    def test_mention_prefix(self):
+        prefilter = MessagePrefilter(['>'])
+        assert not prefilter.matches("<@1234> help")
+        prefilter.set_user_id(1234)
+        assert prefilter.matches("<@1234> help")
+        assert prefilter.matches("<@!1234> help")
+        assert not prefilter.matches("<@4321> help")
+
+    def test_set_prefixes(self):
+        prefilter = MessagePrefilter(['>'])
+        prefilter.set_prefixes(['?'])
+        assert prefilter.matches("?help")
+        assert not prefilter.matches(">help")
+
+    def test_special_characters_are_escaped(self):
+        prefilter = MessagePrefilter(['.', '$'])
+        assert prefilter.matches(".help")
+        assert prefilter.matches("$help")
+        assert not prefilter.matches("help")
+
+    def test_check_counts(self):
+        prefilter = MessagePrefilter(['>'])
+        assert prefilter.check(">help")
+        assert not prefilter.check("just chatting")
+        assert not prefilter.check(">help", is_bot=True)
+        assert prefilter.check("hey bot", mentioned=True)
+        assert prefilter.stats == {'checked': 4, 'skipped': 2, 'passed': 2}
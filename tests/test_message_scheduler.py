@@ -0,0 +1,108 @@
+import asyncio
+
+from src.utils.message_scheduler import (BACKGROUND, INTERACTIVE,
+                                         MessageScheduler, TokenBucket)
+
+
+class FakeChannel():
+    """ Stand-in for a channel that records what it sends """
+
+    def __init__(self, channel_id=1):
+        self.id = channel_id
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+        return len(self.sent)
+
+
+class TestTokenBucket():
+
+    def test_delay(self):
+        now = [0.0]
+        bucket = TokenBucket(5, 5.0, clock=lambda: now[0])
+        for _ in range(5):
+            assert bucket.delay() == 0
+            bucket.take()
+        assert bucket.delay() == 1.0
+        now[0] += 0.5
+        assert bucket.delay() == 0.5
+        now[0] += 10
+        # Never holds more than its capacity
+        for _ in range(5):
+            bucket.take()
+        assert bucket.delay() == 1.0
+
+
+class TestMessageScheduler():
+
+    def test_merges_adjacent_messages(self):
+        scheduler = MessageScheduler()
+        channel = FakeChannel()
+
+        async def main():
+            return await asyncio.gather(*(scheduler.submit(channel, f"@user{i}") for i in range(3)))
+
+        # Every caller gets the one message that was sent
+        assert asyncio.run(main()) == [1, 1, 1]
+        assert channel.sent == ["@user0\n@user1\n@user2"]
+        assert scheduler.stats['sent'] == 1
+        assert scheduler.stats['merged'] == 2
+
+    def test_does_not_merge_past_limit_or_with_embeds(self):
+        scheduler = MessageScheduler()
+        channel = FakeChannel()
+
+        async def main():
+            await asyncio.gather(scheduler.submit(channel, "a" * 1500),
+                                 scheduler.submit(channel, "b" * 600),
+                                 scheduler.submit(channel, "c", embed=object()),
+                                 scheduler.submit(channel, "d"),
+                                 scheduler.submit(channel, "e", merge=False),
+                                 scheduler.submit(channel, "f"))
+
+        asyncio.run(main())
+        assert channel.sent == ["a" * 1500, "b" * 600, "c", "d", "e", "f"]
+
+    def test_interactive_before_background(self):
+        scheduler = MessageScheduler()
+        channel = FakeChannel()
+
+        async def main():
+            await asyncio.gather(scheduler.submit(channel, "live!", BACKGROUND),
+                                 scheduler.submit(channel, "pong", INTERACTIVE, embed=None),
+                                 scheduler.submit(channel, "pong 2", INTERACTIVE, embed=None))
+
+        asyncio.run(main())
+        assert channel.sent == ["pong", "pong 2", "live!"]
+
+    def test_rate_limited_per_channel(self):
+        scheduler = MessageScheduler(capacity=2, per=0.2)
+        first, second = FakeChannel(1), FakeChannel(2)
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            await asyncio.gather(*(scheduler.submit(first, str(i), embed=None) for i in range(4)),
+                                 *(scheduler.submit(second, str(i), embed=None) for i in range(2)))
+            return loop.time() - start
+
+        elapsed = asyncio.run(main())
+        assert first.sent == ["0", "1", "2", "3"]
+        assert second.sent == ["0", "1"]
+        # Two had to wait for a token each, in parallel with the other channel
+        assert 0.15 < elapsed < 0.5
+        assert scheduler.stats['queued'] == 0
+
+    def test_errors_reach_callers(self):
+        scheduler = MessageScheduler()
+
+        class BrokenChannel(FakeChannel):
+            async def send(self, content=None, **kwargs):
+                raise RuntimeError("Forbidden")
+
+        async def main():
+            return await asyncio.gather(scheduler.submit(BrokenChannel(), "hi"),
+                                        return_exceptions=True)
+
+        assert isinstance(asyncio.run(main())[0], RuntimeError)
@@ -0,0 +1,97 @@
+import asyncio
+
+from src.managers.prefix_manager import PrefixManager
+
+
+class FakeDatabase():
+    """ Stand-in for the Database subsystem that counts its calls """
+
+    def __init__(self, data=None, fail=False):
+        self.data = data
+        self.fail = fail
+        self.reads = 0
+        self.writes = 0
+
+    async def read_async(self, path):
+        self.reads += 1
+        if self.fail:
+            raise ConnectionError("Database is down")
+        return self.data
+
+    async def add_async(self, path, data, wait=False):
+        self.writes += 1
+        self.data = {'key1': data}
+        return 'key1'
+
+    async def update_async(self, path, data, wait=False):
+        self.writes += 1
+        self.data.update(data)
+
+
+class TestPrefixManager():
+
+    def test_load_and_get(self):
+        database = FakeDatabase({
+            'key1': {'cmd_prefix': '!'},
+            'key2': {'cmd_prefix': '$', 'guild_id': '42'},
+        })
+        manager = PrefixManager(database, 'bot_settings')
+        assert asyncio.run(manager.load()) is True
+        assert manager.get_prefix(42) == '$'
+        assert manager.get_prefix(7) == '!'
+        assert manager.get_prefix() == '!'
+        assert manager.prefixes == {'!', '$'}
+        assert manager.needs_reload() is False
+
+    def test_creates_default_prefix_once(self):
+        database = FakeDatabase()
+        manager = PrefixManager(database, 'bot_settings', default_prefix='>')
+        asyncio.run(manager.load())
+        assert database.writes == 1
+        assert database.data == {'key1': {'cmd_prefix': '>'}}
+        for _ in range(10):
+            assert manager.get_prefix(1) == '>'
+        assert database.reads == 1
+
+    def test_set_prefix(self):
+        database = FakeDatabase({'key1': {'cmd_prefix': '>'}})
+        manager = PrefixManager(database, 'bot_settings')
+        asyncio.run(manager.load())
+        asyncio.run(manager.set_prefix('?'))
+        assert manager.get_prefix(1) == '?'
+        assert database.data == {'key1': {'cmd_prefix': '?'}}
+
+    def test_negative_cache(self):
+        database = FakeDatabase(fail=True)
+        manager = PrefixManager(database, 'bot_settings', retry_after=60.0)
+        assert asyncio.run(manager.load()) is False
+        assert manager.get_prefix(1) == '>'
+        # The failure is cached, so nothing is read or written until retry_after passes
+        assert manager.needs_reload() is False
+        assert database.writes == 0
+
+        manager.retry_after = 0.0
+        assert manager.needs_reload() is True
+
+    def test_refresh_after(self, monkeypatch):
+        database = FakeDatabase({'key1': {'cmd_prefix': '>'}})
+        manager = PrefixManager(database, 'bot_settings', refresh_after=30)
+        now = [1000.0]
+        monkeypatch.setattr('src.managers.prefix_manager.monotonic', lambda: now[0])
+        asyncio.run(manager.load())
+        assert manager.needs_reload() is False
+
+        # Another process changed the prefix
+        database.data = {'key1': {'cmd_prefix': '!'}}
+        now[0] += 30
+        assert manager.needs_reload() is True
+        asyncio.run(manager.load())
+        assert manager.get_prefix() == '!'
+
+        # A failed refresh keeps the table and waits retry_after before the next
+        database.fail = True
+        now[0] += 30
+        asyncio.run(manager.load())
+        assert manager.get_prefix() == '!'
+        now[0] += 30
+        assert manager.needs_reload() is False
@@ -0,0 +1,156 @@
+from src.subsystems.replica import MISSING, Replica, _Index
+
+
+class Event():
+    """ Same shape as the events firebase_admin passes to listeners """
+
+    def __init__(self, event_type, path, data):
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+
+class Registration():
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestReplica():
+
+    def listen(self, replica):
+        """ Starts the replica and returns the callbacks by path """
+        callbacks = {}
+
+        def listen(path, callback):
+            callbacks[path] = callback
+            return Registration()
+
+        replica.start(listen)
+        return callbacks
+
+    def test_not_replicated(self):
+        replica = Replica(['twitch_users'])
+        assert replica.get('twitch_users') is MISSING
+        assert replica.get('bot_settings') is MISSING
+        assert not replica.covers('twitch_users')
+
+    def test_events(self):
+        replica = Replica(['twitch_users', 'bot_settings'])
+        callbacks = self.listen(replica)
+        callbacks['twitch_users'](Event('put', '/', {'k1': {'user': 'a', 'user_id': '1'}}))
+        assert replica.covers('twitch_users/k1')
+        assert replica.get('twitch_users') == {'k1': {'user': 'a', 'user_id': '1'}}
+        assert not replica.synced
+
+        callbacks['bot_settings'](Event('put', '/', None))
+        assert replica.synced
+        assert replica.get('bot_settings') is None
+
+        callbacks['twitch_users'](Event('patch', '/k1', {'user': 'b'}))
+        callbacks['twitch_users'](Event('put', '/k2', {'user': 'c', 'user_id': '3'}))
+        assert replica.get('twitch_users/k1/user') == 'b'
+        assert replica.get('/twitch_users/k2/') == {'user': 'c', 'user_id': '3'}
+
+        callbacks['twitch_users'](Event('put', '/k1', None))
+        assert replica.get('twitch_users/k1') is None
+        assert list(replica.get('twitch_users')) == ['k2']
+
+    def test_reads_are_copies(self):
+        replica = Replica(['twitch_users'])
+        self.listen(replica)['twitch_users'](Event('put', '/', {'k1': {'user': 'a'}}))
+        replica.get('twitch_users')['k1']['user'] = 'changed'
+        assert replica.get('twitch_users/k1/user') == 'a'
+
+    def test_apply(self):
+        replica = Replica(['twitch_users'])
+        replica.apply('twitch_users/k1', {'user': 'a'})
+        # Nothing to apply the write to before the data is loaded
+        assert replica.get('twitch_users') is MISSING
+
+        self.listen(replica)['twitch_users'](Event('put', '/', None))
+        replica.apply('twitch_users/k1', {'user': 'a'})
+        assert replica.get('twitch_users') == {'k1': {'user': 'a'}}
+        replica.apply('twitch_users/k1', None)
+        assert replica.get('twitch_users') is None
+
+    def test_snapshot(self, tmp_path):
+        snapshot_path = str(tmp_path / "replica.json")
+        replica = Replica(['twitch_users'], snapshot_path=snapshot_path)
+        self.listen(replica)['twitch_users'](Event('put', '/', {'k1': {'user': 'a'}}))
+        replica.stop()
+
+        restarted = Replica(['twitch_users', 'bot_settings'], snapshot_path=snapshot_path)
+        assert restarted.load_snapshot()
+        assert restarted.get('twitch_users/k1') == {'user': 'a'}
+        assert restarted.get('bot_settings') is MISSING
+        assert not restarted.synced
+
+    def test_find(self):
+        replica = Replica(['twitch_users'])
+        callbacks = self.listen(replica)
+        assert replica.find('twitch_users', 'user', 'a') is MISSING
+
+        callbacks['twitch_users'](Event('put', '/', {
+            'k1': {'user': 'a', 'user_id': '1'},
+            'k2': {'user': 'b', 'user_id': '2'},
+        }))
+        assert replica.find('twitch_users', 'user', 'b') == ('k2', {'user': 'b', 'user_id': '2'})
+        assert replica.find('twitch_users', 'user_id', '1') == ('k1', {'user': 'a', 'user_id': '1'})
+        assert replica.find('twitch_users', 'user', 'c') is None
+
+        # The index follows changes
+        callbacks['twitch_users'](Event('patch', '/k2', {'user': 'c'}))
+        assert replica.find('twitch_users', 'user', 'b') is None
+        assert replica.find('twitch_users', 'user', 'c')[0] == 'k2'
+        replica.apply('twitch_users/k1', None)
+        assert replica.find('twitch_users', 'user_id', '1') is None
+
+    def test_find_updates_index(self, monkeypatch):
+        replica = Replica(['twitch_users'])
+        callbacks = self.listen(replica)
+        callbacks['twitch_users'](Event('put', '/', {
+            'k1': {'user': 'a'},
+            'k2': {'user': 'a'},
+        }))
+        builds = []
+        build = _Index.build
+        monkeypatch.setattr(_Index, 'build', lambda index, node: builds.append(1) or build(index, node))
+        assert replica.find('twitch_users', 'user', 'a')[0] == 'k1'
+
+        # Writes below the indexed path update it in place
+        replica.apply('twitch_users/k1/user', 'b')
+        assert replica.find('twitch_users', 'user', 'a')[0] == 'k2'
+        callbacks['twitch_users'](Event('put', '/k3', {'user': 'c'}))
+        assert replica.find('twitch_users', 'user', 'c')[0] == 'k3'
+        replica.apply('twitch_users/k2', None)
+        assert replica.find('twitch_users', 'user', 'a') is None
+        assert len(builds) == 1
+
+        # Replacing the whole node rebuilds it
+        callbacks['twitch_users'](Event('put', '/', {'k4': {'user': 'a'}}))
+        assert replica.find('twitch_users', 'user', 'a')[0] == 'k4'
+        assert replica.find('twitch_users', 'user', 'b') is None
+        assert len(builds) == 2
+
+    def test_keys_and_page(self):
+        replica = Replica(['twitch_users'])
+        assert replica.keys('twitch_users') is MISSING
+        assert replica.page('twitch_users', 3) is MISSING
+        callbacks = self.listen(replica)
+        data = {key: {'n': key} for key in ('b', '10', 'a', '9', 'c')}
+        callbacks['twitch_users'](Event('put', '/', data))
+
+        assert replica.keys('twitch_users') == ['9', '10', 'a', 'b', 'c']
+        assert list(replica.page('twitch_users', 2)) == ['9', '10']
+        assert list(replica.page('twitch_users', 2, start_after='10')) == ['a', 'b']
+        assert list(replica.page('twitch_users', 2, from_end=True)) == ['b', 'c']
+        assert list(replica.page('twitch_users', 2, start_after='a', from_end=True)) == ['9', '10']
+        assert replica.page('twitch_users/a/n', 2) == {}
+
+        page = replica.page('twitch_users', 1)
+        page['9']['n'] = 'changed'
+        assert replica.get('twitch_users/9') == {'n': '9'}
@@ -0,0 +1,96 @@
+import asyncio
+import threading
+from time import sleep
+
+import pytest
+
+from src.utils.single_flight import SingleFlight
+
+
+class TestSingleFlight():
+
+    def test_do_merges_concurrent_calls(self):
+        flight = SingleFlight()
+        calls = []
+
+        def fetch(name):
+            calls.append(name)
+            sleep(0.1)
+            return {'name': name}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('a', fetch, 'a')))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert calls == ['a']
+        assert results == [{'name': 'a'}] * 5
+        assert flight.stats == {'calls': 1, 'merged': 4}
+        # The call is over, so the next one is made again
+        flight.do('a', fetch, 'a')
+        assert calls == ['a', 'a']
+
+    def test_do_shares_errors(self):
+        flight = SingleFlight()
+
+        def fail():
+            sleep(0.05)
+            raise ValueError("down")
+
+        errors = []
+
+        def call():
+            try:
+                flight.do('a', fail)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(errors) == 3
+        assert flight.calls == 1
+
+    def test_do_async(self):
+        flight = SingleFlight()
+        calls = 0
+
+        async def fetch(key):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return key
+
+        async def main():
+            return await asyncio.gather(*(flight.do_async(key, fetch, key) for key in 'aabab'))
+
+        assert asyncio.run(main()) == list('aabab')
+        assert calls == 2
+        assert flight.stats == {'calls': 2, 'merged': 3}
+
+    def test_do_async_cancelled_caller(self):
+        flight = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return 'data'
+
+        async def main():
+            first = asyncio.ensure_future(flight.do_async('a', fetch))
+            second = asyncio.ensure_future(flight.do_async('a', fetch))
+            await asyncio.sleep(0)
+            first.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await first
+            return await second
+
+        assert asyncio.run(main()) == 'data'
+
+    def test_registry(self):
+        flight = SingleFlight('TestRegistry')
+        assert SingleFlight.registry['TestRegistry'] is flight
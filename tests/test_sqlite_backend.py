@@ -0,0 +1,78 @@
+import asyncio
+
+from src.subsystems.sys_firebase import Database
+from src.subsystems.sys_sqlite import SQLiteBackend
+
+
+class TestSQLiteBackend():
+
+    def test_set_and_get(self):
+        backend = SQLiteBackend(':memory:')
+        backend.update('twitch_users', {'key1': {'user': 'a', 'user_id': 1, 'is_live': False}})
+        assert backend.get('twitch_users') == {'key1': {'user': 'a', 'user_id': 1, 'is_live': False}}
+        assert backend.get('twitch_users/key1/user') == 'a'
+        assert backend.get('missing') is None
+        backend.close()
+
+    def test_update_replaces_children(self):
+        backend = SQLiteBackend(':memory:')
+        backend.update('bot_settings', {'key1': {'cmd_prefix': '>', 'guild_id': '1'}})
+        backend.update('bot_settings', {'key1': {'cmd_prefix': '?'}})
+        assert backend.get('bot_settings') == {'key1': {'cmd_prefix': '?'}}
+        # A leaf is replaced by a subtree written below it
+        backend.update('bot_settings/key1/cmd_prefix', {'value': '!'})
+        assert backend.get('bot_settings/key1') == {'cmd_prefix': {'value': '!'}}
+        backend.close()
+
+    def test_multi_location_update(self):
+        backend = SQLiteBackend(':memory:')
+        backend.update('/', {'a/x': 1, 'b/y': {'z': 2}, 'c': None})
+        assert backend.get('/') == {'a': {'x': 1}, 'b': {'y': {'z': 2}}}
+        backend.update('/', {'a/x': None})
+        assert backend.get('/') == {'b': {'y': {'z': 2}}}
+        backend.close()
+
+    def test_delete(self):
+        backend = SQLiteBackend(':memory:')
+        backend.update('twitch_users', {'key1': {'user': 'a'}, 'key10': {'user': 'b'}})
+        backend.delete('twitch_users/key1')
+        assert backend.get('twitch_users') == {'key10': {'user': 'b'}}
+        backend.close()
+
+    def test_keys_and_query(self):
+        backend = SQLiteBackend(':memory:')
+        backend.update('twitch_users', {
+            'key1': {'user': 'a', 'user_id': 1},
+            'key2': {'user': 'b', 'user_id': 2, 'nested': {'user': 'a'}},
+        })
+        assert sorted(backend.get_keys('twitch_users')) == ['key1', 'key2']
+        assert backend.get_keys('/') == ['twitch_users']
+        assert backend.query_by_child('twitch_users', 'user', 'a') == {'key1': {'user': 'a', 'user_id': 1}}
+        # Values are compared with their type, like Firebase does
+        assert backend.query_by_child('twitch_users', 'user_id', '2') == {}
+        assert list(backend.query_by_child('twitch_users', 'user_id', 2)) == ['key2']
+        backend.close()
+
+    def test_persists(self, tmp_path):
+        file_path = str(tmp_path / 'database.sqlite3')
+        backend = SQLiteBackend(file_path)
+        backend.update('bot_settings', {'key1': {'cmd_prefix': '>'}})
+        backend.close()
+        backend = SQLiteBackend(file_path)
+        assert backend.get('bot_settings') == {'key1': {'cmd_prefix': '>'}}
+        backend.close()
+
+    def test_database_with_write_buffer(self):
+        database = Database(write_behind=True, backend=SQLiteBackend(':memory:'))
+
+        async def main():
+            key = await database.add_async('twitch_users', {'user': 'a', 'user_id': 1})
+            await database.update_async('twitch_users', {key: {'user': 'b', 'user_id': 1}})
+            found = await database.find_by_child_async('twitch_users', 'user', 'b')
+            await database.delete_async('twitch_users', key)
+            return key, found, await database.read_async('twitch_users')
+
+        key, found, remaining = asyncio.run(main())
+        assert found == (key, {'user': 'b', 'user_id': 1})
+        assert remaining is None
+        asyncio.run(database.close())
@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+import pytest
+
+from src.utils.startup import StartupGraph
+
+
+class TestStartupGraph():
+
+    def test_independent_steps_run_concurrently(self):
+        graph = StartupGraph()
+        order = []
+
+        def blocking(name):
+            def step():
+                time.sleep(0.2)
+                order.append(name)
+            return step
+
+        async def last():
+            order.append('last')
+
+        graph.add('a', blocking('a'))
+        graph.add('b', blocking('b'))
+        graph.add('last', last, depends=['a', 'b'])
+        started = time.perf_counter()
+        asyncio.run(graph.run())
+        assert time.perf_counter() - started < 0.35
+        assert sorted(order[:2]) == ['a', 'b'] and order[2] == 'last'
+        assert [name for name, _, _ in graph.timings] == ['a', 'b', 'last']
+        assert 'last' in graph.report()
+
+    def test_results_and_steps_added_while_running(self):
+        graph = StartupGraph()
+
+        async def parent():
+            graph.add('child', lambda: graph.results['parent'] + 1, depends=['parent'])
+            return 1
+
+        graph.add('parent', parent)
+        asyncio.run(graph.run())
+        assert graph.results == {'parent': 1, 'child': 2}
+
+        # Only new steps run the next time
+        graph.add('later', lambda: 3, depends=['child'])
+        asyncio.run(graph.run())
+        assert graph.results['later'] == 3
+
+    def test_optional_step_failure(self):
+        graph = StartupGraph()
+
+        def warmup():
+            raise ConnectionError
+
+        graph.add('warmup', warmup, optional=True)
+        graph.add('after', lambda: 'ok', depends=['warmup'])
+        asyncio.run(graph.run())
+        assert graph.results['after'] == 'ok'
+        assert '(failed)' in graph.report()
+
+    def test_required_step_failure(self):
+        graph = StartupGraph()
+        ran = []
+
+        def auth():
+            raise ValueError('bad credentials')
+
+        graph.add('auth', auth)
+        graph.add('database', lambda: ran.append('database'), depends=['auth'])
+        with pytest.raises(ValueError):
+            asyncio.run(graph.run())
+        assert ran == []
+
+    def test_missing_dependency(self):
+        graph = StartupGraph()
+        graph.add('bot', lambda: None, depends=['database'])
+        with pytest.raises(RuntimeError):
+            asyncio.run(graph.run())
+        with pytest.raises(ValueError):
+            graph.add('bot', lambda: None)
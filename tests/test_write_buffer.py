@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+
+from src.subsystems.write_buffer import WriteBuffer
+from src.utils.push_key import generate_push_key
+
+
+class Recorder():
+    """ Collects the updates committed by a WriteBuffer """
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.commits = []
+
+    async def __call__(self, updates):
+        if self.fail:
+            raise ConnectionError("Database is down")
+        self.commits.append(updates)
+
+
+class TestWriteBuffer():
+
+    def test_merges_writes_into_one_commit(self):
+        recorder = Recorder()
+
+        async def main():
+            buffer = WriteBuffer(recorder, flush_interval=0.01)
+            for i in range(10):
+                buffer.set(f"twitch_users/user{i}", {'user': f"user{i}"})
+            await asyncio.sleep(0.05)
+
+        asyncio.run(main())
+        assert len(recorder.commits) == 1
+        assert len(recorder.commits[0]) == 10
+
+    def test_flushes_at_max_batch(self):
+        recorder = Recorder()
+
+        async def main():
+            buffer = WriteBuffer(recorder, flush_interval=10.0, max_batch=3)
+            for i in range(3):
+                buffer.set(f"a/{i}", i)
+            await asyncio.sleep(0.01)
+            return buffer
+
+        buffer = asyncio.run(main())
+        assert recorder.commits == [{'a/0': 0, 'a/1': 1, 'a/2': 2}]
+        assert len(buffer) == 0
+
+    def test_merges_overlapping_paths(self):
+        recorder = Recorder()
+
+        async def main():
+            buffer = WriteBuffer(recorder, flush_interval=10.0)
+            buffer.set("settings/key1/cmd_prefix", '!')
+            buffer.set("settings/key1", {'cmd_prefix': '>'})
+            buffer.set("settings/key1/guild_id", 42)
+            buffer.set("/users/abc/", {'user': 'abc'})
+            buffer.set("users/abc", None)
+            await buffer.flush()
+
+        asyncio.run(main())
+        assert recorder.commits == [{
+            'settings/key1': {'cmd_prefix': '>', 'guild_id': 42},
+            'users/abc': None,
+        }]
+
+    def test_failed_commit_keeps_writes(self):
+        recorder = Recorder(fail=True)
+
+        async def main():
+            buffer = WriteBuffer(recorder, flush_interval=10.0)
+            buffer.set("a/b", 1)
+            with pytest.raises(ConnectionError):
+                await buffer.flush()
+            recorder.fail = False
+            await buffer.flush()
+
+        asyncio.run(main())
+        assert recorder.commits == [{'a/b': 1}]
+
+    def test_journal_survives_crash(self, tmp_path):
+        journal_path = str(tmp_path / "journal.jsonl")
+
+        async def crash():
+            buffer = WriteBuffer(Recorder(fail=True), journal_path=journal_path,
+                                 flush_interval=10.0)
+            buffer.set("a/b", 1)
+            buffer.set("a/c", {'d': 2})
+            # Journaled by the flush, though the commit fails
+            with pytest.raises(ConnectionError):
+                await buffer.flush()
+
+        asyncio.run(crash())
+
+        recorder = Recorder()
+
+        async def restart():
+            buffer = WriteBuffer(recorder, journal_path=journal_path)
+            assert len(buffer) == 2
+            await buffer.close()
+
+        asyncio.run(restart())
+        assert recorder.commits == [{'a/b': 1, 'a/c': {'d': 2}}]
+        with open(journal_path) as f:
+            assert f.read() == ''
+
+    def test_drops_rejected_writes(self):
+        recorder = Recorder()
+
+        async def commit(updates):
+            if any('.' in path for path in updates):
+                raise ValueError("Invalid key")
+            await recorder(updates)
+
+        async def main():
+            buffer = WriteBuffer(commit, flush_interval=10.0)
+            written = [buffer.set(f"a/{i}", i) for i in range(3)]
+            rejected = buffer.set("a/b.c", 1)
+            written.append(buffer.set("a/4", 4))
+            await buffer.flush()
+            await asyncio.gather(*written)
+            with pytest.raises(ValueError):
+                await rejected
+            # Not retried
+            buffer.set("a/5", 5)
+            await buffer.flush()
+
+        asyncio.run(main())
+        assert recorder.commits == [{'a/0': 0, 'a/1': 1}, {'a/2': 2}, {'a/4': 4}, {'a/5': 5}]
+
+    def test_written_waits_for_retry(self):
+        recorder = Recorder(fail=True)
+
+        async def main():
+            buffer = WriteBuffer(recorder, flush_interval=10.0)
+            written = buffer.set("a/b", 1)
+            with pytest.raises(ConnectionError):
+                await buffer.flush()
+            assert not written.done()
+            # Folded into the pending write above it
+            below = buffer.set("a/b/c", 2)
+            recorder.fail = False
+            await buffer.flush()
+            await asyncio.gather(written, below)
+
+        asyncio.run(main())
+        assert recorder.commits == [{'a/b': {'c': 2}}]
+
+
+class TestPushKey():
+
+    def test_keys_are_unique_and_ordered(self):
+        keys = [generate_push_key() for _ in range(1000)]
+        assert len(set(keys)) == 1000
+        assert keys == sorted(keys)
+        assert all(len(key) == 20 for key in keys)